@@ -34,3 +34,6 @@ for col_id, root in tw.forest_walker():
     for node, parent in tw.tree_walker(root):
         # This returns a dict with information about the node
         ni = tw.node_info(node=node, parent=parent)
+
+# Or only get the over-threshold leaves of the (str5, int10) tree
+leaves = tw.get_forest_nodes(combinations=[["str5", "int10"]], node_type="leaf", over_threshold=True)
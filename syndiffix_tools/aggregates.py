@@ -0,0 +1,99 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Name of the column in a marginals table that says which column a row counts
+MARGINAL_COLUMN = "__marginal__"
+
+
+def _decode_dictionaries(table: pa.Table) -> pa.Table:
+    # Dictionary columns (pandas Categorical, as written with compact_dtypes)
+    # become plain values, so that results have the same dtypes and are
+    # sorted by value rather than in dictionary order, however they are made
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, pc.cast(table.column(i), field.type.value_type))
+    return table
+
+
+def _bin_column(column: pa.ChunkedArray, bins) -> pa.Array:
+    ''' Replaces each value with the lower edge of its bin. bins is either the
+        number of equal-width bins or a list of bin edges. Values outside of
+        explicit edges become null.
+    '''
+    is_temporal = pa.types.is_timestamp(column.type) or pa.types.is_date(column.type)
+    if is_temporal:
+        values = pc.cast(column, pa.int64()).to_numpy(zero_copy_only=False).astype(np.float64)
+    else:
+        values = column.to_numpy(zero_copy_only=False).astype(np.float64)
+    # nulls become NaN, which are kept as nulls
+    null_mask = np.isnan(values)
+    if isinstance(bins, int):
+        edges = np.histogram_bin_edges(values[~null_mask], bins=bins)
+    else:
+        edges = np.asarray(bins, dtype=np.float64)
+    index = np.searchsorted(edges, values, side="right") - 1
+    # the last edge is inclusive, as with numpy.histogram
+    index[values == edges[-1]] = len(edges) - 2
+    null_mask |= (index < 0) | (index > len(edges) - 2)
+    lower_edges = edges[np.clip(index, 0, len(edges) - 2)]
+    if is_temporal:
+        return pa.array(lower_edges.astype(np.int64), mask=null_mask).cast(column.type)
+    return pa.array(lower_edges, mask=null_mask)
+
+
+def aggregate_table(
+    table: pa.Table, columns: list, bins: Optional[dict] = None, sum_column: str = None
+) -> pd.DataFrame:
+    ''' Groups table by columns and returns the row count ('count') per
+        group, and the sum of sum_column ('sum') if given. bins maps column
+        names to a number of bins or to a list of bin edges.
+    '''
+    table = _decode_dictionaries(table.select(columns + ([sum_column] if sum_column is not None else [])))
+    if bins:
+        for col, col_bins in bins.items():
+            index = table.schema.get_field_index(col)
+            table = table.set_column(index, col, _bin_column(table.column(col), col_bins))
+    aggregations = [([], "count_all")]
+    if sum_column is not None:
+        aggregations.append((sum_column, "sum"))
+    result = table.group_by(columns).aggregate(aggregations)
+    result = result.rename_columns(
+        [name if name != "count_all" else "count" for name in result.column_names]
+    )
+    if sum_column is not None:
+        result = result.rename_columns(
+            [name if name != sum_column + "_sum" else "sum" for name in result.column_names]
+        )
+    result = result.select(columns + ["count"] + (["sum"] if sum_column is not None else []))
+    return result.to_pandas().sort_values(columns, ignore_index=True)
+
+
+def make_marginals_table(table: pa.Table) -> pa.Table:
+    ''' Builds the 1-dim counts of every column into a single table. The
+        MARGINAL_COLUMN column says which column each row counts, and the
+        other columns are null.
+    '''
+    marginals = []
+    for col in table.column_names:
+        marginal = table.select([col]).group_by([col]).aggregate([([], "count_all")])
+        marginal = marginal.rename_columns([col, "count"])
+        marginal = marginal.append_column(MARGINAL_COLUMN, pa.array([col] * marginal.num_rows, pa.string()))
+        marginals.append(marginal)
+    return pa.concat_tables(marginals, promote_options="default")
+
+
+def put_marginals(file_path: Path, df: pd.DataFrame) -> None:
+    pq.write_table(make_marginals_table(pa.Table.from_pandas(df, preserve_index=False)), file_path)
+
+
+def get_marginal(file_path: Path, column: str) -> pd.DataFrame:
+    marginals = pq.read_table(file_path, columns=[column, "count", MARGINAL_COLUMN])
+    marginal = marginals.filter(pc.equal(marginals[MARGINAL_COLUMN], column))
+    marginal = _decode_dictionaries(marginal.select([column, "count"]))
+    return marginal.to_pandas().sort_values([column], ignore_index=True)
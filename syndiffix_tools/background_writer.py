@@ -0,0 +1,128 @@
+import atexit
+import os
+import queue
+import threading
+import weakref
+from typing import Callable, Optional
+
+
+def _flush_at_exit(writer_ref: weakref.ref) -> None:
+    writer = writer_ref()
+    if writer is not None:
+        writer._queue.join()
+
+
+class BackgroundWriteError(RuntimeError):
+    ''' A write task failed. task_name names the task (normally the data file
+        name of the table being written), and __cause__ is the original error.
+    '''
+
+    def __init__(self, task_name: Optional[str], error: BaseException) -> None:
+        super().__init__(f"Background write of {task_name} failed: {error!r}")
+        self.task_name = task_name
+
+
+class BackgroundWriter:
+    """
+    Runs write tasks (functions) one at a time, in order, on a background
+    thread, so that serializing and writing outputs overlaps with further
+    computation. At most max_pending tasks wait in the queue; submitting more
+    blocks until there is room, which bounds the memory held by pending
+    outputs.
+
+    An error raised by a task is kept as a BackgroundWriteError with the name
+    of the task, and raised by the next call to check or flush (or taken with
+    take_errors or take_error). Submitting never raises an earlier task's
+    error. Later tasks still run. Pending tasks are finished at interpreter
+    exit. In a forked child process (see run_isolated) the thread does not
+    exist, so tasks run synchronously there.
+
+    Inputs:
+        - max_pending: int. The maximum number of tasks waiting in the queue.
+    """
+
+    def __init__(self, max_pending: int = 4) -> None:
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._errors = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(_flush_at_exit, weakref.ref(self))
+
+    def _run(self) -> None:
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                func, task_name, args, kwargs = task
+                try:
+                    func(*args, **kwargs)
+                except BaseException as e:
+                    error = BackgroundWriteError(task_name, e)
+                    error.__cause__ = e
+                    with self._lock:
+                        self._errors.append(error)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func: Callable, *args, task_name: Optional[str] = None, **kwargs) -> None:
+        ''' Queues func(*args, **kwargs), blocking while the queue is full.
+            task_name identifies the task in its error, if it fails.
+        '''
+        if os.getpid() != self._pid:
+            func(*args, **kwargs)
+            return
+        self._queue.put((func, task_name, args, kwargs))
+
+    def wait(self) -> None:
+        ''' Waits until all queued tasks are done, without raising their errors.
+        '''
+        if os.getpid() != self._pid:
+            return
+        self._queue.join()
+
+    def take_errors(self) -> list:
+        ''' Returns and forgets the errors of the tasks that failed so far.
+        '''
+        with self._lock:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def take_error(self, task_name: str) -> Optional[BackgroundWriteError]:
+        ''' Returns and forgets the first error of the tasks named task_name,
+            leaving the errors of other tasks to be raised elsewhere.
+        '''
+        with self._lock:
+            for i, error in enumerate(self._errors):
+                if error.task_name == task_name:
+                    return self._errors.pop(i)
+        return None
+
+    def check(self) -> None:
+        ''' Raises the first error of a task that failed so far, if any,
+            without waiting for the queued tasks.
+        '''
+        with self._lock:
+            error = self._errors.pop(0) if len(self._errors) > 0 else None
+        if error is not None:
+            raise error
+
+    def flush(self) -> None:
+        ''' Waits until all queued tasks are done, and raises the first error
+            of a task that failed so far, if any.
+        '''
+        self.wait()
+        self.check()
+
+    def close(self) -> None:
+        ''' Flushes and stops the thread.
+        '''
+        if os.getpid() != self._pid:
+            return
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
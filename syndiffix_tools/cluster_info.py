@@ -12,6 +12,15 @@ class ClusterInfo:
 
     def __init__(self, sdx: Synthesizer) -> None:
         self.sdx = sdx
+        # Map column names to column indices once, rather than searching
+        # forest.columns for every column of every cluster.
+        self.column_ids = {name: ColumnId(i) for i, name in enumerate(self.sdx.forest.columns)}
+
+    def _get_column_id(self, column_name: str) -> ColumnId:
+        try:
+            return self.column_ids[column_name]
+        except KeyError:
+            raise ValueError(f"Column {column_name} not found.")
 
     def put_initial_cluster(self, cluster: list[str], final: bool = False) -> None:
         ''' The cluster is a list of column names.
@@ -23,13 +32,8 @@ class ClusterInfo:
         if len(cluster) == 0:
             raise ValueError("Cluster must contain at least one column.")
         # Convert the list of names into a list of column indices
-        self.sdx.clusters.initial_cluster = []
-        for column_name in cluster:
-            try:
-                column_id = self.sdx.forest.columns.index(column_name)
-            except:
-                raise ValueError(f"Column {column_name} not found.")
-            self.sdx.clusters.initial_cluster.append(ColumnId(column_id))
+        # Clusters is a frozen dataclass, so the list is replaced in place
+        self.sdx.clusters.initial_cluster[:] = [self._get_column_id(column_name) for column_name in cluster]
         self._check_clusters(final)
 
     def put_derived_cluster(self, owner: str = 'shared',
@@ -57,17 +61,9 @@ class ClusterInfo:
         else:
             raise ValueError(f"Owner {owner} not recognized. Must be 'shared', 'left', or 'right'.")
         for column_name in stitch_columns:
-            try:
-                column_id = self.sdx.forest.columns.index(column_name)
-            except:
-                raise ValueError(f"Column {column_name} not found.")
-            derived_cluster[self.STITCH_COLUMNS].append(ColumnId(column_id))
+            derived_cluster[self.STITCH_COLUMNS].append(self._get_column_id(column_name))
         for column_name in derived_columns:
-            try:
-                column_id = self.sdx.forest.columns.index(column_name)
-            except:
-                raise ValueError(f"Column {column_name} not found.")
-            derived_cluster[self.DERIVED_COLUMNS].append(ColumnId(column_id))
+            derived_cluster[self.DERIVED_COLUMNS].append(self._get_column_id(column_name))
         self.sdx.clusters.derived_clusters.append(derived_cluster)
         self._check_clusters(final)
 
@@ -124,3 +120,25 @@ class ClusterInfo:
                 }
             )
         return cluster_info
+
+    def get_cluster_plan(self) -> dict:
+        """Returns the clusters in a form that can be stored as JSON and
+        later re-applied with PlannedClustering. Columns are recorded by name
+        so that the plan does not depend on column order.
+        """
+        columns = self.sdx.forest.columns
+        derived_clusters = []
+        for cluster in self.sdx.clusters.derived_clusters:
+            derived_clusters.append(
+                [
+                    cluster[self.STITCH_OWNER].name.lower(),
+                    [columns[i] for i in cluster[self.STITCH_COLUMNS]],
+                    [columns[i] for i in cluster[self.DERIVED_COLUMNS]],
+                ]
+            )
+        return {
+            "columns": list(columns),
+            "initial_cluster": [columns[i] for i in self.sdx.clusters.initial_cluster],
+            "derived_clusters": derived_clusters,
+            "entropy_1dim": [float(e) for e in self.sdx.entropy_1dim],
+        }
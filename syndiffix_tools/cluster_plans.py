@@ -0,0 +1,110 @@
+import json
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from syndiffix.clustering.common import Clusters, ColumnId, Entropy1Dim, StitchOwner
+from syndiffix.clustering.strategy import ClusteringStrategy
+from syndiffix.forest import Forest
+
+from syndiffix_tools.common_tasks import make_data_file_name
+
+OWNERS = {
+    "shared": StitchOwner.SHARED,
+    "left": StitchOwner.LEFT,
+    "right": StitchOwner.RIGHT,
+}
+
+
+class PlannedClustering(ClusteringStrategy):
+    """
+    A clustering strategy that applies a stored cluster plan (as produced by
+    ClusterInfo.get_cluster_plan) instead of measuring column dependence.
+
+    Inputs:
+        - plan: dict. The cluster plan. Its columns must be the same as the
+              columns being synthesized, though not necessarily in the same order.
+    """
+
+    def __init__(self, plan: dict) -> None:
+        self.plan = plan
+
+    def build_clusters(self, forest: Forest) -> tuple[Clusters, Entropy1Dim]:
+        column_ids = {name: ColumnId(i) for i, name in enumerate(forest.columns)}
+        if len(column_ids) != len(self.plan["columns"]) or not all(
+            col in column_ids for col in self.plan["columns"]
+        ):
+            raise ValueError("Cluster plan columns do not match the synthesized columns.")
+
+        def to_ids(names: list) -> list[ColumnId]:
+            try:
+                return [column_ids[name] for name in names]
+            except KeyError as e:
+                raise ValueError(f"Column {e.args[0]} not found.")
+
+        checker = [False] * len(column_ids)
+        initial_cluster = to_ids(self.plan["initial_cluster"])
+        for column_id in initial_cluster:
+            if checker[column_id]:
+                raise ValueError(f"Duplicate column detected (initial) {column_id}")
+            checker[column_id] = True
+        derived_clusters = []
+        for owner, stitch_columns, derived_columns in self.plan["derived_clusters"]:
+            if owner not in OWNERS:
+                raise ValueError(f"Owner {owner} not recognized. Must be 'shared', 'left', or 'right'.")
+            stitch_ids = to_ids(stitch_columns)
+            derived_ids = to_ids(derived_columns)
+            for column_id in stitch_ids:
+                if not checker[column_id]:
+                    raise ValueError(f"Stitch column not in prior cluster {column_id}.")
+            for column_id in derived_ids:
+                if checker[column_id]:
+                    raise ValueError(f"Duplicate column detected (derived) {column_id}")
+                checker[column_id] = True
+            derived_clusters.append((OWNERS[owner], stitch_ids, derived_ids))
+        if not all(checker):
+            raise ValueError(f"Column not in any cluster {checker.index(False)}")
+
+        # The entropies were recorded in plan column order
+        entropy_by_name = dict(zip(self.plan["columns"], self.plan["entropy_1dim"]))
+        entropy_1dim = np.array([entropy_by_name[name] for name in forest.columns], dtype=np.float64)
+        return Clusters(initial_cluster=initial_cluster, derived_clusters=derived_clusters), entropy_1dim
+
+
+class ClusterPlanStore:
+    """
+    Stores cluster plans as JSON files, keyed by the fingerprint of the
+    original dataset, the set of synthesized columns, and the target column.
+
+    Inputs:
+        - dir_path: str or Path. The directory where plans are stored. It is
+              created if it does not exist.
+    """
+
+    def __init__(self, dir_path: Union[str, Path]) -> None:
+        self.dir_path = Path(dir_path)
+        self.dir_path.mkdir(exist_ok=True)
+
+    def _plan_path(self, fingerprint: str, columns: list, target_column: str = None) -> Path:
+        plan_name = make_data_file_name(fingerprint, list(columns), target=target_column)
+        return Path(self.dir_path, "plan." + plan_name + ".json")
+
+    def get_plan(self, fingerprint: str, columns: list, target_column: str = None) -> Optional[dict]:
+        plan_path = self._plan_path(fingerprint, columns, target_column)
+        if not plan_path.exists():
+            return None
+        with plan_path.open("r") as file:
+            plan = json.load(file)
+        # Guard against name collisions
+        if sorted(plan["columns"]) != sorted(columns) or plan["target_column"] != target_column:
+            return None
+        return plan
+
+    def put_plan(self, fingerprint: str, plan: dict, target_column: str = None) -> None:
+        plan = dict(plan, fingerprint=fingerprint, target_column=target_column)
+        plan_path = self._plan_path(fingerprint, plan["columns"], target_column)
+        with plan_path.open("w") as file:
+            json.dump(plan, file, indent=4)
+
+    def remove_plan(self, fingerprint: str, columns: list, target_column: str = None) -> None:
+        self._plan_path(fingerprint, columns, target_column).unlink(missing_ok=True)
@@ -1,7 +1,12 @@
+import hashlib
+import io
+import os
 import random
+import shutil
 import string
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 
@@ -24,14 +29,154 @@ def put_csv_from_df(filePath: Path, df: pd.DataFrame) -> None:
     df.to_csv(filePath, index=False)
 
 
-def put_pq_from_df(filePath: Path, df: pd.DataFrame) -> None:
-    # Save to Parquet file
-    df.to_parquet(filePath, engine="pyarrow")
+# Named sets of pyarrow parquet write options. A use_dictionary of
+# "categorical" dictionary encodes the columns passed to put_pq_from_df as
+# dictionary_columns (normally those classified as categorical) and, as
+# pyarrow does by default, all string columns, but not the other columns
+# (mostly continuous numbers, where dictionaries only add size).
+# Statistics are written per row group so that readers can prune row groups.
+PQ_WRITE_PROFILES = {
+    "default": {},
+    "fast-read": {
+        "compression": "snappy",
+        "row_group_size": 64 * 1024,
+        "use_dictionary": "categorical",
+        "write_statistics": True,
+    },
+    "small": {
+        "compression": "zstd",
+        "compression_level": 9,
+        "row_group_size": 256 * 1024,
+        "use_dictionary": "categorical",
+        "write_statistics": True,
+    },
+    "archive": {
+        "compression": "zstd",
+        "compression_level": 19,
+        "row_group_size": 1024 * 1024,
+        "use_dictionary": "categorical",
+        "write_statistics": False,
+    },
+}
 
 
-def get_df_from_pq(filePath: Path) -> pd.DataFrame:
-    # Load from Parquet file
-    df = pd.read_parquet(filePath, engine="pyarrow")
+def _get_pq_write_options(df: pd.DataFrame, profile: str, dictionary_columns: list = None) -> dict:
+    if profile not in PQ_WRITE_PROFILES:
+        raise ValueError(f"Parquet write profile {profile} not recognized. Must be one of {list(PQ_WRITE_PROFILES)}.")
+    options = dict(PQ_WRITE_PROFILES[profile])
+    if options.get("use_dictionary") == "categorical":
+        if dictionary_columns is None:
+            dictionary_columns = []
+        options["use_dictionary"] = [
+            col for col in df.columns
+            if col in dictionary_columns or pd.api.types.is_string_dtype(df[col]) or
+            isinstance(df[col].dtype, pd.CategoricalDtype)
+        ]
+    return options
+
+
+def put_pq_from_df(
+    filePath: Path, df: pd.DataFrame, profile: str = "default", dictionary_columns: list = None
+) -> None:
+    # Save to Parquet file. The file is written under a temporary name and
+    # then renamed, so that readers never see a partially written file.
+    options = _get_pq_write_options(df, profile, dictionary_columns)
+    tmp_file_path = Path(filePath).with_name(Path(filePath).name + ".tmp")
+    df.to_parquet(tmp_file_path, engine="pyarrow", **options)
+    os.replace(tmp_file_path, filePath)
+
+
+def get_pq_bytes_from_df(df: pd.DataFrame, profile: str = "default", dictionary_columns: list = None) -> bytes:
+    # The bytes of a Parquet file, as put_pq_from_df would write it
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, engine="pyarrow", **_get_pq_write_options(df, profile, dictionary_columns))
+    return buffer.getvalue()
+
+
+def get_df_from_pq(filePath: Path, columns: list = None, filters: list = None) -> pd.DataFrame:
+    # Load from Parquet file. filters (pyarrow DNF form) skip the row groups
+    # whose statistics rule them out.
+    df = pd.read_parquet(filePath, engine="pyarrow", columns=columns, filters=filters)
+    return df
+
+
+def compact_df_dtypes(df: pd.DataFrame, column_classes: dict) -> pd.DataFrame:
+    # Returns a copy of df with smaller dtypes but the same values. String
+    # columns classified as categorical become pandas Categorical, and
+    # numeric columns are downcast where no value changes.
+    df = df.copy()
+    for col in df.columns:
+        dtype = df[col].dtype
+        if column_classes.get(col) == "categorical" and dtype == "object":
+            df[col] = df[col].astype("category")
+        elif pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+        elif dtype == "float64":
+            downcast = df[col].astype("float32")
+            if downcast.astype("float64").equals(df[col]):
+                df[col] = downcast
+    return df
+
+
+def restore_df_dtypes(df: pd.DataFrame, column_dtypes: dict) -> pd.DataFrame:
+    # Undoes compact_df_dtypes, using the dtypes recorded when the original
+    # data was first stored.
+    restore = {
+        col: column_dtypes[col]
+        for col in df.columns
+        if col in column_dtypes and str(df[col].dtype) != column_dtypes[col]
+    }
+    if len(restore) == 0:
+        return df
+    return df.astype(restore)
+
+
+def make_column_fingerprints(df: pd.DataFrame) -> dict:
+    # Content hash of each column of a dataframe, including its name and dtype.
+    fingerprints = {}
+    for col in df.columns:
+        hasher = hashlib.sha256()
+        hasher.update(str(col).encode())
+        hasher.update(str(df[col].dtype).encode())
+        hasher.update(pd.util.hash_pandas_object(df[col], index=False).values.tobytes())
+        fingerprints[col] = hasher.hexdigest()[:16]
+    return fingerprints
+
+
+def combine_fingerprints(fingerprints: dict) -> str:
+    # Single hash of the column fingerprints made by make_column_fingerprints.
+    hasher = hashlib.sha256()
+    for col, fingerprint in fingerprints.items():
+        hasher.update(str(col).encode())
+        hasher.update(fingerprint.encode())
+    return hasher.hexdigest()[:16]
+
+
+def make_df_fingerprint(df: pd.DataFrame) -> str:
+    # Content hash of a dataframe, including column names and dtypes.
+    return combine_fingerprints(make_column_fingerprints(df))
+
+
+def put_pq_replicates(
+    dirPath: Path, dfs: list, profile: str = "default", dictionary_columns: list = None
+) -> None:
+    # Save a list of dataframes as a hive-partitioned parquet dataset, with
+    # one partition per replicate (dirPath/replicate=<i>/part-0.parquet).
+    if Path(dirPath).exists():
+        shutil.rmtree(dirPath)
+    for replicate, df in enumerate(dfs):
+        partition_path = Path(dirPath, f"replicate={replicate}")
+        partition_path.mkdir(parents=True)
+        put_pq_from_df(Path(partition_path, "part-0.parquet"), df, profile=profile,
+                       dictionary_columns=dictionary_columns)
+
+
+def get_df_from_pq_replicates(dirPath: Path, replicate: int = None) -> pd.DataFrame:
+    # Load one replicate, or all replicates with an added 'replicate' column.
+    if replicate is not None:
+        return get_df_from_pq(Path(dirPath, f"replicate={replicate}", "part-0.parquet"))
+    df = pd.read_parquet(dirPath, engine="pyarrow")
+    df["replicate"] = df["replicate"].astype("int64")
     return df
 
 
@@ -78,7 +223,9 @@ def make_data_file_name(table: str, columns: list[str], target: str = None) -> s
         seed = table + "__".join(columns+ [target])
     else:
         seed = table + "__".join(columns)
-    random.seed(seed)
+    # A local generator, so that the global random state (possibly used by
+    # other threads) is left alone
+    rng = random.Random(seed)
     # append random alphanumeric characters
-    name += "." + "".join(random.choices(string.ascii_lowercase + string.digits, k=6))
+    name += "." + "".join(rng.choices(string.ascii_lowercase + string.digits, k=6))
     return name
@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import pandas as pd
+
+
+class FrameCache:
+    """
+    A least-recently-used cache of dataframes, bounded by the total memory
+    used by the cached dataframes. One FrameCache can be shared by several
+    readers so that they are all held to one memory budget.
+
+    Inputs:
+        - max_bytes: int. The memory budget. Dataframes larger than this are
+              never cached.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        with self._lock:
+            if key not in self._frames:
+                return None
+            self._frames.move_to_end(key)
+            return self._frames[key][0]
+
+    def put(self, key: Hashable, df: pd.DataFrame, num_bytes: Optional[int] = None) -> None:
+        # num_bytes can be given for values other than dataframes
+        if num_bytes is None:
+            num_bytes = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            self._remove(key)
+            if num_bytes > self.max_bytes:
+                return
+            while self.num_bytes + num_bytes > self.max_bytes:
+                self._remove(next(iter(self._frames)))
+            self._frames[key] = (df, num_bytes)
+            self.num_bytes += num_bytes
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+            self.num_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._frames
+
+    def _remove(self, key: Hashable) -> None:
+        if key in self._frames:
+            _, num_bytes = self._frames.pop(key)
+            self.num_bytes -= num_bytes
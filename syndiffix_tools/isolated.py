@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import traceback
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Optional
+
+# How often the RSS of the child process is checked
+RSS_POLL_INTERVAL = 0.1
+
+
+def _get_statm_bytes(pid: int, field: int) -> Optional[int]:
+    # Linux only. Returns None where /proc is not available.
+    try:
+        with open(f"/proc/{pid}/statm", "r") as file:
+            return int(file.read().split()[field]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _get_rss_bytes(pid: int) -> Optional[int]:
+    return _get_statm_bytes(pid, 1)
+
+
+def _get_address_space_bytes(pid: int) -> Optional[int]:
+    return _get_statm_bytes(pid, 0)
+
+
+def _limit_address_space(max_memory_bytes: int) -> None:
+    # A forked child starts with all of the parent's address space, so the
+    # limit is on top of that. Without /proc, only max_rss_bytes applies.
+    import resource
+
+    address_space_bytes = _get_address_space_bytes(os.getpid())
+    if address_space_bytes is None:
+        return
+    limit = address_space_bytes + max_memory_bytes
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+    if hard_limit != resource.RLIM_INFINITY:
+        limit = min(limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+
+
+def _child(conn, func: Callable, kwargs: dict, max_memory_bytes: Optional[int]) -> None:
+    if max_memory_bytes is not None:
+        _limit_address_space(max_memory_bytes)
+    try:
+        func(**kwargs)
+        conn.send(("ok", None))
+    except MemoryError:
+        conn.send(("out_of_memory", "MemoryError"))
+    except BaseException as e:
+        conn.send(("error", "".join(traceback.format_exception_only(type(e), e)).strip()))
+    finally:
+        conn.close()
+
+
+def run_isolated(
+    func: Callable,
+    kwargs: dict,
+    max_memory_bytes: Optional[int] = None,
+    max_rss_bytes: Optional[int] = None,
+    timeout: Optional[float] = None,
+    start_guard: Optional[ContextManager] = None,
+) -> dict:
+    ''' Runs func(**kwargs) in a child process and returns a dict with:
+        'status': 'ok', 'out_of_memory', 'timeout', or 'error'
+        'error': a description of the failure, or None
+        'elapsed_time': the wall-clock seconds the child ran
+        max_memory_bytes caps how much address space the child may add to
+        what it starts with (RLIMIT_AS), so that allocations beyond it raise
+        MemoryError. It limits virtual memory, which runs ahead of the memory
+        in use, and is not applied where /proc is not available.
+        max_rss_bytes is checked by polling the child's resident memory, and
+        the child is killed when it is exceeded. timeout is in seconds.
+        The child is forked where possible, so func and kwargs need not be
+        picklable and large inputs are shared copy-on-write. A fork copies
+        only the calling thread, so a lock held by another thread at the fork
+        stays locked in the child. start_guard, if given, is entered while
+        the child is started, for instance to keep other threads from
+        holding locks at that moment.
+    '''
+    method = "fork" if sys.platform != "win32" else "spawn"
+    ctx = multiprocessing.get_context(method)
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_child, args=(child_conn, func, kwargs, max_memory_bytes))
+    start_time = time.time()
+    with start_guard if start_guard is not None else nullcontext():
+        process.start()
+    child_conn.close()
+    status, error = None, None
+    while process.is_alive():
+        if parent_conn.poll(RSS_POLL_INTERVAL):
+            break
+        if timeout is not None and time.time() - start_time > timeout:
+            status, error = "timeout", f"Exceeded timeout of {timeout} seconds."
+            break
+        if max_rss_bytes is not None:
+            rss_bytes = _get_rss_bytes(process.pid)
+            if rss_bytes is not None and rss_bytes > max_rss_bytes:
+                status, error = "out_of_memory", f"Exceeded RSS limit of {max_rss_bytes} bytes."
+                break
+    if status is None and parent_conn.poll():
+        try:
+            status, error = parent_conn.recv()
+        except EOFError:
+            pass
+    if status == "ok":
+        # Let the child exit on its own once it has reported success
+        process.join(timeout=5.0)
+    if process.is_alive():
+        process.kill()
+    process.join()
+    if status is None:
+        if process.exitcode == -signal.SIGKILL:
+            # Most likely the kernel's out-of-memory killer
+            status, error = "out_of_memory", "Killed by SIGKILL."
+        else:
+            status, error = "error", f"Child process exited with code {process.exitcode}."
+    parent_conn.close()
+    return {"status": status, "error": error, "elapsed_time": time.time() - start_time}
@@ -0,0 +1,188 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from syndiffix import Synthesizer
+from syndiffix.microdata import TIMESTAMP_REFERENCE, RealConvertor, StringConvertor, TimestampConvertor
+from syndiffix.tree import Branch, Leaf
+
+from syndiffix_tools.tree_walker import TreeWalker
+
+
+def _has_strings(values: pd.Series) -> bool:
+    # Strings would be parsed as numbers by numpy, unlike by the convertors
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind in ("string", "bytes"):
+        return True
+    return kind.startswith("mixed") and values.map(lambda value: isinstance(value, (str, bytes))).any()
+
+
+class LeafIndex:
+    """
+    Indexes the leaves of a synthesizer's forest by their snapped intervals,
+    so that the leaves covering given points or intersecting a given box can
+    be found without scanning the node info of the whole forest.
+
+    The leaves of each tree (column combination) are held as two NumPy arrays
+    of interval minimums and maximums, one row per leaf. Points are located by
+    descending the tree itself, with the points of each node tested against
+    its children only, so a lookup costs about points x depth rather than
+    points x leaves. Query values are in the units of the original data, and are
+    converted to the forest's normalized units the same way SynDiffix
+    converts the original data, one column at a time.
+
+    Inputs:
+        - sdx: Synthesizer. A synthesizer whose forest has been built.
+        - combinations: only index the trees of these column combinations
+              (see TreeWalker.forest_walker). None for all trees.
+    """
+
+    def __init__(self, sdx: Synthesizer, combinations: Optional[list] = None) -> None:
+        self.sdx = sdx
+        self.tw = TreeWalker(sdx)
+        self.column_ids = {name: i for i, name in enumerate(sdx.forest.columns)}
+        self.roots = {}
+        self.leaves = {}
+        self.mins = {}
+        self.maxs = {}
+        for comb, root in self.tw.forest_walker(combinations):
+            self.roots[comb] = root
+            leaves = [node for node, _, _ in self.tw.filtered_tree_walker(root) if isinstance(node, Leaf)]
+            self.leaves[comb] = leaves
+            self.mins[comb] = np.array([[si.min for si in leaf.snapped_intervals] for leaf in leaves])
+            self.maxs[comb] = np.array([[si.max for si in leaf.snapped_intervals] for leaf in leaves])
+        self.node_ids = {comb: [self.tw._make_node_id(leaf) for leaf in leaves] for comb, leaves in self.leaves.items()}
+        self._leaf_numbers = {comb: {id(leaf): i for i, leaf in enumerate(leaves)} for comb, leaves in self.leaves.items()}
+        # The sorted strings of each string column, for lookups
+        self._value_indexes = {}
+
+    def convert_values(self, column: str, values) -> np.ndarray:
+        ''' Converts original values of a column to the forest's units. Nulls
+            take the column's null mapping, and strings that are not in the
+            original data become inf, which is in no leaf. Numbers of any type
+            are accepted for numeric and boolean columns, and anything that
+            pd.Timestamp accepts for datetime columns. Other values raise
+            ValueError.
+        '''
+        col_id = self.column_ids[column]
+        convertor = self.sdx.column_convertors[col_id]
+        values = pd.Series(values).reset_index(drop=True)
+        nulls = values.isna().to_numpy()
+        present = values[~nulls]
+        floats = np.zeros(len(values), dtype=np.float64)
+        unknown = np.zeros(len(values), dtype=bool)
+        if isinstance(convertor, StringConvertor):
+            if col_id not in self._value_indexes:
+                self._value_indexes[col_id] = pd.Index(convertor.value_map)
+            codes = self._value_indexes[col_id].get_indexer(present)
+            unknown[~nulls] = codes < 0
+            floats[~nulls] = np.maximum(codes, 0)
+        else:
+            floats[~nulls] = self._to_floats(column, convertor, present)
+        if convertor.scaler is not None:
+            floats = convertor.scaler.transform(floats.reshape(-1, 1)).flatten()
+        floats[nulls] = self.sdx.forest.null_mappings[col_id]
+        floats[unknown] = np.inf
+        return floats
+
+    def _to_floats(self, column: str, convertor, values: pd.Series) -> np.ndarray:
+        # The convertors assert the exact type of the original data, so the
+        # values are converted here the same way, from any compatible type
+        try:
+            if isinstance(convertor, TimestampConvertor):
+                timestamps = pd.to_datetime(values, format="mixed") if values.dtype == object else pd.to_datetime(values)
+                return ((timestamps - TIMESTAMP_REFERENCE) / pd.Timedelta(1, "s")).to_numpy(dtype=np.float64)
+            if values.dtype == object and _has_strings(values):
+                raise TypeError("not a number")
+            # Integers are not rounded, so that e.g. a bound of 2.5 stays
+            # between 2 and 3. Booleans are 0.0 and 1.0.
+            floats = values.to_numpy(dtype=np.float64)
+            if isinstance(convertor, RealConvertor):
+                # As RealConvertor.to_float, but np.round may differ from
+                # round in the last bit, which only matters for points
+                # exactly on a leaf boundary
+                floats = np.round(floats, convertor.final_round_precision)
+            return floats
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Values {values.head(3).tolist()!r} cannot be converted for column {column}.") from e
+
+    def _get_combinations(self, columns: list, combinations: Optional[list]) -> list:
+        if combinations is not None:
+            return [comb for comb in self.tw._normalize_combinations(combinations) if comb in self.leaves]
+        column_ids = set(self.column_ids[col] for col in columns if col in self.column_ids)
+        return [comb for comb in self.leaves if set(comb) <= column_ids]
+
+    def leaves_containing(self, df_points: pd.DataFrame, combinations: Optional[list] = None) -> pd.DataFrame:
+        ''' Finds the leaf of each tree that contains each point. df_points
+            has one point per row, in the original units. By default the trees
+            of all combinations of the columns of df_points are searched.
+            Returns a dataframe with columns 'row' (the df_points index),
+            'combination' and 'node_id', with one row per point and tree for
+            which there is a containing leaf.
+        '''
+        results = []
+        for comb in self._get_combinations(list(df_points.columns), combinations):
+            columns = [self.sdx.forest.columns[i] for i in comb]
+            points = np.column_stack([self.convert_values(col, df_points[col]) for col in columns])
+            point_index, leaf_index = self._descend(comb, points)
+            results.append(
+                pd.DataFrame(
+                    {
+                        "row": df_points.index[point_index],
+                        "combination": [comb] * len(point_index),
+                        "node_id": [self.node_ids[comb][i] for i in leaf_index],
+                    }
+                )
+            )
+        if len(results) == 0:
+            return pd.DataFrame({"row": [], "combination": [], "node_id": []})
+        return pd.concat(results, ignore_index=True)
+
+    def _descend(self, comb: tuple, points: np.ndarray) -> tuple:
+        # Routes the points down the tree, keeping at each node only those
+        # inside it. Returns the points found in leaves and their leaf numbers.
+        point_indexes, leaf_indexes = [], []
+        leaf_numbers = self._leaf_numbers[comb]
+        stack = [(self.roots[comb], np.arange(len(points)))]
+        while stack:
+            node, rows = stack.pop()
+            mins = np.array([si.min for si in node.snapped_intervals])
+            maxs = np.array([si.max for si in node.snapped_intervals])
+            node_points = points[rows]
+            # Same as Interval.contains_value, in every dimension
+            rows = rows[((node_points == mins) | ((node_points > mins) & (node_points < maxs))).all(axis=1)]
+            if len(rows) == 0:
+                continue
+            if isinstance(node, Branch):
+                stack.extend((child, rows) for child in node.children.values())
+            elif id(node) in leaf_numbers:
+                point_indexes.append(rows)
+                leaf_indexes.append(np.full(len(rows), leaf_numbers[id(node)]))
+        if len(point_indexes) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        point_index, leaf_index = np.concatenate(point_indexes), np.concatenate(leaf_indexes)
+        order = np.argsort(point_index, kind="stable")
+        return point_index[order], leaf_index[order]
+
+    def leaves_intersecting(self, box: dict, combinations: Optional[list] = None) -> pd.DataFrame:
+        ''' Finds the leaves that intersect a box. box maps column names to
+            closed (low, high) ranges in the original units. By default the
+            trees of all combinations of the box's columns are searched.
+            Returns a dataframe with columns 'combination' and 'node_id'.
+        '''
+        results = []
+        for comb in self._get_combinations(list(box.keys()), combinations):
+            columns = [self.sdx.forest.columns[i] for i in comb]
+            lows = np.array([self.convert_values(col, [box[col][0]])[0] for col in columns])
+            highs = np.array([self.convert_values(col, [box[col][1]])[0] for col in columns])
+            mins, maxs = self.mins[comb], self.maxs[comb]
+            intersects = ((mins <= highs) & ((maxs > lows) | (mins == lows))).all(axis=1)
+            node_ids = [self.node_ids[comb][i] for i in np.nonzero(intersects)[0]]
+            results.append(pd.DataFrame({"combination": [comb] * len(node_ids), "node_id": node_ids}))
+        if len(results) == 0:
+            return pd.DataFrame({"combination": [], "node_id": []})
+        return pd.concat(results, ignore_index=True)
+
+    def get_leaf_info(self, comb: tuple, node_id: str) -> dict:
+        leaf = self.leaves[comb][self.node_ids[comb].index(node_id)]
+        return self.tw.node_info(node=leaf)
@@ -0,0 +1,267 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS syn_tables (
+    name TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    target_column TEXT,
+    num_columns INTEGER,
+    rows INTEGER,
+    elapsed_time REAL,
+    num_clusters INTEGER,
+    max_cluster_size INTEGER,
+    created REAL,
+    meta_data TEXT NOT NULL,
+    stats TEXT
+);
+CREATE TABLE IF NOT EXISTS syn_table_columns (
+    column_name TEXT NOT NULL,
+    name TEXT NOT NULL REFERENCES syn_tables(name) ON DELETE CASCADE,
+    PRIMARY KEY (column_name, name)
+);
+CREATE INDEX IF NOT EXISTS syn_tables_target ON syn_tables(target_column);
+CREATE INDEX IF NOT EXISTS syn_tables_elapsed_time ON syn_tables(elapsed_time);
+CREATE INDEX IF NOT EXISTS syn_tables_num_columns ON syn_tables(num_columns);
+CREATE INDEX IF NOT EXISTS syn_tables_max_cluster_size ON syn_tables(max_cluster_size);
+CREATE INDEX IF NOT EXISTS syn_table_columns_name ON syn_table_columns(name);
+"""
+
+
+class Manifest:
+    """
+    A SQLite database with the metadata (and optionally the stats) of all
+    synthetic tables of a dataset directory, in place of the per-table
+    sidecar JSON files in syn/ and stats files in stats/. It is shared by
+    TablesBuilder, TablesManager and TablesReader.
+
+    Each table is one row, written in a single transaction together with its
+    columns, and the catalog is loaded with a single query. The columns,
+    target column, synthesis time, row count and cluster sizes are indexed,
+    so that questions like "all tables with target X that took over 10
+    minutes" do not scan the tables.
+
+    Table file paths are stored relative to the dataset directory.
+
+    Inputs:
+        - dir_path: str or Path. The dataset directory. The database is
+              manifest.sqlite in it, created on the first write.
+    """
+
+    FILE_NAME = "manifest.sqlite"
+
+    def __init__(self, dir_path: Union[str, Path]) -> None:
+        self.dir_path = Path(dir_path)
+        self.path = Path(self.dir_path, self.FILE_NAME)
+        self._initialized = False
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per operation, so that the manifest can be used from
+        # several threads and processes
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        if not self._initialized:
+            # WAL lets readers load the catalog while a synthesis is recorded
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+            self._initialized = True
+        return conn
+
+    def put_table(self, name: str, meta_data: dict, file_path: Path, stats: Optional[dict] = None) -> None:
+        ''' Adds or replaces a table, in one transaction.
+        '''
+        cluster_info = meta_data.get("cluster_info") or []
+        row = (
+            name,
+            Path(file_path).relative_to(self.dir_path).as_posix(),
+            meta_data.get("target_column"),
+            len(meta_data["columns"]),
+            meta_data.get("rows"),
+            meta_data.get("elapsed_time"),
+            len(cluster_info),
+            max((len(cluster["cluster_id"]) for cluster in cluster_info), default=None),
+            time.time(),
+            json.dumps(meta_data),
+            json.dumps(stats) if stats is not None else None,
+        )
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM syn_tables WHERE name = ?", (name,))
+                conn.execute("INSERT INTO syn_tables VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                conn.executemany(
+                    "INSERT INTO syn_table_columns VALUES (?, ?)", [(col, name) for col in meta_data["columns"]]
+                )
+        finally:
+            conn.close()
+
+    def put_meta_data(self, name: str, meta_data: dict) -> None:
+        ''' Replaces the metadata of a table that exists, keeping its file
+            path and stats. The indexed fields are not updated, so meta_data
+            may only add keys (like quality scores) that are not indexed.
+        '''
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE syn_tables SET meta_data = ? WHERE name = ?", (json.dumps(meta_data), name))
+        finally:
+            conn.close()
+
+    def remove_table(self, name: str) -> None:
+        if not self.exists():
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM syn_tables WHERE name = ?", (name,))
+        finally:
+            conn.close()
+
+    def _to_entry(self, row: sqlite3.Row) -> dict:
+        meta_data = json.loads(row["meta_data"])
+        meta_data["name"] = row["name"]
+        meta_data["file_path"] = Path(self.dir_path, row["file_path"])
+        return meta_data
+
+    def query(
+        self,
+        columns: Optional[list] = None,
+        target: Optional[str] = None,
+        min_elapsed_time: Optional[float] = None,
+        max_elapsed_time: Optional[float] = None,
+        max_cluster_size: Optional[int] = None,
+        exact_columns: bool = False,
+    ) -> list:
+        ''' Returns the metadata of the tables (with 'name' and 'file_path')
+            that contain all of columns (exactly these columns, with
+            exact_columns), have the target column, and whose synthesis time
+            and largest cluster are within the given limits. Tables with the
+            fewest columns come first. With no arguments, returns all tables.
+        '''
+        if not self.exists():
+            return []
+        conditions = []
+        params = []
+        if columns is not None:
+            columns = list(dict.fromkeys(columns))
+            placeholders = ", ".join("?" * len(columns))
+            conditions.append(
+                f"name IN (SELECT name FROM syn_table_columns WHERE column_name IN ({placeholders}) "
+                "GROUP BY name HAVING COUNT(*) = ?)"
+            )
+            params += columns + [len(columns)]
+            if exact_columns:
+                conditions.append("num_columns = ?")
+                params.append(len(columns))
+        if target is not None:
+            conditions.append("target_column = ?")
+            params.append(target)
+        if min_elapsed_time is not None:
+            conditions.append("elapsed_time >= ?")
+            params.append(min_elapsed_time)
+        if max_elapsed_time is not None:
+            conditions.append("elapsed_time <= ?")
+            params.append(max_elapsed_time)
+        if max_cluster_size is not None:
+            conditions.append("max_cluster_size <= ?")
+            params.append(max_cluster_size)
+        sql = "SELECT name, file_path, meta_data FROM syn_tables"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY num_columns, name"
+        conn = self._connect()
+        try:
+            return [self._to_entry(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def get_table(self, name: str) -> Optional[dict]:
+        if not self.exists():
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT name, file_path, meta_data FROM syn_tables WHERE name = ?", (name,)).fetchone()
+        finally:
+            conn.close()
+        return self._to_entry(row) if row is not None else None
+
+    def get_stats(self, name: str) -> Optional[dict]:
+        if not self.exists():
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT stats FROM syn_tables WHERE name = ?", (name,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or row["stats"] is None:
+            return None
+        return json.loads(row["stats"])
+
+    def get_stats_num_bytes(self) -> dict:
+        ''' Returns the size of the stats of each table that has stats, by
+            name.
+        '''
+        if not self.exists():
+            return {}
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT name, LENGTH(stats) FROM syn_tables WHERE stats IS NOT NULL").fetchall()
+        finally:
+            conn.close()
+        return {name: num_bytes for name, num_bytes in rows}
+
+    def remove_stats(self, name: str) -> None:
+        if not self.exists():
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE syn_tables SET stats = NULL WHERE name = ?", (name,))
+        finally:
+            conn.close()
+
+    def vacuum(self) -> None:
+        ''' Rewrites the database to return the space of removed tables and
+            stats to the file system.
+        '''
+        if not self.exists():
+            return
+        conn = self._connect()
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def import_files(self, syn_dir_path: Path, stats_dir_path: Path, remove: bool = False) -> int:
+        ''' Adds the tables that have sidecar JSON files in syn_dir_path (and
+            their stats files in stats_dir_path) to the manifest. With remove,
+            the sidecar and stats files are then deleted. Returns the number of
+            tables imported.
+        '''
+        num_imported = 0
+        for meta_data_path in sorted(Path(syn_dir_path).glob("*.json")):
+            # Both '.json' and '.meta_data.json' sidecars
+            name = meta_data_path.name.removesuffix(".json").removesuffix(".meta_data")
+            file_path = Path(syn_dir_path, name + ".parquet")
+            if not file_path.exists():
+                continue
+            with meta_data_path.open("r") as file:
+                meta_data = json.load(file)
+            stats_path = Path(stats_dir_path, "stats_" + name + ".json")
+            stats = None
+            if stats_path.exists():
+                with stats_path.open("r") as file:
+                    stats = json.load(file)
+            self.put_table(name, meta_data, file_path, stats=stats)
+            if remove:
+                meta_data_path.unlink()
+                stats_path.unlink(missing_ok=True)
+            num_imported += 1
+        return num_imported
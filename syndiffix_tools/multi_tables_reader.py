@@ -0,0 +1,108 @@
+from pathlib import Path
+from typing import Optional, Union
+
+import pandas as pd
+
+from syndiffix_tools.frame_cache import FrameCache
+from syndiffix_tools.tables_reader import TablesReader, load_catalog, open_entry
+
+
+class MultiTablesReader:
+    """
+    This class serves the synthetic datasets of many original datasets. Each
+    dataset is a directory under root_path, as populated by TablesBuilder
+    (i.e. the synthetic datasets are in <root_path>/<dataset>/syn).
+
+    The tables of all datasets are held in one catalog, with one index from
+    (dataset, column) to the tables that contain the column, fewest columns
+    first. A query only looks at the tables of its least common column.
+
+    All datasets share one memory budget for cached dataframes, with the
+    least recently used dataframes evicted first.
+
+    Inputs:
+        - root_path: str or Path. The directory holding the dataset directories.
+        - max_cache_bytes: int. The memory budget for cached dataframes. 0
+              disables caching.
+    """
+
+    def __init__(self, root_path: Union[str, Path], max_cache_bytes: int = 0) -> None:
+        self.root_path = Path(root_path)
+        if not self.root_path.exists():
+            raise FileNotFoundError(f"Directory {self.root_path} does not exist.")
+        self.frame_cache = FrameCache(max_cache_bytes)
+        self.catalog = []
+        self.index = {}
+        self.all_columns = {}
+        self.readers = {}
+        self.build_index()
+
+    def build_index(self) -> None:
+        # Rebuilds the catalog and index. Cached dataframes are kept.
+        self.catalog = []
+        self.index = {}
+        self.all_columns = {}
+        self.readers = {}
+        for dataset_path in sorted(self.root_path.iterdir()):
+            syn_dir_path = Path(dataset_path, "syn")
+            if not syn_dir_path.is_dir():
+                continue
+            catalog = load_catalog(syn_dir_path)
+            for entry in catalog:
+                entry['dataset'] = dataset_path.name
+            self.all_columns[dataset_path.name] = max((entry["columns"] for entry in catalog), key=len, default=[])
+            self.catalog += catalog
+        # The sort is stable, so ties keep catalog order, as in TablesReader
+        for entry in sorted(self.catalog, key=lambda entry: len(entry["columns"])):
+            for col in entry["columns"]:
+                self.index.setdefault((entry['dataset'], col), []).append(entry)
+
+    def get_datasets(self) -> list:
+        return list(self.all_columns.keys())
+
+    def _check_dataset(self, dataset: str) -> None:
+        if dataset not in self.all_columns:
+            raise KeyError(f"Dataset {dataset} not found under {self.root_path.as_posix()}.")
+
+    def get_reader(self, dataset: str) -> TablesReader:
+        ''' Returns a TablesReader for one dataset (e.g. for count_by), which
+            uses the shared catalog entries and memory budget.
+        '''
+        self._check_dataset(dataset)
+        if dataset not in self.readers:
+            catalog = [entry for entry in self.catalog if entry['dataset'] == dataset]
+            self.readers[dataset] = TablesReader(
+                Path(self.root_path, dataset, "syn"), frame_cache=self.frame_cache, catalog=catalog
+            )
+        return self.readers[dataset]
+
+    def get_best_entry(self, dataset: str, columns: list = None, target: str = None) -> Optional[dict]:
+        ''' Returns the catalog entry of the table of the dataset with the
+            fewest columns that contains all of the requested columns.
+        '''
+        self._check_dataset(dataset)
+        if columns is None:
+            columns = self.all_columns[dataset]
+        if len(columns) == 0:
+            candidates = sorted((entry for entry in self.catalog if entry['dataset'] == dataset),
+                                key=lambda entry: len(entry["columns"]))
+        else:
+            candidates = min((self.index.get((dataset, col), []) for col in columns), key=len)
+        for entry in candidates:
+            if target is not None and entry["target_column"] != target:
+                continue
+            if all(col in entry["columns"] for col in columns):
+                return entry
+        return None
+
+    def get_best_syn_df(
+        self, dataset: str, columns: list = None, target: str = None
+    ) -> Optional[pd.DataFrame]:
+        entry = self.get_best_entry(dataset, columns, target=target)
+        if entry is None:
+            return None
+        df = self.frame_cache.get(entry['dataset_path'])
+        if df is None:
+            df = pd.read_parquet(open_entry(entry))
+            self.frame_cache.put(entry['dataset_path'], df)
+        return df
@@ -0,0 +1,288 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+
+from syndiffix_tools.common_tasks import get_df_from_pq, get_pq_bytes_from_df
+
+
+def open_location(location: dict) -> pa.BufferReader:
+    ''' Returns a reader over the parquet file of a table in a pack (see
+        PartitionedStore.get_locations), which pd.read_parquet and
+        pq.read_table accept in place of a path.
+    '''
+    with open(location["pack"], "rb") as file:
+        file.seek(location["offset"])
+        data = file.read(location["length"])
+    if len(data) != location["length"]:
+        raise OSError(f"Pack file {location['pack']} is truncated.")
+    return pa.BufferReader(data)
+
+
+class PartitionedStore:
+    """
+    Holds many small synthetic tables in a few large pack files, and the
+    metadata of all tables in one shared manifest. This replaces the
+    per-table parquet, sidecar and stats files in syn/ and stats/, so that
+    thousands of tables take a handful of files, and a catalog is built from
+    a single file.
+
+    Each table is a complete parquet file, appended to the current pack file
+    (pack-<n>.parquets) in one O_APPEND write. A new pack is started once the
+    current one reaches max_pack_bytes. The manifest is append-only JSON
+    lines, and a table's line (with its pack, offset and length) is written
+    after its data, so readers never see a table that is not there yet. If a
+    table is written again or removed, its latest line wins. Readers only
+    parse the lines appended since their last read.
+
+    The pack files are a private format of this package: concatenated
+    parquet files that only PartitionedStore (and open_location) can read,
+    not pyarrow.dataset or other parquet tools. Use get_df or open_table, or
+    export a table with get_df(name).to_parquet(...).
+
+    Rewritten and removed tables leave dead bytes in the packs and lines in
+    the manifest until compact() copies the live tables to new packs and
+    rewrites the manifest and stats with one line per table. Writers and
+    open_table take a shared lock (flock on the lock file of the store), and
+    compact an exclusive one, so that compaction waits for them and they
+    wait for it, also across processes. Locations that were read before a
+    compaction (like those in a TablesReader catalog) are stale after it.
+
+    Inputs:
+        - dir_path: str or Path. The directory of the store, normally
+              syn/partitioned.
+        - max_pack_bytes: int. The size at which a new pack file is started.
+    """
+
+    MANIFEST_FILE_NAME = "manifest.jsonl"
+    STATS_FILE_NAME = "stats.jsonl"
+    PACK_SUFFIX = ".parquets"
+    LOCK_FILE_NAME = "lock"
+
+    def __init__(self, dir_path: Union[str, Path], max_pack_bytes: int = 2**28) -> None:
+        self.dir_path = Path(dir_path)
+        self.max_pack_bytes = max_pack_bytes
+        self.manifest_path = Path(self.dir_path, self.MANIFEST_FILE_NAME)
+        self.stats_path = Path(self.dir_path, self.STATS_FILE_NAME)
+        self.lock_path = Path(self.dir_path, self.LOCK_FILE_NAME)
+        self._manifest = {}
+        self._locations = {}
+        self._manifest_offset = 0
+        self._manifest_inode = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _store_lock(self, exclusive: bool = False):
+        # Each use opens the lock file anew, so that threads of one process
+        # exclude each other as well. Closing the file releases the lock.
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+        with self.lock_path.open("a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def get_table_path(self, name: str) -> Path:
+        ''' The path by which catalogs and caches know the table. There is no
+            such file; the table is read with get_df or open_table.
+        '''
+        return Path(self.dir_path, name + ".parquet")
+
+    def _read_manifest(self) -> None:
+        if not self.manifest_path.exists():
+            return
+        stat = self.manifest_path.stat()
+        if stat.st_ino != self._manifest_inode or stat.st_size < self._manifest_offset:
+            # Rewritten by compact
+            self._manifest, self._locations = {}, {}
+            self._manifest_offset = 0
+            self._manifest_inode = stat.st_ino
+        if stat.st_size == self._manifest_offset:
+            return
+        with self.manifest_path.open("rb") as file:
+            file.seek(self._manifest_offset)
+            for line in file:
+                # A line without its newline is still being written
+                if not line.endswith(b"\n"):
+                    break
+                self._manifest_offset += len(line)
+                record = json.loads(line)
+                name = record["name"]
+                self._manifest.pop(name, None)
+                self._locations.pop(name, None)
+                if record.get("removed"):
+                    continue
+                location = record.pop("location")
+                self._locations[name] = dict(location, pack=Path(self.dir_path, location["pack"]))
+                # Without metadata where it is kept elsewhere (see put_table)
+                if "columns" in record:
+                    self._manifest[name] = record
+
+    def get_manifest(self) -> dict:
+        ''' Returns the metadata of each table, by data file name.
+        '''
+        with self._lock:
+            self._read_manifest()
+            return dict(self._manifest)
+
+    def get_locations(self) -> dict:
+        ''' Returns the pack ('pack', 'offset' and 'length') of each table, by
+            data file name, including tables whose metadata is kept elsewhere.
+        '''
+        with self._lock:
+            self._read_manifest()
+            return dict(self._locations)
+
+    def exists(self, name: str) -> bool:
+        return name in self.get_locations()
+
+    def _append(self, path: Path, data: bytes) -> int:
+        # A single O_APPEND write, so that concurrent writers do not
+        # interleave. Returns the offset at which data was written.
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if os.write(fd, data) != len(data):
+                raise OSError(f"Short write to {path}.")
+            return os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+        finally:
+            os.close(fd)
+
+    def _append_line(self, path: Path, record: dict) -> None:
+        self._append(path, (json.dumps(record) + "\n").encode())
+
+    def _get_pack_paths(self) -> list:
+        return sorted(self.dir_path.glob("pack-*" + self.PACK_SUFFIX))
+
+    def _add_pack_path(self, pack_paths: list) -> Path:
+        number = 0
+        if len(pack_paths) > 0:
+            number = int(pack_paths[-1].name.removeprefix("pack-").removesuffix(self.PACK_SUFFIX)) + 1
+        pack_paths.append(Path(self.dir_path, f"pack-{number:05d}{self.PACK_SUFFIX}"))
+        return pack_paths[-1]
+
+    def _get_pack_path(self, num_bytes: int, pack_paths: list) -> Path:
+        # The last pack, or a new one if the data would take it over the limit
+        if len(pack_paths) > 0:
+            size = pack_paths[-1].stat().st_size if pack_paths[-1].exists() else 0
+            if size == 0 or size + num_bytes <= self.max_pack_bytes:
+                return pack_paths[-1]
+        return self._add_pack_path(pack_paths)
+
+    def _put_data(self, data: bytes, pack_paths: list) -> dict:
+        pack_path = self._get_pack_path(len(data), pack_paths)
+        offset = self._append(pack_path, data)
+        return {"pack": pack_path.name, "offset": offset, "length": len(data)}
+
+    def put_table(
+        self,
+        name: str,
+        df: pd.DataFrame,
+        meta_data: Optional[dict],
+        profile: str = "default",
+        dictionary_columns: list = None,
+    ) -> None:
+        ''' meta_data is None where the metadata is kept elsewhere (see
+            Manifest). The manifest then only records where the table is.
+        '''
+        data = get_pq_bytes_from_df(df, profile=profile, dictionary_columns=dictionary_columns)
+        with self._store_lock():
+            location = self._put_data(data, self._get_pack_paths())
+            self._append_line(self.manifest_path, dict(meta_data or {}, name=name, location=location))
+
+    def put_meta_data(self, name: str, meta_data: dict) -> None:
+        ''' Replaces the metadata of a table that exists, keeping its data.
+        '''
+        with self._store_lock():
+            location = self.get_locations()[name]
+            location = dict(location, pack=location["pack"].name)
+            self._append_line(self.manifest_path, dict(meta_data, name=name, location=location))
+
+    def remove_table(self, name: str) -> None:
+        ''' Removes a table and its stats. The space is freed by compact.
+        '''
+        with self._store_lock():
+            if self.exists(name):
+                self._append_line(self.manifest_path, {"name": name, "removed": True})
+
+    def put_stats(self, name: str, stats: dict) -> None:
+        with self._store_lock():
+            self._append_line(self.stats_path, dict(stats, name=name))
+
+    def remove_stats(self, name: str) -> None:
+        with self._store_lock():
+            self._append_line(self.stats_path, {"name": name, "removed": True})
+
+    def get_stats(self) -> dict:
+        ''' Returns the latest stats of each table that exists, by data file
+            name.
+        '''
+        locations = self.get_locations()
+        stats = {}
+        if self.stats_path.exists():
+            with self.stats_path.open("rb") as file:
+                for line in file:
+                    if line.endswith(b"\n"):
+                        record = json.loads(line)
+                        stats.pop(record["name"], None)
+                        if not record.get("removed"):
+                            stats[record["name"]] = record
+        return {name: record for name, record in stats.items() if name in locations}
+
+    def open_table(self, name: str) -> Optional[pa.BufferReader]:
+        if not self.dir_path.exists():
+            return None
+        with self._store_lock():
+            location = self.get_locations().get(name)
+            return open_location(location) if location is not None else None
+
+    def get_df(self, name: str, columns: Optional[list] = None) -> Optional[pd.DataFrame]:
+        source = self.open_table(name)
+        if source is None:
+            return None
+        return get_df_from_pq(source, columns=columns)
+
+    def get_num_bytes(self) -> int:
+        ''' The size of the store on disk, including dead bytes.
+        '''
+        paths = self._get_pack_paths() + [self.manifest_path, self.stats_path]
+        return sum(path.stat().st_size for path in paths if path.exists())
+
+    def compact(self) -> int:
+        ''' Copies the live tables to new packs, rewrites the manifest and
+            stats with one line per live table, and deletes the old packs.
+            Returns the number of bytes freed. Waits for the writers and
+            open_table calls that are running, and holds off new ones.
+        '''
+        if not self.dir_path.exists():
+            return 0
+        with self._store_lock(exclusive=True):
+            return self._compact()
+
+    def _compact(self) -> int:
+        num_bytes = self.get_num_bytes()
+        manifest = self.get_manifest()
+        locations = self.get_locations()
+        stats = self.get_stats()
+        old_pack_paths = self._get_pack_paths()
+        # New packs are numbered after the old ones
+        pack_paths = list(old_pack_paths)
+        self._add_pack_path(pack_paths)
+        lines = []
+        for name in sorted(locations):
+            with open_location(locations[name]) as source:
+                data = source.read()
+            location = self._put_data(data, pack_paths)
+            lines.append(json.dumps(dict(manifest.get(name, {}), name=name, location=location)) + "\n")
+        for path, records in [(self.manifest_path, lines),
+                              (self.stats_path, [json.dumps(stats[name]) + "\n" for name in sorted(stats)])]:
+            tmp_path = path.with_name(path.name + ".tmp")
+            with tmp_path.open("w") as file:
+                file.writelines(records)
+            os.replace(tmp_path, path)
+        for pack_path in old_pack_paths:
+            pack_path.unlink()
+        return num_bytes - self.get_num_bytes()
@@ -0,0 +1,105 @@
+import time
+import tracemalloc
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from syndiffix.synthesizer import Synthesizer
+
+from syndiffix_tools.cluster_info import ClusterInfo
+
+
+def sample_by_pid(df: pd.DataFrame, pid_cols: list, fraction: float, seed: int = 0) -> pd.DataFrame:
+    ''' Returns the rows of a random fraction of the protected entities, so
+        that every sampled entity keeps all of its rows. Without pid_cols,
+        each row is its own entity.
+    '''
+    rng = np.random.default_rng(seed)
+    if len(pid_cols) == 0:
+        keep = rng.random(len(df)) < fraction
+    else:
+        entity_codes = df.groupby(pid_cols, sort=False, dropna=False).ngroup().to_numpy()
+        keep = (rng.random(entity_codes.max() + 1) < fraction)[entity_codes]
+    if not keep.any() and len(df) > 0:
+        # Keep at least one entity
+        keep = entity_codes == entity_codes[0] if len(pid_cols) > 0 else np.arange(len(df)) == 0
+    return df[keep]
+
+
+def extrapolate(sizes: list, values: list, full_size: int) -> tuple:
+    ''' Fits value = a * size**b to the samples and returns the value at
+        full_size together with b. With a single sample, b is taken as 1.
+    '''
+    sizes = np.asarray(sizes, dtype=np.float64)
+    values = np.maximum(np.asarray(values, dtype=np.float64), 1e-9)
+    if len(np.unique(sizes)) > 1:
+        exponent, log_scale = np.polyfit(np.log(sizes), np.log(values), 1)
+    else:
+        exponent = 1.0
+        log_scale = np.log(values[-1]) - np.log(sizes[-1])
+    return float(np.exp(log_scale) * full_size ** exponent), float(exponent)
+
+
+def preview_synthesis(
+    df_orig: pd.DataFrame,
+    columns: list,
+    pid_cols: list,
+    fractions: list,
+    target_column: Optional[str] = None,
+    evaluator=None,
+    measure_memory: bool = True,
+) -> dict:
+    ''' Synthesizes the columns from pid-aware subsamples of df_orig, one per
+        fraction, and returns a dict with the measurements of each sample
+        under 'samples', and 'estimated_time' and 'estimated_memory_bytes'
+        for a run on all of df_orig. Memory is the peak of the Python heap
+        (tracemalloc) during synthesis, which includes the numpy and pandas
+        buffers. tracemalloc slows synthesis down, so memory is measured in a
+        second, untimed run of each sample. Without measure_memory, that run
+        is skipped and the memory estimates are None. evaluator is an
+        optional QualityEvaluator for rough quality scores.
+    '''
+    samples = []
+    for fraction in sorted(fractions):
+        df_sample = sample_by_pid(df_orig, pid_cols, fraction)
+        df_pid = df_sample[pid_cols] if len(pid_cols) > 0 else None
+        start_time = time.time()
+        syn = Synthesizer(df_sample[columns], pids=df_pid, target_column=target_column)
+        df_syn = syn.sample()
+        elapsed_time = time.time() - start_time
+        peak_bytes = None
+        if measure_memory:
+            tracemalloc.start()
+            try:
+                Synthesizer(df_sample[columns], pids=df_pid, target_column=target_column).sample()
+                _, peak_bytes = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        samples.append(
+            {
+                "fraction": fraction,
+                "num_rows": len(df_sample),
+                "elapsed_time": elapsed_time,
+                "peak_memory_bytes": peak_bytes,
+                "cluster_info": ClusterInfo(syn).get_cluster_info(),
+                "quality": evaluator.evaluate_df(df_syn) if evaluator is not None else None,
+            }
+        )
+    sizes = [sample["num_rows"] for sample in samples]
+    estimated_time, time_exponent = extrapolate(sizes, [sample["elapsed_time"] for sample in samples], len(df_orig))
+    estimated_memory_bytes, memory_exponent = None, None
+    if measure_memory:
+        estimated_memory_bytes, memory_exponent = extrapolate(
+            sizes, [sample["peak_memory_bytes"] for sample in samples], len(df_orig)
+        )
+        estimated_memory_bytes = int(estimated_memory_bytes)
+    return {
+        "columns": columns,
+        "target_column": target_column,
+        "num_rows": len(df_orig),
+        "samples": samples,
+        "estimated_time": estimated_time,
+        "time_exponent": time_exponent,
+        "estimated_memory_bytes": estimated_memory_bytes,
+        "memory_exponent": memory_exponent,
+    }
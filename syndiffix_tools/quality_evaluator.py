@@ -0,0 +1,272 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from syndiffix_tools.common_tasks import (
+    combine_fingerprints,
+    get_df_from_pq,
+    make_column_fingerprints,
+    restore_df_dtypes,
+)
+from syndiffix_tools.manifest import Manifest
+from syndiffix_tools.partitioned_store import PartitionedStore
+
+
+def _to_float(series: pd.Series) -> np.ndarray:
+    # Numeric and datetime values as floats, with nulls as NaN
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.to_numpy(dtype="datetime64[ns]")
+        return np.where(np.isnat(values), np.nan, values.view(np.int64).astype(np.float64))
+    return series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _total_variation(counts_orig: np.ndarray, counts_syn: np.ndarray) -> float:
+    # Half the L1 distance between the two normalized histograms, from 0 to 1
+    return 0.5 * float(np.abs(counts_orig / counts_orig.sum() - counts_syn / counts_syn.sum()).sum())
+
+
+def _sparse_total_variation(hist_orig: tuple, hist_syn: tuple) -> float:
+    # The same for histograms given as sorted (codes, counts) of the codes
+    # that occur. Since |p - q| = p + q - 2 * min(p, q), the distance is 1
+    # minus the overlap on the codes that occur in both.
+    codes_orig, counts_orig = hist_orig
+    codes_syn, counts_syn = hist_syn
+    positions = np.minimum(np.searchsorted(codes_orig, codes_syn), max(len(codes_orig) - 1, 0))
+    shared = codes_orig[positions] == codes_syn if len(codes_orig) > 0 else np.zeros(len(codes_syn), dtype=bool)
+    overlap = np.minimum(counts_orig[positions[shared]] / counts_orig.sum(), counts_syn[shared] / counts_syn.sum())
+    return float(1.0 - overlap.sum())
+
+
+class QualityEvaluator:
+    """
+    Scores the synthetic tables of a dataset directory (as populated by
+    TablesBuilder or TablesManager) against the original table.
+
+    The scores of each table are:
+        - marginal_1dim_error: the mean over columns of the total variation
+              distance between the original and synthetic 1-dim histograms.
+        - marginal_2dim_error: the same for all pairs of columns (None for
+              tables with one column).
+        - correlation_delta: the mean absolute difference between the original
+              and synthetic Pearson correlations of continuous column pairs
+              (None if there are fewer than two continuous columns).
+
+    Categorical columns are histogrammed per value, continuous columns with
+    num_bins equal-width bins taken from the original data. 2-dim histograms
+    only count the value pairs that occur, since all pairs of two categorical
+    columns with many distinct values would not fit in memory. The original
+    side (bins, per-row bin codes, histograms and correlations) is computed once
+    and shared across all tables. Tables are evaluated in a thread pool; the
+    parquet reads and numpy kernels do most of their work outside of the GIL.
+    Scores are cached under the "quality" key of each table's metadata: its
+    metadata file, its row of manifest.sqlite (see Manifest), or its manifest
+    line in partitioned storage, together with the scored columns and the
+    fingerprint of the original on them. Later runs only evaluate tables
+    without scores, or whose scores are for other columns, another num_bins
+    or an original that has since been replaced (see update_df_orig).
+
+    Inputs:
+        - dir_path: str or Path. The dataset directory.
+        - num_bins: int. The number of bins for continuous columns.
+        - max_workers: int. The number of threads. None for the default.
+        - columns: list. If given, only these columns of the original table
+              are loaded, and only they are scored.
+    """
+
+    def __init__(
+        self,
+        dir_path: Union[str, Path],
+        num_bins: int = 20,
+        max_workers: Optional[int] = None,
+        columns: Optional[list] = None,
+    ) -> None:
+        self.dir_path = Path(dir_path)
+        self.syn_dir_path = Path(self.dir_path, "syn")
+        self.partitioned_store = PartitionedStore(Path(self.syn_dir_path, "partitioned"))
+        self.manifest = Manifest(self.dir_path)
+        self.num_bins = num_bins
+        self.max_workers = max_workers
+        with Path(self.dir_path, "orig_meta_data.json").open("r") as file:
+            self.orig_meta_data = json.load(file)
+        df_orig = get_df_from_pq(Path(self.dir_path, self.orig_meta_data["orig_file_name"]), columns=columns)
+        df_orig = restore_df_dtypes(df_orig, self.orig_meta_data["column_dtypes"])
+        self.column_classes = self.orig_meta_data["column_classes"]
+        self.column_fingerprints = self.orig_meta_data.get("column_fingerprints")
+        if self.column_fingerprints is None:
+            self.column_fingerprints = make_column_fingerprints(df_orig)
+        self.codebooks = {}
+        self.orig_codes = {}
+        self.orig_hist_1dim = {}
+        for col in df_orig.columns:
+            self.codebooks[col] = self._make_codebook(df_orig[col])
+            self.orig_codes[col] = self._encode(col, df_orig[col])
+            self.orig_hist_1dim[col] = np.bincount(self.orig_codes[col], minlength=self._num_codes(col))
+        self.continuous_columns = [
+            col for col in df_orig.columns
+            if self.column_classes.get(col) == "continuous" and self.codebooks[col][0] == "bins"
+        ]
+        self.orig_corr = pd.DataFrame({col: _to_float(df_orig[col]) for col in self.continuous_columns}).corr()
+        self.orig_hist_2dim = {}
+        self._lock = threading.Lock()
+
+    def _make_codebook(self, series: pd.Series) -> tuple:
+        if self.column_classes.get(series.name) != "categorical":
+            try:
+                values = _to_float(series)
+            except (TypeError, ValueError):
+                values = None
+            if values is not None:
+                values = values[~np.isnan(values)]
+                if len(values) == 0:
+                    values = np.zeros(1)
+                return ("bins", np.histogram_bin_edges(values, bins=self.num_bins))
+        return ("values", pd.Index(series.dropna().unique()))
+
+    def _num_codes(self, col: str) -> int:
+        kind, book = self.codebooks[col]
+        # The last code is for nulls and values not seen in the original
+        return (len(book) - 1 if kind == "bins" else len(book)) + 1
+
+    def _encode(self, col: str, series: pd.Series) -> np.ndarray:
+        kind, book = self.codebooks[col]
+        null_code = self._num_codes(col) - 1
+        if kind == "bins":
+            values = _to_float(series)
+            codes = np.clip(np.searchsorted(book, values, side="right") - 1, 0, len(book) - 2)
+            codes[np.isnan(values)] = null_code
+        else:
+            codes = book.get_indexer(series)
+            codes[codes < 0] = null_code
+        return codes.astype(np.int64)
+
+    def _get_hist_2dim(self, codes1: np.ndarray, col2: str, codes2: np.ndarray) -> tuple:
+        # The sorted codes of the value pairs that occur, with their counts
+        return np.unique(codes1 * self._num_codes(col2) + codes2, return_counts=True)
+
+    def _get_orig_hist_2dim(self, col1: str, col2: str) -> tuple:
+        key = (col1, col2)
+        hist = self.orig_hist_2dim.get(key)
+        if hist is None:
+            hist = self._get_hist_2dim(self.orig_codes[col1], col2, self.orig_codes[col2])
+            with self._lock:
+                self.orig_hist_2dim[key] = hist
+        return hist
+
+    def _get_scored_columns(self, columns: list) -> list:
+        return sorted(col for col in columns if col in self.codebooks)
+
+    def _get_orig_fingerprint(self, columns: list) -> str:
+        return combine_fingerprints({col: self.column_fingerprints.get(col, "") for col in columns})
+
+    def _get_cached_quality(self, meta_data: dict, force: bool) -> Optional[dict]:
+        # The scores in the metadata, if they are for the same evaluation
+        quality = meta_data.get("quality")
+        if force or quality is None or quality["num_bins"] != self.num_bins:
+            return None
+        columns = self._get_scored_columns(meta_data.get("columns") or [])
+        if quality.get("columns") != columns or quality.get("orig_fingerprint") != self._get_orig_fingerprint(columns):
+            return None
+        return quality
+
+    def evaluate_df(self, df_syn: pd.DataFrame) -> dict:
+        columns = self._get_scored_columns(df_syn.columns)
+        syn_codes = {col: self._encode(col, df_syn[col]) for col in columns}
+        errors_1dim = {}
+        for col in columns:
+            hist = np.bincount(syn_codes[col], minlength=self._num_codes(col))
+            errors_1dim[col] = _total_variation(self.orig_hist_1dim[col], hist)
+        errors_2dim = []
+        for i, col1 in enumerate(columns):
+            for col2 in columns[i + 1:]:
+                hist = self._get_hist_2dim(syn_codes[col1], col2, syn_codes[col2])
+                errors_2dim.append(_sparse_total_variation(self._get_orig_hist_2dim(col1, col2), hist))
+        continuous = [col for col in columns if col in self.continuous_columns]
+        correlation_delta = None
+        if len(continuous) >= 2:
+            syn_corr = pd.DataFrame({col: _to_float(df_syn[col]) for col in continuous}).corr()
+            delta = (syn_corr - self.orig_corr.loc[continuous, continuous]).abs().to_numpy()
+            upper = delta[np.triu_indices(len(continuous), k=1)]
+            if not np.isnan(upper).all():
+                correlation_delta = float(np.nanmean(upper))
+        return {
+            "num_bins": self.num_bins,
+            "columns": columns,
+            "orig_fingerprint": self._get_orig_fingerprint(columns),
+            "marginal_1dim_error": float(np.mean(list(errors_1dim.values()))) if errors_1dim else None,
+            "marginal_2dim_error": float(np.mean(errors_2dim)) if errors_2dim else None,
+            "correlation_delta": correlation_delta,
+            "marginal_1dim_error_per_column": errors_1dim,
+        }
+
+    def _get_meta_data_path(self, dataset_path: Path) -> Path:
+        # TablesBuilder writes <name>.json, TablesManager <name>.meta_data.json
+        meta_data_path = dataset_path.with_suffix(".json")
+        if not meta_data_path.exists():
+            meta_data_path = dataset_path.with_suffix(".meta_data.json")
+        return meta_data_path
+
+    def evaluate_table(self, dataset_path: Path, force: bool = False) -> dict:
+        ''' dataset_path is a table's parquet file, or for a table in
+            partitioned storage, its PartitionedStore.get_table_path.
+        '''
+        name = dataset_path.name.removesuffix(".parquet")
+        entry = self.manifest.get_table(name)
+        if entry is not None:
+            return self._evaluate_manifest_table(entry, force)
+        if dataset_path.parent == self.partitioned_store.dir_path and self.partitioned_store.exists(name):
+            return self._evaluate_partitioned_table(name, force)
+        meta_data_path = self._get_meta_data_path(dataset_path)
+        meta_data = None
+        if meta_data_path.exists():
+            with meta_data_path.open("r") as file:
+                meta_data = json.load(file)
+            quality = self._get_cached_quality(meta_data, force)
+            if quality is not None:
+                return quality
+        quality = self.evaluate_df(get_df_from_pq(dataset_path))
+        if meta_data is not None:
+            meta_data["quality"] = quality
+            with meta_data_path.open("w") as file:
+                json.dump(meta_data, file, indent=4)
+        return quality
+
+    def _evaluate_manifest_table(self, entry: dict, force: bool) -> dict:
+        name, dataset_path = entry.pop("name"), entry.pop("file_path")
+        quality = self._get_cached_quality(entry, force)
+        if quality is not None:
+            return quality
+        if dataset_path.parent == self.partitioned_store.dir_path:
+            df_syn = self.partitioned_store.get_df(name)
+        else:
+            df_syn = get_df_from_pq(dataset_path)
+        quality = self.evaluate_df(df_syn)
+        self.manifest.put_meta_data(name, dict(entry, quality=quality))
+        return quality
+
+    def _evaluate_partitioned_table(self, name: str, force: bool) -> dict:
+        meta_data = self.partitioned_store.get_manifest().get(name)
+        if meta_data is not None:
+            quality = self._get_cached_quality(meta_data, force)
+            if quality is not None:
+                return quality
+        quality = self.evaluate_df(self.partitioned_store.get_df(name))
+        if meta_data is not None:
+            self.partitioned_store.put_meta_data(name, dict(meta_data, quality=quality))
+        return quality
+
+    def evaluate_all(self, force: bool = False) -> dict:
+        ''' Returns a dict of quality scores keyed by synthetic file name
+            (<name>.parquet, also for tables in partitioned storage).
+            Set force to True to re-evaluate tables that already have scores.
+        '''
+        dataset_paths = sorted(path for path in self.syn_dir_path.iterdir() if path.suffix == ".parquet")
+        dataset_paths += [self.partitioned_store.get_table_path(name)
+                          for name in sorted(self.partitioned_store.get_locations())]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            qualities = executor.map(lambda path: self.evaluate_table(path, force=force), dataset_paths)
+            return {path.name: quality for path, quality in zip(dataset_paths, qualities)}
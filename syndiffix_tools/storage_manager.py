@@ -0,0 +1,345 @@
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+from syndiffix_tools.manifest import Manifest
+from syndiffix_tools.partitioned_store import PartitionedStore
+
+
+def _get_record_num_bytes(record: Optional[dict]) -> int:
+    # The size of a JSON line
+    return len(json.dumps(record)) + 1 if record is not None else 0
+
+
+def _get_num_bytes(path: Path) -> int:
+    if path.is_dir():
+        return sum(file_path.stat().st_size for file_path in path.rglob("*") if file_path.is_file())
+    if path.exists():
+        return path.stat().st_size
+    return 0
+
+
+class StorageManager:
+    """
+    Reports and limits the disk space used by the synthetic tables (syn/) and
+    statistics (stats/) of a dataset directory populated by TablesBuilder or
+    TablesManager.
+
+    The last access of a table is taken from access_log.jsonl (written by
+    TablesReader with access_log=True) if there is one, and otherwise from the
+    file access time, which some file systems only update coarsely. The
+    rebuild cost of a table is its recorded synthesis time. The access log is
+    compacted to one line per distinct request (see compact_access_log) by
+    enforce_budget once it exceeds max_access_log_bytes.
+
+    Stats files whose table no longer exists are orphans. They count towards
+    the budget and are the first to be deleted.
+
+    Tables are deleted sidecar first, so that a TablesReader building its
+    catalog never finds a sidecar without its table. Readers that are already
+    running need a new catalog after deletions.
+
+    Tables in partitioned storage (see PartitionedStore) are included, with
+    the size of their part of a pack. Deleting them, or their stats, frees
+    the space by compacting the store. Compaction holds the store's lock, so
+    builders writing to it (in this or other processes) wait for it rather
+    than lose their tables. The store's other bytes (its manifest, and the dead bytes of rewritten
+    tables) count as partitioned_overhead_bytes.
+
+    Tables recorded in manifest.sqlite (see Manifest) are included, with the
+    size of the stats in their row. Deleting them, or their stats, vacuums the
+    database.
+
+    Inputs:
+        - dir_path: str or Path. The dataset directory.
+        - max_access_log_bytes: int. The size above which enforce_budget
+              compacts the access log.
+    """
+
+    def __init__(self, dir_path: Union[str, Path], max_access_log_bytes: int = 2**24) -> None:
+        self.dir_path = Path(dir_path)
+        self.max_access_log_bytes = max_access_log_bytes
+        self.syn_dir_path = Path(self.dir_path, "syn")
+        self.stats_dir_path = Path(self.dir_path, "stats")
+        self.access_log_path = Path(self.dir_path, "access_log.jsonl")
+        self.manifest = Manifest(self.dir_path)
+        self.partitioned_store = PartitionedStore(Path(self.syn_dir_path, "partitioned"))
+
+    def _read_access_log(self, path: Optional[Path] = None) -> list:
+        path = path or self.access_log_path
+        accesses = []
+        if path.exists():
+            with path.open("r") as file:
+                for line in file:
+                    # A line without its newline is still being written
+                    if line.strip() and line.endswith("\n"):
+                        accesses.append(json.loads(line))
+        return accesses
+
+    def compact_access_log(self, max_age: Optional[float] = None) -> int:
+        ''' Rewrites the access log with one line per distinct request (file,
+            columns and target), with its last 'time' and its 'count'. With
+            max_age (seconds), older requests are dropped. The log is moved
+            aside first, so that concurrent TablesReaders start a new one.
+            Returns the number of bytes freed.
+        '''
+        if not self.access_log_path.exists():
+            return 0
+        num_bytes = _get_num_bytes(self.access_log_path)
+        old_path = self.access_log_path.with_name(self.access_log_path.name + ".old")
+        os.replace(self.access_log_path, old_path)
+        requests = {}
+        for access in self._read_access_log(old_path):
+            key = (access["file"], json.dumps(access["columns"]), access["target"])
+            request = requests.setdefault(key, dict(access, count=0))
+            request["time"] = max(request["time"], access["time"])
+            request["count"] += access.get("count", 1)
+        if max_age is not None:
+            min_time = time.time() - max_age
+            requests = {key: request for key, request in requests.items() if request["time"] >= min_time}
+        data = "".join(json.dumps(request) + "\n" for request in sorted(requests.values(), key=lambda r: r["time"]))
+        # Appended, since readers may have started the new log already
+        with self.access_log_path.open("a") as file:
+            file.write(data)
+        old_path.unlink()
+        return num_bytes - len(data.encode())
+
+    def get_tables(self) -> list:
+        ''' Returns a dict per synthetic table with its name, columns,
+            target_column, files, partitioned, in_manifest, num_bytes
+            (including replicates and marginals), stats_num_bytes (of its
+            stats file, partitioned stats or manifest row), elapsed_time and
+            last_access.
+        '''
+        last_access = {}
+        for access in self._read_access_log():
+            if access["file"] is not None:
+                last_access[access["file"]] = max(access["time"], last_access.get(access["file"], 0))
+        in_manifest = {meta_data["name"]: meta_data for meta_data in self.manifest.query()}
+        manifest_stats_num_bytes = self.manifest.get_stats_num_bytes()
+        tables = []
+        for dataset_path in sorted(self.syn_dir_path.glob("*.parquet")):
+            name = dataset_path.stem
+            meta_data_paths = [Path(self.syn_dir_path, name + ".json"), Path(self.syn_dir_path, name + ".meta_data.json")]
+            meta_data = in_manifest.get(name, {})
+            for meta_data_path in meta_data_paths:
+                if meta_data_path.exists():
+                    with meta_data_path.open("r") as file:
+                        meta_data = json.load(file)
+            # Sidecars go first in the list, in deletion order
+            files = [path for path in meta_data_paths if path.exists()] + [dataset_path]
+            files += [
+                path
+                for path in [
+                    Path(self.syn_dir_path, name + ".replicates"),
+                    Path(self.dir_path, "marginals", name + ".parquet"),
+                ]
+                if path.exists()
+            ]
+            stats_path = Path(self.stats_dir_path, "stats_" + name + ".json")
+            tables.append(
+                {
+                    "name": name,
+                    "columns": meta_data.get("columns"),
+                    "target_column": meta_data.get("target_column"),
+                    "files": files,
+                    "partitioned": False,
+                    "in_manifest": name in in_manifest,
+                    "num_bytes": sum(_get_num_bytes(path) for path in files),
+                    "stats_path": stats_path if stats_path.exists() else None,
+                    "stats_num_bytes": _get_num_bytes(stats_path) + manifest_stats_num_bytes.get(name, 0),
+                    "elapsed_time": meta_data.get("elapsed_time") or 0.0,
+                    "last_access": last_access.get(dataset_path.name, dataset_path.stat().st_atime),
+                }
+            )
+        locations = self.partitioned_store.get_locations()
+        partitioned_meta_datas = self.partitioned_store.get_manifest()
+        partitioned_stats = self.partitioned_store.get_stats()
+        for name in sorted(locations):
+            meta_data = partitioned_meta_datas.get(name) or in_manifest.get(name, {})
+            marginals_path = Path(self.dir_path, "marginals", name + ".parquet")
+            files = [marginals_path] if marginals_path.exists() else []
+            location = locations[name]
+            tables.append(
+                {
+                    "name": name,
+                    "columns": meta_data.get("columns"),
+                    "target_column": meta_data.get("target_column"),
+                    "files": files,
+                    "partitioned": True,
+                    "in_manifest": name in in_manifest,
+                    "num_bytes": location["length"] + sum(_get_num_bytes(path) for path in files),
+                    "stats_path": None,
+                    "stats_num_bytes": _get_record_num_bytes(partitioned_stats.get(name))
+                    + manifest_stats_num_bytes.get(name, 0),
+                    "elapsed_time": meta_data.get("elapsed_time") or 0.0,
+                    "last_access": last_access.get(name + ".parquet", location["pack"].stat().st_atime),
+                }
+            )
+        return tables
+
+    def get_orphan_stats_paths(self, tables: Optional[list] = None) -> list:
+        ''' Returns the stats files whose table does not exist.
+        '''
+        if tables is None:
+            tables = self.get_tables()
+        names = {table["name"] for table in tables}
+        stats_paths = sorted(self.stats_dir_path.glob("stats_*.json")) if self.stats_dir_path.exists() else []
+        return [path for path in stats_paths if path.name.removeprefix("stats_").removesuffix(".json") not in names]
+
+    def report(self) -> dict:
+        tables = self.get_tables()
+        stats_paths = sorted(self.stats_dir_path.glob("*.json")) if self.stats_dir_path.exists() else []
+        locations = self.partitioned_store.get_locations()
+        partitioned_stats_num_bytes = sum(
+            _get_record_num_bytes(stats) for stats in self.partitioned_store.get_stats().values()
+        )
+        partitioned_num_bytes = sum(location["length"] for location in locations.values()) + partitioned_stats_num_bytes
+        return {
+            "tables": [{key: table[key] for key in ["name", "num_bytes", "stats_num_bytes"]} for table in tables],
+            "syn_num_bytes": sum(table["num_bytes"] for table in tables),
+            "stats_num_bytes": sum(_get_num_bytes(path) for path in stats_paths)
+            + partitioned_stats_num_bytes
+            + sum(self.manifest.get_stats_num_bytes().values()),
+            "orphan_stats_num_bytes": sum(_get_num_bytes(path) for path in self.get_orphan_stats_paths(tables)),
+            "partitioned_overhead_bytes": self.partitioned_store.get_num_bytes() - partitioned_num_bytes,
+        }
+
+    def find_redundant_tables(self, requests: Optional[list] = None) -> list:
+        ''' Returns the names of tables that could serve some requests, but
+            for each of those requests a table with fewer columns is chosen
+            instead. requests is a list of (columns, target) pairs, by default
+            the requests in the access log.
+        '''
+        if requests is None:
+            requests = [(access["columns"], access["target"]) for access in self._read_access_log()]
+        tables = [table for table in self.get_tables() if table["columns"] is not None]
+        served = set()
+        covering = set()
+        for columns, target in requests:
+            candidates = [
+                table
+                for table in tables
+                if (target is None or table["target_column"] == target)
+                and (columns is None or all(col in table["columns"] for col in columns))
+            ]
+            if columns is None:
+                # A request for all columns is served by the widest table
+                candidates = sorted(candidates, key=lambda table: -len(table["columns"]))[:1]
+            if len(candidates) == 0:
+                continue
+            best = min(candidates, key=lambda table: len(table["columns"]))
+            served.add(best["name"])
+            covering.update(table["name"] for table in candidates)
+        return sorted(covering - served)
+
+    def delete_table(self, name: str) -> int:
+        ''' Deletes a table, its sidecar files and its stats. Returns the
+            number of bytes freed.
+        '''
+        for table in self.get_tables():
+            if table["name"] == name:
+                num_bytes = self._delete(table, include_stats=True)
+                if table["partitioned"]:
+                    self.partitioned_store.compact()
+                if table["in_manifest"]:
+                    self.manifest.vacuum()
+                return num_bytes
+        raise ValueError(f"Table {name} not found.")
+
+    def _delete(self, table: dict, include_stats: bool) -> int:
+        # The manifest row (with its stats), like a sidecar, goes before the
+        # table. The space is freed by vacuum.
+        self.manifest.remove_table(table["name"])
+        num_bytes = table["num_bytes"]
+        if table["partitioned"]:
+            # With its stats; the space is freed by compact
+            self.partitioned_store.remove_table(table["name"])
+        paths = list(table["files"])
+        if include_stats:
+            num_bytes += table["stats_num_bytes"]
+            if table["stats_path"] is not None:
+                paths.append(table["stats_path"])
+        for path in paths:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink(missing_ok=True)
+        return num_bytes
+
+    def _delete_stats(self, table: dict) -> None:
+        if table["in_manifest"]:
+            self.manifest.remove_stats(table["name"])
+        if table["partitioned"]:
+            self.partitioned_store.remove_stats(table["name"])
+        elif table["stats_path"] is not None:
+            table["stats_path"].unlink(missing_ok=True)
+
+    def enforce_budget(self, max_bytes: int, dry_run: bool = False) -> list:
+        ''' Deletes files until syn/ and stats/ together use at most max_bytes.
+            Orphan stats files go first. Then stats files, oldest first, since
+            tables can be served without them. Then redundant tables, and then the tables with the
+            lowest rebuild cost per unit of time since their last access.
+            Returns a list of (kind, name, num_bytes) for what was (or, with
+            dry_run, would be) deleted. The partitioned store is compacted
+            first if that is not enough, and again after deleting from it. The
+            manifest is vacuumed after deleting from it.
+        '''
+        if not dry_run and _get_num_bytes(self.access_log_path) > self.max_access_log_bytes:
+            self.compact_access_log()
+        report = self.report()
+        total_bytes = report["syn_num_bytes"] + report["stats_num_bytes"] + report["partitioned_overhead_bytes"]
+        deleted = []
+        if total_bytes <= max_bytes:
+            return deleted
+        if report["partitioned_overhead_bytes"] > 0 and not dry_run:
+            total_bytes -= self.partitioned_store.compact()
+        tables = self.get_tables()
+        now = time.time()
+        compact = False
+        vacuum = False
+        for stats_path in self.get_orphan_stats_paths(tables):
+            if total_bytes <= max_bytes:
+                return deleted
+            num_bytes = _get_num_bytes(stats_path)
+            if not dry_run:
+                stats_path.unlink(missing_ok=True)
+            total_bytes -= num_bytes
+            deleted.append(("orphan_stats", stats_path.name, num_bytes))
+        for table in sorted(
+            (table for table in tables if table["stats_num_bytes"] > 0), key=lambda table: table["last_access"]
+        ):
+            if total_bytes <= max_bytes:
+                break
+            num_bytes = table["stats_num_bytes"]
+            if not dry_run:
+                self._delete_stats(table)
+                compact = compact or table["partitioned"]
+                vacuum = vacuum or table["in_manifest"]
+            table["stats_path"] = None
+            total_bytes -= num_bytes
+            deleted.append(("stats", table["name"], num_bytes))
+        redundant = set(self.find_redundant_tables()) if total_bytes > max_bytes else set()
+
+        def keep_value(table: dict) -> tuple:
+            age = max(now - table["last_access"], 1.0)
+            return (table["name"] not in redundant, table["elapsed_time"] / age)
+
+        for table in sorted(tables, key=keep_value):
+            if total_bytes <= max_bytes:
+                break
+            num_bytes = table["num_bytes"]
+            if not dry_run:
+                self._delete(table, include_stats=False)
+                compact = compact or table["partitioned"]
+                vacuum = vacuum or table["in_manifest"]
+            total_bytes -= num_bytes
+            deleted.append(("table", table["name"], num_bytes))
+        if compact:
+            self.partitioned_store.compact()
+        if vacuum:
+            self.manifest.vacuum()
+        return deleted
@@ -1,13 +1,36 @@
+import glob
 import json
 import time
 from pathlib import Path
-from typing import Union, Optional
+from typing import Any, Callable, Optional, Union
 import pandas as pd
 
+from syndiffix.clustering.strategy import NoClustering
 from syndiffix.synthesizer import Synthesizer
+from syndiffix_tools.aggregates import put_marginals
+from syndiffix_tools.background_writer import BackgroundWriter
 from syndiffix_tools.cluster_info import ClusterInfo
+from syndiffix_tools.cluster_plans import ClusterPlanStore, PlannedClustering
+from syndiffix_tools.isolated import run_isolated
+from syndiffix_tools.manifest import Manifest
+from syndiffix_tools.partitioned_store import PartitionedStore
+from syndiffix_tools.preview import preview_synthesis
+from syndiffix_tools.quality_evaluator import QualityEvaluator
+from syndiffix_tools.time_budget import WorkRates, fit_time_budget, should_skip_clustering
 from syndiffix_tools.tree_walker import TreeWalker
-from syndiffix_tools.common_tasks import get_df_from_pq, put_pq_from_df, make_data_file_name, put_csv_from_df, best_guess_column_classification
+from syndiffix_tools.common_tasks import (
+    PQ_WRITE_PROFILES,
+    best_guess_column_classification,
+    compact_df_dtypes,
+    get_df_from_pq,
+    make_data_file_name,
+    combine_fingerprints,
+    make_column_fingerprints,
+    put_csv_from_df,
+    put_pq_from_df,
+    put_pq_replicates,
+    restore_df_dtypes,
+)
 
 class TablesBuilder:
     """
@@ -16,12 +39,54 @@ class TablesBuilder:
     Inputs:
         - dir_path: str or Path. the directory path where the synthetic
               datasets and other metadata are stored.
+        - compact_dtypes: bool. If True, df_orig and the synthetic tables are
+              held and written with compact dtypes (Categorical for categorical
+              string columns, downcast numerics). The values are unchanged, and
+              the original dtypes are kept in orig_meta_data["column_dtypes"].
+        - orig_on_disk: bool. If True, the original table is not held in
+              memory (df_orig stays None). Instead, each synthesis reads only
+              the columns it needs, plus the pid columns, from the parquet file.
+        - partitioned: bool. If True, synthetic tables are written to the
+              shared pack files of syn/partitioned (see PartitionedStore)
+              instead of as separate files, which suits large numbers of
+              small tables. Tables in either storage are found when reading.
+        - write_queue_size: int. If more than 0, the outputs of synthesize
+              (tables, metadata, marginals and stats) and the CSV of
+              put_df_orig are written by a background thread, with up to this
+              many writes queued, so that writing overlaps with the next
+              synthesis. flush() waits for the writes. A write error names
+              its table, and is raised by the next flush, or by the next
+              synthesize before it starts. synthesize_jobs records it as a
+              failure of the job of that table.
+        - use_manifest: bool. If True, the metadata and stats of synthetic
+              tables are recorded in manifest.sqlite (see Manifest) instead of
+              sidecar JSON files in syn/ and stats files in stats/.
     Files:
         - orig_meta_data.json: metadata about the original dataset. This is initially created with a best guess as to whether columns are continuous or categorical. This can be manually edited afterwards.
+        - plans/: cluster plans that synthesize can re-apply (see use_cluster_plan).
+        - marginals/: precomputed 1-dim counts of synthetic tables (see save_marginals).
+        - failures/: records of failed syntheses (see synthesize_jobs).
+        - preview/: results of preview syntheses (see synthesize with preview).
+        - syn/partitioned/: synthetic tables, their metadata and stats in partitioned storage (see partitioned).
+        - manifest.sqlite: metadata and stats of synthetic tables (see use_manifest).
     """
 
-    def __init__(self, dir_path: Union[str, Path]) -> None:
+    SYN_META_DATA_SUFFIX = ".json"
+
+    def __init__(
+        self,
+        dir_path: Union[str, Path],
+        compact_dtypes: bool = False,
+        orig_on_disk: bool = False,
+        partitioned: bool = False,
+        write_queue_size: int = 0,
+        use_manifest: bool = False,
+    ) -> None:
         self.df_orig = None  # populate with put_df_orig
+        self.compact_dtypes = compact_dtypes
+        self.orig_on_disk = orig_on_disk
+        self.partitioned = partitioned
+        self.use_manifest = use_manifest
         self.orig_file_name = None
         self.orig_meta_data = {}
         if type(dir_path) == str:
@@ -34,23 +99,44 @@ class TablesBuilder:
         self.stats_dir_path.mkdir(exist_ok=True)
         self.syn_dir_path = Path(self.dir_path, "syn")
         self.syn_dir_path.mkdir(exist_ok=True)
+        self.plans_dir_path = Path(self.dir_path, "plans")
+        self.marginals_dir_path = Path(self.dir_path, "marginals")
+        self.failures_dir_path = Path(self.dir_path, "failures")
+        self.preview_dir_path = Path(self.dir_path, "preview")
+        self.partitioned_store = PartitionedStore(Path(self.syn_dir_path, "partitioned"))
+        self.manifest = Manifest(self.dir_path)
+        self._writer = BackgroundWriter(max_pending=write_queue_size) if write_queue_size > 0 else None
+        # Tables that are synthesized but not yet written
+        self._pending_writes = set()
+        # Parsed from the metadata on the first budgeted synthesis
+        self._work_rates = None
         self.meta_data_path = Path(self.dir_path, "orig_meta_data.json")
         if self.meta_data_path.exists():
             with self.meta_data_path.open("r") as file:
                 self.orig_meta_data = json.load(file)
             self.orig_file_name = self.orig_meta_data["orig_file_name"]
-            self.df_orig = get_df_from_pq(Path(self.dir_path, self.orig_file_name))
+            if not self.orig_on_disk:
+                self.df_orig = self.get_df_orig()
 
     def get_dir_path_str(self) -> str:
         return self.dir_path.as_posix()
 
     def put_df_orig(
-        self, df_orig: pd.DataFrame, orig_file_name: str, also_make_csv: bool = False
+        self,
+        df_orig: pd.DataFrame,
+        orig_file_name: str,
+        also_make_csv: bool = False,
+        pq_profile: str = "default",
     ) -> None:
+        ''' pq_profile: the parquet write profile, one of the keys of
+               PQ_WRITE_PROFILES ('default', 'fast-read', 'small', 'archive').
+        '''
         if self.df_orig is not None:
             raise ValueError("df_orig is already populated.")
         if len(self.orig_meta_data) > 0:
             raise ValueError("orig_meta_data is already populated.")
+        if pq_profile not in PQ_WRITE_PROFILES:
+            raise ValueError(f"Parquet write profile {pq_profile} not recognized.")
         self.orig_file_name = orig_file_name + ".parquet"
         # record the number of distinct values per column
 
@@ -63,17 +149,71 @@ class TablesBuilder:
             "columns": list(df_orig.columns),
             "column_dtypes": {col: str(df_orig[col].dtype) for col in df_orig.columns},
             "column_classes": best_guess_column_classification(df_orig),
+            "pq_profile": pq_profile,
+            "column_fingerprints": make_column_fingerprints(df_orig),
         }
         # Make a dict that contains the column names and their dataframe dtypes
 
-        self.df_orig = df_orig
+        if self.compact_dtypes:
+            df_orig = self._adjust_dtypes(df_orig)
+        if not self.orig_on_disk:
+            self.df_orig = df_orig
         self.orig_file_path = Path(self.dir_path, self.orig_file_name)
-        put_pq_from_df(self.orig_file_path, df_orig)
         if also_make_csv:
+            # Queued first, so that it overlaps with the parquet write
             self.orig_meta_data["orig_file_name_csv"] = self.orig_file_name + ".csv"
-            put_csv_from_df(self.orig_file_path.with_suffix(".csv"), df_orig)
+            self._write(put_csv_from_df, self.orig_file_path.with_suffix(".csv"), df_orig,
+                        task_name=self.orig_file_name + ".csv")
+        put_pq_from_df(self.orig_file_path, df_orig, profile=pq_profile,
+                       dictionary_columns=self._get_categorical_columns(df_orig.columns))
         self._save_meta_data()
 
+    def _write(self, func: Callable, *args, task_name: Optional[str] = None, **kwargs) -> None:
+        if self._writer is None:
+            func(*args, **kwargs)
+        else:
+            self._writer.submit(func, *args, task_name=task_name, **kwargs)
+
+    def flush(self) -> None:
+        ''' Waits for the background writes (see write_queue_size), and raises
+            the first write error, a BackgroundWriteError that names the table
+            whose write failed.
+        '''
+        if self._writer is not None:
+            self._writer.flush()
+
+    def _check_writes(self) -> None:
+        # An earlier table's write error is raised before a synthesis starts,
+        # so that it does not cost the new table its result
+        if self._writer is not None:
+            self._writer.check()
+
+    def _get_job_data_file_name(self, job: dict) -> str:
+        columns = self._get_synthesis_columns(job.get("columns"))
+        return make_data_file_name(self.orig_file_name, columns, target=job.get("target_column"))
+
+    def _record_write_errors(
+        self, job_results: dict, max_memory_bytes: Optional[int], max_rss_bytes: Optional[int], timeout: Optional[float]
+    ) -> None:
+        # A background write error fails the job whose table it was writing
+        if self._writer is None:
+            return
+        for error in self._writer.take_errors():
+            result = job_results.get(error.task_name)
+            if result is None:
+                raise error
+            result["status"] = "error"
+            result["error"] = repr(error.__cause__)
+            self._record_job_result(result, max_memory_bytes, max_rss_bytes, timeout)
+
+    def _syn_exists(self, data_file_name: str) -> bool:
+        return (
+            data_file_name in self._pending_writes
+            or Path(self.syn_dir_path, data_file_name + ".parquet").exists()
+            or self.partitioned_store.exists(data_file_name)
+            or self.manifest.get_table(data_file_name) is not None
+        )
+
     def set_pid_cols(self, pid_cols: list) -> None:
         self.orig_meta_data["pid_cols"] = pid_cols
         self._save_meta_data()
@@ -81,6 +221,237 @@ class TablesBuilder:
     def get_pid_cols(self) -> list:
         return self.orig_meta_data["pid_cols"]
 
+    def update_df_orig(self, df_orig: pd.DataFrame) -> list:
+        ''' Replaces the original data with an updated version that has the
+            same columns, for instance with new rows. Returns the columns whose
+            content changed. Synthetic tables built from changed columns become
+            stale (see get_stale_tables), but are served until they are rebuilt.
+        '''
+        if len(self.orig_meta_data) == 0:
+            raise ValueError("orig_meta_data is not populated. Use put_df_orig.")
+        if list(df_orig.columns) != self.orig_meta_data["columns"]:
+            raise ValueError("The updated df_orig must have the same columns as the original.")
+        old_fingerprints = self.get_column_fingerprints()
+        new_fingerprints = make_column_fingerprints(df_orig)
+        self.orig_meta_data.update(
+            {
+                "num_rows": df_orig.shape[0],
+                "num_distinct_per_column": df_orig.nunique().to_dict(),
+                "column_dtypes": {col: str(df_orig[col].dtype) for col in df_orig.columns},
+                "column_fingerprints": new_fingerprints,
+            }
+        )
+        if self.compact_dtypes:
+            df_orig = self._adjust_dtypes(df_orig)
+        orig_file_path = Path(self.dir_path, self.orig_file_name)
+        put_pq_from_df(orig_file_path, df_orig, profile=self.orig_meta_data.get("pq_profile", "default"),
+                       dictionary_columns=self._get_categorical_columns(df_orig.columns))
+        if "orig_file_name_csv" in self.orig_meta_data:
+            put_csv_from_df(orig_file_path.with_suffix(".csv"), df_orig)
+        if not self.orig_on_disk:
+            self.df_orig = df_orig
+        self._save_meta_data()
+        return [col for col in new_fingerprints if old_fingerprints.get(col) != new_fingerprints[col]]
+
+    def get_column_fingerprints(self) -> dict:
+        # Computed on first use for metadata that predates column fingerprints
+        if "column_fingerprints" not in self.orig_meta_data:
+            # The original dtypes are restored so that the fingerprints do
+            # not depend on compact_dtypes
+            df_orig = restore_df_dtypes(self.get_df_orig(), self.orig_meta_data["column_dtypes"])
+            self.orig_meta_data["column_fingerprints"] = make_column_fingerprints(df_orig)
+            self._save_meta_data()
+        return self.orig_meta_data["column_fingerprints"]
+
+    def get_fingerprint(self) -> str:
+        return combine_fingerprints(self.get_column_fingerprints())
+
+    def _get_syn_meta_datas(self) -> list:
+        # The metadata of all synthetic tables, in any storage
+        meta_datas = self.manifest.query()
+        names = {meta_data["name"] for meta_data in meta_datas}
+        for meta_data_path in sorted(self.syn_dir_path.glob("*" + self.SYN_META_DATA_SUFFIX)):
+            # Sidecars of tables that were imported into the manifest are skipped
+            if meta_data_path.name.removesuffix(self.SYN_META_DATA_SUFFIX) in names:
+                continue
+            with meta_data_path.open("r") as file:
+                meta_datas.append(json.load(file))
+        manifest = self.partitioned_store.get_manifest()
+        meta_datas += [manifest[name] for name in sorted(manifest)]
+        return meta_datas
+
+    def _get_work_rates(self) -> WorkRates:
+        # Then updated with each synthesis, rather than parsed again
+        if self._work_rates is None:
+            self._work_rates = WorkRates(self._get_syn_meta_datas())
+        return self._work_rates
+
+    def get_stale_tables(self) -> list:
+        ''' Returns the metadata of the synthetic tables that were built from
+            columns (or pid columns) that have since changed. Tables built
+            before column fingerprints were recorded count as stale.
+        '''
+        fingerprints = self.get_column_fingerprints()
+        pid_cols = self.orig_meta_data["pid_cols"]
+        stale_tables = []
+        for meta_data in self._get_syn_meta_datas():
+            if "columns" not in meta_data:
+                continue
+            built_from = meta_data.get("column_fingerprints", {})
+            expected = {col: fingerprints.get(col) for col in meta_data["columns"] + pid_cols}
+            if built_from != expected:
+                stale_tables.append(meta_data)
+        return stale_tables
+
+    def synthesize_jobs(
+        self,
+        jobs: list,
+        isolated: bool = True,
+        max_memory_bytes: int = None,
+        max_rss_bytes: int = None,
+        timeout: float = None,
+    ) -> list:
+        ''' Runs synthesize once per job, where each job is a dict of
+            synthesize arguments, e.g. {"columns": ["a", "b"]}.
+            isolated: if True, each job runs in a child process (see
+               run_isolated), so that a job that runs out of memory or time
+               does not take down the caller.
+            max_memory_bytes, max_rss_bytes, timeout: limits per isolated job.
+            A failed job is recorded in failures/ and the remaining jobs still
+            run. Returns a result dict per job, with 'status' ('ok',
+            'out_of_memory', 'timeout', or 'error'), 'error', 'elapsed_time'
+            and 'job'.
+        '''
+        # Computed once here rather than in every child process
+        self.get_column_fingerprints()
+        # Write errors from before these jobs are not theirs. Isolated jobs
+        # write in their child processes, so the writer then stays idle and
+        # holds no lock when a child is forked.
+        self.flush()
+        results = []
+        job_results = {}
+        for job in jobs:
+            self._record_write_errors(job_results, max_memory_bytes, max_rss_bytes, timeout)
+            if isolated:
+                result = run_isolated(self.synthesize, job, max_memory_bytes=max_memory_bytes,
+                                      max_rss_bytes=max_rss_bytes, timeout=timeout)
+                if result["status"] != "ok":
+                    self._remove_partial_writes(self._get_job_data_file_name(job))
+            else:
+                start_time = time.time()
+                result = {"status": "ok", "error": None}
+                try:
+                    self.synthesize(**job)
+                except MemoryError:
+                    result = {"status": "out_of_memory", "error": "MemoryError"}
+                except Exception as e:
+                    result = {"status": "error", "error": repr(e)}
+                result["elapsed_time"] = time.time() - start_time
+            result["job"] = job
+            self._record_job_result(result, max_memory_bytes, max_rss_bytes, timeout)
+            results.append(result)
+            job_results.setdefault(self._get_job_data_file_name(job), result)
+        if self._writer is not None:
+            self._writer.wait()
+        self._record_write_errors(job_results, max_memory_bytes, max_rss_bytes, timeout)
+        return results
+
+    def _remove_partial_writes(self, data_file_name: str) -> None:
+        # A killed child can leave the temporary files of put_pq_from_df behind.
+        # (A partial write to a pack of the partitioned store is freed by its
+        # compact.)
+        name = glob.escape(data_file_name)
+        partial_paths = list(self.syn_dir_path.glob(name + "*.tmp"))
+        partial_paths += self.syn_dir_path.glob(name + ".replicates/*/*.tmp")
+        for path in partial_paths:
+            path.unlink(missing_ok=True)
+
+    def _record_job_result(
+        self, result: dict, max_memory_bytes: Optional[int], max_rss_bytes: Optional[int], timeout: Optional[float]
+    ) -> None:
+        columns = self._get_synthesis_columns(result["job"].get("columns"))
+        target_column = result["job"].get("target_column")
+        data_file_name = make_data_file_name(self.orig_file_name, columns, target=target_column)
+        failure_path = Path(self.failures_dir_path, data_file_name + ".json")
+        if result["status"] == "ok":
+            failure_path.unlink(missing_ok=True)
+            return
+        self.failures_dir_path.mkdir(exist_ok=True)
+        failure = {
+            "columns": columns,
+            "target_column": target_column,
+            "status": result["status"],
+            "error": result["error"],
+            "elapsed_time": result["elapsed_time"],
+            "max_memory_bytes": max_memory_bytes,
+            "max_rss_bytes": max_rss_bytes,
+            "timeout": timeout,
+            "time": time.time(),
+        }
+        with failure_path.open("w") as file:
+            json.dump(failure, file, indent=4)
+
+    def get_failures(self) -> list:
+        failures = []
+        if self.failures_dir_path.exists():
+            for failure_path in sorted(self.failures_dir_path.glob("*.json")):
+                with failure_path.open("r") as file:
+                    failures.append(json.load(file))
+        return failures
+
+    def rebuild_stale_tables(
+        self, priority: Callable[[dict], Any] = None, save_stats: str = 'min', max_tables: int = None
+    ) -> list:
+        ''' Re-synthesizes stale tables in priority order and returns the
+            metadata of the tables that were rebuilt.
+            priority: sort key over table metadata. By default the tables with
+               the fewest columns, and then the shortest synthesis time, go first.
+            max_tables: rebuild at most this many tables.
+        '''
+        if priority is None:
+            priority = lambda meta_data: (len(meta_data["columns"]), meta_data.get("elapsed_time") or 0)
+        stale_tables = sorted(self.get_stale_tables(), key=priority)
+        if max_tables is not None:
+            stale_tables = stale_tables[:max_tables]
+        for meta_data in stale_tables:
+            # The stale table is replaced only once the new one is written
+            self.synthesize(
+                columns=list(meta_data["columns"]),
+                target_column=meta_data["target_column"],
+                save_stats=save_stats,
+                force=True,
+                pq_profile=meta_data.get("pq_profile", "default"),
+                replicates=meta_data.get("replicates", 1),
+            )
+        self.flush()
+        return stale_tables
+
+    def get_df_orig(self, columns: list = None) -> pd.DataFrame:
+        ''' Returns the original table, or only the given columns of it. With
+            orig_on_disk, the columns are read from the parquet file.
+        '''
+        if self.df_orig is not None:
+            return self.df_orig if columns is None else self.df_orig[columns]
+        df = get_df_from_pq(Path(self.dir_path, self.orig_file_name), columns=columns)
+        return self._adjust_dtypes(df)
+
+    def _get_synthesis_columns(self, columns: Optional[list]) -> list:
+        if columns is None:
+            columns = list(self.orig_meta_data["columns"])
+        # remove pid columns
+        columns = [col for col in columns if col not in self.orig_meta_data["pid_cols"]]
+        columns.sort()
+        return columns
+
+    def _adjust_dtypes(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.compact_dtypes:
+            return compact_df_dtypes(df, self.orig_meta_data["column_classes"])
+        return restore_df_dtypes(df, self.orig_meta_data["column_dtypes"])
+
+    def _get_categorical_columns(self, columns: list) -> list:
+        column_classes = self.orig_meta_data["column_classes"]
+        return [col for col in columns if column_classes.get(col) == "categorical"]
+
     def _save_meta_data(self) -> None:
         with self.meta_data_path.open("w") as file:
             json.dump(self.orig_meta_data, file, indent=4)
@@ -113,6 +484,18 @@ class TablesBuilder:
     ) -> None:
         if save_stats == 'none':
             return
+        saver = self._make_sdx_stats(syn, columns, elapsed_time, save_stats, target_column=target_column)
+        with stats_file_path.open("w") as file:
+            json.dump(saver, file, indent=4)
+
+    def _make_sdx_stats(
+        self,
+        syn: Synthesizer,
+        columns: list,
+        elapsed_time: float,
+        save_stats: str,
+        target_column: str = None,
+    ) -> dict:
         saver = {
             "columns": columns,
             "target_column": target_column,
@@ -126,8 +509,7 @@ class TablesBuilder:
         if save_stats == 'max':
             tw = TreeWalker(syn)
             saver["forest_nodes"] = tw.get_forest_nodes()
-        with stats_file_path.open("w") as file:
-            json.dump(saver, file, indent=4)
+        return saver
 
     def synthesize(
         self, 
@@ -135,13 +517,45 @@ class TablesBuilder:
         target_column: str = None,
         save_stats: str = 'min', 
         force: bool = False,
+        use_cluster_plan: bool = False,
+        pq_profile: str = "default",
+        save_marginals: bool = False,
+        replicates: int = 1,
+        preview: Optional[list] = None,
+        time_budget: Optional[float] = None,
         also_save_stats: bool = None,     # deprecated
-    ) -> None:
+    ) -> Optional[dict]:
         ''' columns: list of column names to synthesize. If None, all
                columns are synthesized.
             target_column: use as the ML target column
             save_stats: 'min', 'max', or 'none'. 'max' can be quite large.
             force: if True, synthesize even if the file already exists.
+            use_cluster_plan: if True, apply the stored cluster plan for these
+               columns instead of computing the clusters. If there is no
+               stored plan, the clusters are computed and stored as the plan.
+            pq_profile: the parquet write profile for the synthetic table.
+            save_marginals: if True, also save the 1-dim counts of each column,
+               which TablesReader.count_by uses instead of reading the table.
+            replicates: if more than 1, sample this many synthetic tables from
+               the one synthesizer, and also save them all as a partitioned
+               dataset in <data file name>.replicates. The first replicate is
+               the usual synthetic table. Not available with partitioned storage.
+            preview: a list of sample fractions (e.g. [0.01, 0.05]). If given,
+               nothing is written to syn/ or stats/. Instead, the columns are
+               synthesized from a pid-aware subsample at each fraction, and the
+               measured time, peak memory, cluster info and rough quality, plus
+               the extrapolated time and memory of the full run, are returned
+               and written to preview/<data file name>.json.
+            time_budget: seconds. If given, the sampling time is estimated from
+               the recorded synthesis times of the other tables (or, if there
+               are none, from the time taken to set up this synthesis), and if
+               the estimate exceeds what is left of the budget, the size of the
+               clusters is capped until it fits. The estimates and the applied
+               degradations are recorded under 'time_budget' in the metadata.
+               Before that, if the recorded setup times show that measuring the
+               column dependence alone would exhaust the budget, it is skipped
+               and every column is patched ('no_clustering'). The budget is a
+               target, not a hard limit.
         '''
         # also_save_stats is deprecated
         if also_save_stats is not None:
@@ -149,29 +563,160 @@ class TablesBuilder:
                 save_stats = 'max'
             else:
                 save_stats = 'none'
-        if columns is None:
-            columns = list(self.df_orig.columns)
-        # remove pid columns
-        columns = [col for col in columns if col not in self.orig_meta_data["pid_cols"]]
-        columns.sort()
+        self._check_writes()
+        columns = self._get_synthesis_columns(columns)
         data_file_name = make_data_file_name(self.orig_file_name, columns, target=target_column)
-        data_file_path = Path(self.syn_dir_path, data_file_name + ".parquet")
-        if data_file_path.exists() and not force:
+        if self.partitioned and replicates > 1:
+            raise ValueError("Replicates are not supported with partitioned storage.")
+        if self._syn_exists(data_file_name) and not force and preview is None:
             return
-        if len(self.orig_meta_data["pid_cols"]) > 0:
-            df_pid = self.df_orig[self.orig_meta_data["pid_cols"]]
+        pid_cols = self.orig_meta_data["pid_cols"]
+        # SynDiffix needs the original dtypes, not the compact ones
+        df_orig = restore_df_dtypes(self.get_df_orig(columns + pid_cols), self.orig_meta_data["column_dtypes"])
+        if preview is not None:
+            results = preview_synthesis(df_orig, columns, pid_cols, preview, target_column=target_column,
+                                        evaluator=QualityEvaluator(self.dir_path, columns=columns))
+            self.preview_dir_path.mkdir(exist_ok=True)
+            with Path(self.preview_dir_path, data_file_name + ".json").open("w") as file:
+                json.dump(results, file, indent=4)
+            return results
+        df_columns = df_orig[columns]
+        if len(pid_cols) > 0:
+            df_pid = df_orig[pid_cols]
         else:
             df_pid = None
+        plan = None
+        if use_cluster_plan:
+            plan_store = ClusterPlanStore(self.plans_dir_path)
+            plan = plan_store.get_plan(self.get_fingerprint(), columns, target_column=target_column)
+        skip_clustering = False
+        if time_budget is not None and plan is None:
+            skip_clustering = should_skip_clustering(time_budget, len(df_columns), len(columns),
+                                                     self._get_work_rates(), num_samples=replicates)
         # record start of elapsed time
         start_time = time.time()
-        syn = Synthesizer(self.df_orig[columns], pids=df_pid, target_column=target_column)
+        if plan is not None:
+            # The plan already reflects the target column, if any
+            syn = Synthesizer(df_columns, pids=df_pid, clustering=PlannedClustering(plan))
+        elif skip_clustering:
+            # Measuring column dependence alone would exceed the time budget
+            syn = Synthesizer(df_columns, pids=df_pid, clustering=NoClustering())
+        else:
+            syn = Synthesizer(df_columns, pids=df_pid, target_column=target_column)
+        setup_time = time.time() - start_time
+        budget_info = None
+        if time_budget is not None:
+            budget_info = fit_time_budget(syn, time_budget - setup_time, len(df_columns),
+                                          seconds_per_work=self._get_work_rates().get_seconds_per_work(),
+                                          setup_time=setup_time, num_samples=replicates)
+            budget_info["time_budget"] = time_budget
+            if skip_clustering:
+                budget_info["degradations"].insert(0, {"type": "no_clustering"})
+        if plan is not None or skip_clustering:
+            # Only setups that measured the clusters calibrate setup rates
+            setup_time = None
+        # The time budget models the sampling time on its own
+        sampling_start_time = time.time()
         df_syn = syn.sample()
+        sampling_time = time.time() - sampling_start_time
         elapsed_time = time.time() - start_time
-        put_pq_from_df(data_file_path, df_syn)
-        meta_data = self._build_meta_data(syn, df_syn, elapsed_time, target_column=target_column)
-        meta_data_path = Path(self.syn_dir_path, data_file_name + ".json")
-        with meta_data_path.open("w") as file:
-            json.dump(meta_data, file, indent=4)
-        if save_stats != 'none':
-            stats_file_path = Path(self.stats_dir_path, "stats_" + data_file_name + ".json")
-            self._save_sdx_stats(syn, stats_file_path, columns, elapsed_time, save_stats, target_column=target_column)
\ No newline at end of file
+        if self._work_rates is not None:
+            self._work_rates.add({"rows": len(df_syn), "columns": columns, "sampling_time": sampling_time,
+                                  "setup_time": setup_time, "cluster_info": ClusterInfo(syn).get_cluster_info()})
+        df_replicates = [df_syn] + [syn.sample() for _ in range(replicates - 1)]
+        if self.compact_dtypes:
+            df_replicates = [self._adjust_dtypes(df) for df in df_replicates]
+        # A degraded clustering is not stored as the plan
+        if use_cluster_plan and plan is None and not (budget_info and budget_info["degradations"]):
+            ci = ClusterInfo(syn)
+            plan_store.put_plan(self.get_fingerprint(), ci.get_cluster_plan(), target_column=target_column)
+        fingerprints = self.get_column_fingerprints()
+        column_fingerprints = {col: fingerprints[col] for col in columns + pid_cols}
+        self._pending_writes.add(data_file_name)
+        try:
+            self._write(
+                self._write_outputs,
+                syn,
+                df_replicates,
+                data_file_name,
+                columns,
+                target_column,
+                elapsed_time,
+                sampling_time,
+                setup_time,
+                plan is not None,
+                column_fingerprints,
+                save_stats,
+                pq_profile,
+                save_marginals,
+                budget_info,
+                task_name=data_file_name,
+            )
+        except BaseException:
+            self._pending_writes.discard(data_file_name)
+            raise
+
+    def _write_outputs(
+        self,
+        syn: Synthesizer,
+        df_replicates: list,
+        data_file_name: str,
+        columns: list,
+        target_column: Optional[str],
+        elapsed_time: float,
+        sampling_time: float,
+        setup_time: Optional[float],
+        used_cluster_plan: bool,
+        column_fingerprints: dict,
+        save_stats: str,
+        pq_profile: str,
+        save_marginals: bool,
+        budget_info: Optional[dict],
+    ) -> None:
+        try:
+            df_syn = df_replicates[0]
+            data_file_path = Path(self.syn_dir_path, data_file_name + ".parquet")
+            if not self.partitioned:
+                put_pq_from_df(data_file_path, df_syn, profile=pq_profile,
+                               dictionary_columns=self._get_categorical_columns(df_syn.columns))
+            if len(df_replicates) > 1:
+                put_pq_replicates(Path(self.syn_dir_path, data_file_name + ".replicates"), df_replicates,
+                                  profile=pq_profile,
+                                  dictionary_columns=self._get_categorical_columns(df_syn.columns))
+            if save_marginals:
+                self.marginals_dir_path.mkdir(exist_ok=True)
+                put_marginals(Path(self.marginals_dir_path, data_file_name + ".parquet"), df_syn)
+            meta_data = self._build_meta_data(syn, df_syn, elapsed_time, target_column=target_column)
+            meta_data["sampling_time"] = sampling_time
+            if setup_time is not None:
+                meta_data["setup_time"] = setup_time
+            meta_data["used_cluster_plan"] = used_cluster_plan
+            meta_data["pq_profile"] = pq_profile
+            meta_data["compact_dtypes"] = self.compact_dtypes
+            meta_data["replicates"] = len(df_replicates)
+            meta_data["column_fingerprints"] = column_fingerprints
+            if budget_info is not None:
+                meta_data["time_budget"] = budget_info
+            if self.partitioned:
+                # The table and its metadata, in that order
+                self.partitioned_store.put_table(data_file_name, df_syn, None if self.use_manifest else meta_data,
+                                                 profile=pq_profile,
+                                                 dictionary_columns=self._get_categorical_columns(df_syn.columns))
+                data_file_path = self.partitioned_store.get_table_path(data_file_name)
+            elif not self.use_manifest:
+                meta_data_path = Path(self.syn_dir_path, data_file_name + self.SYN_META_DATA_SUFFIX)
+                with meta_data_path.open("w") as file:
+                    json.dump(meta_data, file, indent=4)
+            stats = None
+            if save_stats != 'none' and (self.partitioned or self.use_manifest):
+                stats = self._make_sdx_stats(syn, columns, elapsed_time, save_stats, target_column=target_column)
+            if self.use_manifest:
+                # The metadata and stats in one transaction
+                self.manifest.put_table(data_file_name, meta_data, data_file_path, stats=stats)
+            elif stats is not None:
+                self.partitioned_store.put_stats(data_file_name, stats)
+            elif save_stats != 'none':
+                stats_file_path = Path(self.stats_dir_path, "stats_" + data_file_name + ".json")
+                self._save_sdx_stats(syn, stats_file_path, columns, elapsed_time, save_stats, target_column=target_column)
+        finally:
+            self._pending_writes.discard(data_file_name)
\ No newline at end of file
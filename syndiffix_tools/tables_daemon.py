@@ -0,0 +1,264 @@
+import hashlib
+import json
+import mmap
+import os
+import socket
+import socketserver
+import struct
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from syndiffix_tools.frame_cache import FrameCache
+from syndiffix_tools.multi_tables_reader import MultiTablesReader
+from syndiffix_tools.tables_reader import TablesReader, open_entry
+
+# Messages are a JSON header, optionally followed by a payload, each
+# preceded by its length as an 8-byte unsigned integer.
+_LENGTH = struct.Struct("!Q")
+
+
+def _send_message(sock: socket.socket, header: dict, payload: Optional[pa.Buffer] = None) -> None:
+    header_bytes = json.dumps(header).encode()
+    sock.sendall(_LENGTH.pack(len(header_bytes)) + header_bytes)
+    if payload is not None:
+        sock.sendall(_LENGTH.pack(payload.size))
+        sock.sendall(memoryview(payload))
+
+
+def _recv_exactly(sock: socket.socket, num_bytes: int) -> bytearray:
+    data = bytearray(num_bytes)
+    view = memoryview(data)
+    received = 0
+    while received < num_bytes:
+        count = sock.recv_into(view[received:], num_bytes - received)
+        if count == 0:
+            raise ConnectionError("Connection closed before the message was complete.")
+        received += count
+    return data
+
+
+def _recv_header(sock: socket.socket) -> dict:
+    (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return json.loads(_recv_exactly(sock, length).decode())
+
+
+def _recv_payload(sock: socket.socket) -> bytearray:
+    (length,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return _recv_exactly(sock, length)
+
+
+class TablesDaemon:
+    """
+    Serves synthetic tables to many local processes over a Unix socket, so
+    that the catalog is scanned once and each table is decoded once per host.
+
+    Tables are sent as Arrow IPC streams. If shm_dir is given (normally a
+    directory in /dev/shm), each table is instead written there once as an
+    Arrow IPC file, and clients memory-map it, sharing the same pages. The
+    client is sent an open descriptor of the file (SCM_RIGHTS) rather than
+    its path, so a file that is removed before the client maps it stays
+    readable. The files are held to max_cache_bytes as well (least recently
+    used first), and the file of a rewritten table is replaced. Tables are
+    converted outside of the lock on the files, so requests for other tables
+    do not wait for a conversion. shutdown removes the files.
+
+    Inputs:
+        - reader: TablesReader or MultiTablesReader. Requests are routed to
+              its get_best_entry (with a 'dataset' for MultiTablesReader).
+        - socket_path: str or Path. The Unix socket to listen on.
+        - max_cache_bytes: int. The memory budget for the IPC buffers, and
+              separately for the files in shm_dir.
+        - shm_dir: str or Path. Optional directory for shared IPC files.
+    """
+
+    def __init__(
+        self,
+        reader: Union[TablesReader, MultiTablesReader],
+        socket_path: Union[str, Path],
+        max_cache_bytes: int = 2**30,
+        shm_dir: Optional[Union[str, Path]] = None,
+    ) -> None:
+        self.reader = reader
+        self.socket_path = Path(socket_path)
+        self.max_cache_bytes = max_cache_bytes
+        self.buffer_cache = FrameCache(max_cache_bytes)
+        self.shm_dir = Path(shm_dir) if shm_dir is not None else None
+        if self.shm_dir is not None:
+            self.shm_dir.mkdir(parents=True, exist_ok=True)
+        self._shm_lock = threading.Lock()
+        # The file in shm_dir of each table, by table path, in LRU order
+        self._shm_files = OrderedDict()
+        self._shm_bytes = 0
+        self.server = None
+        self._thread = None
+
+    def _get_entry(self, request: dict) -> Optional[dict]:
+        if isinstance(self.reader, MultiTablesReader):
+            return self.reader.get_best_entry(request["dataset"], request.get("columns"), request.get("target"))
+        return self.reader.get_best_entry(request.get("columns"), target=request.get("target"))
+
+    def _get_key(self, entry: dict) -> str:
+        # The modification time (or place in a pack) is included so that
+        # rewritten tables are reloaded
+        if entry.get("location") is not None:
+            location = entry["location"]
+            return f"{location['pack'].resolve().as_posix()}:{location['offset']}"
+        dataset_path = entry["dataset_path"]
+        return f"{dataset_path.resolve().as_posix()}:{dataset_path.stat().st_mtime_ns}"
+
+    def _get_ipc_buffer(self, entry: dict) -> pa.Buffer:
+        key = self._get_key(entry)
+        buffer = self.buffer_cache.get(key)
+        if buffer is None:
+            table = pq.read_table(open_entry(entry))
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            buffer = sink.getvalue()
+            self.buffer_cache.put(key, buffer, num_bytes=buffer.size)
+        return buffer
+
+    def _get_shm_fd(self, entry: dict) -> int:
+        # Opened under the lock, so that the file cannot be removed first
+        name = hashlib.sha256(self._get_key(entry).encode()).hexdigest()[:16]
+        shm_path = Path(self.shm_dir, name + ".arrow")
+        table_key = entry["dataset_path"].resolve().as_posix()
+        with self._shm_lock:
+            if table_key in self._shm_files and self._shm_files[table_key][0] == shm_path:
+                self._shm_files.move_to_end(table_key)
+                return os.open(shm_path, os.O_RDONLY)
+        # Concurrent requests for a new table may each convert it, to the
+        # same content
+        table = pq.read_table(open_entry(entry))
+        tmp_path = shm_path.with_name(f"{name}.{threading.get_ident()}.tmp")
+        try:
+            with pa.OSFile(tmp_path.as_posix(), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        with self._shm_lock:
+            os.replace(tmp_path, shm_path)
+            fd = os.open(shm_path, os.O_RDONLY)
+            if table_key in self._shm_files and self._shm_files[table_key][0] == shm_path:
+                self._shm_files.move_to_end(table_key)
+            else:
+                # The file of an older version of the table is replaced
+                self._remove_shm_file(table_key)
+                self._shm_files[table_key] = (shm_path, os.fstat(fd).st_size)
+                self._shm_bytes += self._shm_files[table_key][1]
+            # The new file is kept even if it alone exceeds the budget
+            while self._shm_bytes > self.max_cache_bytes and len(self._shm_files) > 1:
+                self._remove_shm_file(next(iter(self._shm_files)))
+        return fd
+
+    def _remove_shm_file(self, table_key: str) -> None:
+        if table_key in self._shm_files:
+            shm_path, num_bytes = self._shm_files.pop(table_key)
+            self._shm_bytes -= num_bytes
+            shm_path.unlink(missing_ok=True)
+
+    def handle(self, sock: socket.socket) -> None:
+        request = _recv_header(sock)
+        try:
+            entry = self._get_entry(request)
+            if entry is None:
+                _send_message(sock, {"status": "ok", "kind": "none"})
+            elif self.shm_dir is not None and request.get("shared", True):
+                fd = self._get_shm_fd(entry)
+                try:
+                    _send_message(sock, {"status": "ok", "kind": "shm"})
+                    socket.send_fds(sock, [b"\0"], [fd])
+                finally:
+                    os.close(fd)
+            else:
+                _send_message(sock, {"status": "ok", "kind": "ipc"}, self._get_ipc_buffer(entry))
+        except Exception as e:
+            _send_message(sock, {"status": "error", "error": repr(e)})
+
+    def start(self) -> None:
+        # Serves requests in a background thread, one thread per connection
+        daemon = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                daemon.handle(self.request)
+
+        self.socket_path.unlink(missing_ok=True)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path.as_posix(), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self) -> None:
+        self.start()
+        self._thread.join()
+
+    def shutdown(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.socket_path.unlink(missing_ok=True)
+        if self.shm_dir is not None:
+            with self._shm_lock:
+                for table_key in list(self._shm_files):
+                    self._remove_shm_file(table_key)
+            try:
+                self.shm_dir.rmdir()
+            except OSError:
+                # Not empty, so not only ours
+                pass
+
+
+class TablesClient:
+    """
+    Fetches synthetic tables from a TablesDaemon.
+
+    Inputs:
+        - socket_path: str or Path. The daemon's Unix socket.
+    """
+
+    def __init__(self, socket_path: Union[str, Path]) -> None:
+        self.socket_path = Path(socket_path)
+
+    def get_best_syn_table(
+        self, columns: list = None, target: str = None, dataset: str = None, shared: bool = True
+    ) -> Optional[pa.Table]:
+        ''' Returns the best matching table as an Arrow table, or None. With
+            shared (and a daemon using shm_dir), the table is memory-mapped
+            from shared memory rather than copied over the socket.
+        '''
+        request = {"columns": columns, "target": target, "dataset": dataset, "shared": shared}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path.as_posix())
+            _send_message(sock, request)
+            header = _recv_header(sock)
+            if header["status"] != "ok":
+                raise RuntimeError(f"TablesDaemon error: {header['error']}")
+            if header["kind"] == "none":
+                return None
+            if header["kind"] == "shm":
+                _, fds, _, _ = socket.recv_fds(sock, 1, 1)
+                try:
+                    # The Arrow buffers keep the mapping alive
+                    mapped = mmap.mmap(fds[0], 0, access=mmap.ACCESS_READ)
+                finally:
+                    os.close(fds[0])
+                return pa.ipc.open_file(pa.py_buffer(mapped)).read_all()
+            return pa.ipc.open_stream(pa.py_buffer(_recv_payload(sock))).read_all()
+
+    def get_best_syn_df(
+        self, columns: list = None, target: str = None, dataset: str = None
+    ) -> Optional[pd.DataFrame]:
+        table = self.get_best_syn_table(columns=columns, target=target, dataset=dataset)
+        if table is None:
+            return None
+        return table.to_pandas()
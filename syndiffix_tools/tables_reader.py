@@ -5,13 +5,66 @@ from pathlib import Path
 from typing import Union, Optional
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from syndiffix.synthesizer import Synthesizer
 
+from syndiffix_tools.aggregates import aggregate_table, get_marginal
+
 from syndiffix_tools.cluster_info import *
 from syndiffix_tools.common_tasks import *
+from syndiffix_tools.frame_cache import FrameCache
+from syndiffix_tools.manifest import Manifest
+from syndiffix_tools.partitioned_store import PartitionedStore, open_location
 from syndiffix_tools.tree_walker import *
 
 
+def load_catalog(syn_dir_path: Path) -> list:
+    ''' Returns the catalog entries (metadata plus 'name', 'dataset_path',
+        'location' and 'df') of the synthetic tables of a syn directory, in
+        any storage. Read tables with open_entry.
+    '''
+    catalog = []
+    partitioned_store = PartitionedStore(Path(syn_dir_path, "partitioned"))
+    locations = partitioned_store.get_locations()
+    # Tables in the manifest, loaded with one query
+    for meta_data in Manifest(syn_dir_path.parent).query():
+        meta_data['dataset_path'] = meta_data.pop('file_path')
+        meta_data['location'] = locations.get(meta_data['name'])
+        meta_data['df'] = None
+        catalog.append(meta_data)
+    in_manifest = {entry['name'] for entry in catalog}
+    for meta_data_path in syn_dir_path.iterdir():
+        if meta_data_path.suffix == ".json" and meta_data_path.stem not in in_manifest:
+            with meta_data_path.open("r") as file:
+                meta_data = json.load(file)
+            dataset_path = meta_data_path.with_suffix(".parquet")
+            # convert dataset_path to a string
+            if not dataset_path.exists():
+                raise FileNotFoundError(f"Dataset file {dataset_path.as_posix()} does not exist.")
+            meta_data['name'] = dataset_path.stem
+            meta_data['dataset_path'] = dataset_path
+            meta_data['location'] = None
+            meta_data['df'] = None
+            catalog.append(meta_data)
+    # Tables in partitioned storage, listed from its manifest
+    for name, meta_data in partitioned_store.get_manifest().items():
+        meta_data['dataset_path'] = partitioned_store.get_table_path(name)
+        meta_data['location'] = locations[name]
+        meta_data['df'] = None
+        catalog.append(meta_data)
+    return catalog
+
+
+def open_entry(entry: dict):
+    ''' Returns what pd.read_parquet and pq.read_table read a catalog entry's
+        table from: its path, or a reader over its part of a pack file.
+    '''
+    if entry.get('location') is not None:
+        return open_location(entry['location'])
+    return entry['dataset_path']
+
+
 class TablesReader:
     """
     This class takes the synthetic datasets and metadata generated by TablesManager
@@ -25,9 +78,23 @@ class TablesReader:
               datasets and other metadata are stored.
         - cache: bool. If True, the synthetic datasets are cached in memory
               as they are retrieved.
+        - frame_cache: FrameCache. If given, the synthetic datasets are cached
+              here instead, within the FrameCache's memory budget. This allows
+              several readers to share one budget.
+        - access_log: bool. If True, each request is appended to
+              access_log.jsonl next to the syn directory, for StorageManager.
+        - catalog: list. If given, these catalog entries (see load_catalog)
+              are used instead of scanning dir_path.
     """
 
-    def __init__(self, dir_path: Union[str, Path], cache: bool = False) -> None:
+    def __init__(
+        self,
+        dir_path: Union[str, Path],
+        cache: bool = False,
+        frame_cache: Optional[FrameCache] = None,
+        access_log: bool = False,
+        catalog: Optional[list] = None,
+    ) -> None:
         if type(dir_path) == str:
             self.syn_dir_path = Path(dir_path)
         else:
@@ -35,27 +102,47 @@ class TablesReader:
         if not self.syn_dir_path.exists():
             raise FileNotFoundError(f"Directory {self.syn_dir_path} does not exist.")
         self.cache = cache
+        self.frame_cache = frame_cache
+        # Aggregates are small, so all computed aggregates are kept
+        self.aggregate_cache = {}
+        # synthesize(save_marginals=True) puts precomputed 1-dim counts here
+        self.marginals_dir_path = Path(self.syn_dir_path.parent, "marginals")
+        self.access_log_path = Path(self.syn_dir_path.parent, "access_log.jsonl") if access_log else None
         self.catalog = None
         self.all_columns = []
-        self._build_catalog()
-
-    def _build_catalog(self) -> None:
-        self.catalog = []
-        for meta_data_path in self.syn_dir_path.iterdir():
-            if meta_data_path.suffix == ".json":
-                with meta_data_path.open("r") as file:
-                    meta_data = json.load(file)
-                dataset_path = meta_data_path.with_suffix(".parquet")
-                # convert dataset_path to a string
-                if not dataset_path.exists():
-                    raise FileNotFoundError(f"Dataset file {dataset_path.as_posix()} does not exist.")
-                meta_data['dataset_path'] = dataset_path
-                meta_data['df'] = None
-                if len(meta_data["columns"]) > len(self.all_columns):
-                    self.all_columns = meta_data["columns"]
-                self.catalog.append(meta_data)
+        self._build_catalog(catalog)
+
+    def _build_catalog(self, catalog: Optional[list] = None) -> None:
+        self.catalog = catalog if catalog is not None else load_catalog(self.syn_dir_path)
+        for entry in self.catalog:
+            if len(entry["columns"]) > len(self.all_columns):
+                self.all_columns = entry["columns"]
 
     def get_best_syn_df(self, columns: list = None, target: str = None) -> Optional[pd.DataFrame]:
+        best_match_entry = self.get_best_entry(columns, target=target)
+        self._log_access(best_match_entry, columns, target)
+        if best_match_entry is not None:
+            return self._load_entry(best_match_entry)
+        else:
+            return None
+
+    def _log_access(self, entry: Optional[dict], columns: Optional[list], target: Optional[str]) -> None:
+        if self.access_log_path is None:
+            return
+        access = {
+            "time": time.time(),
+            "file": entry['name'] + ".parquet" if entry is not None else None,
+            "columns": columns,
+            "target": target,
+        }
+        with self.access_log_path.open("a") as file:
+            file.write(json.dumps(access) + "\n")
+
+    def get_best_entry(self, columns: list = None, target: str = None, replicates: bool = False) -> Optional[dict]:
+        ''' Returns the catalog entry of the table with the fewest columns
+            that contains all of the requested columns. With replicates, only
+            tables synthesized with more than one replicate are considered.
+        '''
         if columns is None:
             columns = self.all_columns
         best_match_columns = None
@@ -63,17 +150,84 @@ class TablesReader:
         for entry in self.catalog:
             if target is not None and entry["target_column"] != target:
                 continue
+            if replicates and entry.get("replicates", 1) <= 1:
+                continue
             entry_columns = entry["columns"]
             if all(col in entry_columns for col in columns):
                 if best_match_columns is None or len(entry_columns) < len(best_match_columns):
                     best_match_columns = entry_columns
                     best_match_entry = entry
-        if best_match_entry is not None:
-            if best_match_entry['df'] is not None:
-                return best_match_entry['df']
-            best_match_df = pd.read_parquet(best_match_entry['dataset_path'])
-            if self.cache:
-                best_match_entry['df'] = best_match_df
-            return best_match_df
+        return best_match_entry
+
+    def get_best_syn_replicates(
+        self, columns: list = None, target: str = None, replicate: int = None
+    ) -> Optional[pd.DataFrame]:
+        ''' As get_best_syn_df, but among the tables synthesized with
+            replicates, and returns one replicate or all of them (with a
+            'replicate' column).
+        '''
+        best_match_entry = self.get_best_entry(columns, target=target, replicates=True)
+        if best_match_entry is None:
+            return None
+        dir_path = best_match_entry['dataset_path'].with_suffix(".replicates")
+        return get_df_from_pq_replicates(dir_path, replicate=replicate)
+
+    def count_by(self, columns: list, bins: dict = None, target: str = None) -> Optional[pd.DataFrame]:
+        ''' Returns the number of rows per distinct combination of values of
+            columns (column 'count'), taken from the best matching table.
+            bins maps continuous columns to a number of equal-width bins or a
+            list of bin edges; values are then replaced by their bin's lower
+            edge. Returns None if no table contains the columns.
+        '''
+        return self._aggregate(columns, bins, target)
+
+    def sum_by(
+        self, columns: list, sum_column: str, bins: dict = None, target: str = None
+    ) -> Optional[pd.DataFrame]:
+        ''' As count_by, and also the sum of sum_column per group (column 'sum').
+        '''
+        return self._aggregate(columns, bins, target, sum_column=sum_column)
+
+    def _aggregate(
+        self, columns: list, bins: Optional[dict], target: Optional[str], sum_column: str = None
+    ) -> Optional[pd.DataFrame]:
+        needed_columns = list(columns) + ([sum_column] if sum_column is not None else [])
+        entry = self.get_best_entry(needed_columns, target=target)
+        self._log_access(entry, needed_columns, target)
+        if entry is None:
+            return None
+        bins_key = tuple(sorted((col, str(col_bins)) for col, col_bins in bins.items())) if bins else None
+        key = (entry['dataset_path'], tuple(columns), bins_key, sum_column)
+        if key in self.aggregate_cache:
+            return self.aggregate_cache[key]
+        marginals_path = Path(self.marginals_dir_path, entry['name'] + ".parquet")
+        if len(columns) == 1 and not bins and sum_column is None and marginals_path.exists():
+            result = get_marginal(marginals_path, columns[0])
         else:
-            return None
\ No newline at end of file
+            df = self._get_cached_df(entry)
+            if df is not None:
+                table = pa.Table.from_pandas(df[needed_columns], preserve_index=False)
+            else:
+                # Only the needed columns are read
+                table = pq.read_table(open_entry(entry), columns=needed_columns)
+            result = aggregate_table(table, list(columns), bins=bins, sum_column=sum_column)
+        self.aggregate_cache[key] = result
+        return result
+
+    def _get_cached_df(self, entry: dict) -> Optional[pd.DataFrame]:
+        if entry['df'] is not None:
+            return entry['df']
+        if self.frame_cache is not None:
+            return self.frame_cache.get(entry['dataset_path'])
+        return None
+
+    def _load_entry(self, entry: dict) -> pd.DataFrame:
+        df = self._get_cached_df(entry)
+        if df is not None:
+            return df
+        df = pd.read_parquet(open_entry(entry))
+        if self.frame_cache is not None:
+            self.frame_cache.put(entry['dataset_path'], df)
+        elif self.cache:
+            entry['df'] = df
+        return df
@@ -0,0 +1,189 @@
+import statistics
+from bisect import insort
+from typing import Optional
+
+from syndiffix import Synthesizer
+
+from syndiffix_tools.cluster_info import ClusterInfo
+
+
+def estimate_work(num_rows: int, cluster_widths: list) -> float:
+    ''' A cluster of w columns (stitch columns included) is sampled from a
+        w-dim tree, which is refined from all of its lower-dim subtrees, so
+        the work grows as num_rows * (2**w - 1).
+    '''
+    return float(num_rows) * sum(2 ** width - 1 for width in cluster_widths)
+
+
+def estimate_setup_work(num_rows: int, num_columns: int, clustering_sample_size: int = 1000) -> float:
+    ''' The Synthesizer builds a 1-dim tree per column, and to measure the
+        dependence between columns, the 2-dim trees of all pairs of columns
+        on a sample of the rows.
+    '''
+    num_pairs = num_columns * (num_columns - 1) / 2
+    return float(num_rows) * num_columns + float(min(num_rows, clustering_sample_size)) * 3 * num_pairs
+
+
+def get_plan_widths(plan: dict) -> list:
+    widths = [len(plan["initial_cluster"])]
+    widths += [len(stitch_columns) + len(derived_columns) for _, stitch_columns, derived_columns in
+               plan["derived_clusters"]]
+    return widths
+
+
+class WorkRates:
+    """
+    The seconds per unit of sampling work (see estimate_work) and of setup
+    work (see estimate_setup_work) of recorded syntheses. The rates are kept
+    sorted, so that a builder can add each new synthesis and take the
+    medians without parsing all metadata again.
+
+    elapsed_time also includes the setup of the Synthesizer, which
+    estimate_work does not model, so only metadata with sampling_time gives
+    a sampling rate, and only metadata with setup_time a setup rate.
+
+    Inputs:
+        - meta_datas: list. The metadata of synthetic tables.
+    """
+
+    def __init__(self, meta_datas: list = ()) -> None:
+        self.sampling_rates = []
+        self.setup_rates = []
+        for meta_data in meta_datas:
+            self.add(meta_data)
+
+    def add(self, meta_data: dict) -> None:
+        if not meta_data.get("rows") or not meta_data.get("cluster_info"):
+            return
+        if meta_data.get("sampling_time"):
+            widths = [len(cluster["cluster_id"]) for cluster in meta_data["cluster_info"]]
+            insort(self.sampling_rates, meta_data["sampling_time"] / estimate_work(meta_data["rows"], widths))
+        if meta_data.get("setup_time") and meta_data.get("columns"):
+            setup_work = estimate_setup_work(meta_data["rows"], len(meta_data["columns"]))
+            insort(self.setup_rates, meta_data["setup_time"] / setup_work)
+
+    def get_seconds_per_work(self) -> Optional[float]:
+        return statistics.median(self.sampling_rates) if len(self.sampling_rates) > 0 else None
+
+    def get_seconds_per_setup_work(self) -> Optional[float]:
+        return statistics.median(self.setup_rates) if len(self.setup_rates) > 0 else None
+
+
+def get_seconds_per_work(meta_datas: list) -> Optional[float]:
+    ''' Returns the median seconds per unit of sampling work over the
+        synthetic tables whose metadata records a sampling time and clusters,
+        or None if there are none (see WorkRates).
+    '''
+    return WorkRates(meta_datas).get_seconds_per_work()
+
+
+def should_skip_clustering(
+    time_budget: float,
+    num_rows: int,
+    num_columns: int,
+    rates: WorkRates,
+    num_samples: int = 1,
+) -> bool:
+    ''' Decides, before the Synthesizer is built, whether measuring column
+        dependence (most of the setup of a wide table) would by itself leave
+        no time to sample even with every column patched. The Synthesizer is
+        then built with NoClustering. False if there are no recorded rates.
+    '''
+    seconds_per_setup_work = rates.get_seconds_per_setup_work()
+    if seconds_per_setup_work is None or num_columns < 2:
+        return False
+    seconds_per_work = rates.get_seconds_per_work() or 0.0
+    setup_time = seconds_per_setup_work * estimate_setup_work(num_rows, num_columns)
+    sampling_time = num_samples * seconds_per_work * estimate_work(num_rows, [1] * num_columns)
+    return setup_time + sampling_time > time_budget
+
+
+def limit_cluster_size(plan: dict, max_size: int) -> dict:
+    ''' Returns a copy of the cluster plan (see ClusterInfo.get_cluster_plan)
+        where no cluster has more than max_size columns. The columns cut from
+        the initial cluster are stitched to its first column, and the derived
+        columns of a cluster that is too wide are split over several clusters
+        with the same (possibly fewer) stitch columns. With max_size 1, all
+        columns but one are patched.
+    '''
+    if max_size < 1:
+        raise ValueError("max_size must be at least 1.")
+
+    def chunk(columns: list, size: int) -> list:
+        return [columns[i:i + size] for i in range(0, len(columns), size)]
+
+    initial_cluster = plan["initial_cluster"][:max_size]
+    initial_stitch = initial_cluster[:1] if max_size > 1 else []
+    derived_clusters = [
+        ["shared", list(initial_stitch), columns]
+        for columns in chunk(plan["initial_cluster"][max_size:], max_size - len(initial_stitch))
+    ]
+    for owner, stitch_columns, derived_columns in plan["derived_clusters"]:
+        stitch_columns = stitch_columns[:max_size - 1]
+        for columns in chunk(derived_columns, max_size - len(stitch_columns)):
+            derived_clusters.append([owner, list(stitch_columns), columns])
+    return dict(plan, initial_cluster=initial_cluster, derived_clusters=derived_clusters)
+
+
+def apply_cluster_plan(syn: Synthesizer, plan: dict) -> None:
+    ''' Replaces the clusters of a Synthesizer that has not sampled yet.
+    '''
+    ci = ClusterInfo(syn)
+    # Stitch columns are checked against the prior clusters, so start empty
+    syn.clusters.derived_clusters.clear()
+    ci.put_initial_cluster(plan["initial_cluster"], final=len(plan["derived_clusters"]) == 0)
+    for i, (owner, stitch_columns, derived_columns) in enumerate(plan["derived_clusters"]):
+        ci.put_derived_cluster(owner=owner, stitch_columns=stitch_columns, derived_columns=derived_columns,
+                               final=i == len(plan["derived_clusters"]) - 1)
+
+
+def fit_time_budget(
+    syn: Synthesizer,
+    time_left: float,
+    num_rows: int,
+    seconds_per_work: Optional[float] = None,
+    setup_time: float = 0.0,
+    num_samples: int = 1,
+) -> dict:
+    ''' Estimates the time for num_samples calls of syn.sample(), and if that
+        exceeds time_left, caps the cluster size of syn at the largest size
+        whose estimate fits. seconds_per_work comes from recorded syntheses
+        (see get_seconds_per_work). If None, it is calibrated from setup_time,
+        the time the Synthesizer took to build its 1-dim trees and measure
+        column dependence. That only measures the speed of this machine on
+        this data: tree building per row and column costs roughly the same as
+        sampling per row and tree, but the two are not the same work, so the
+        calibrated estimate is rough (within a small factor) and is marked
+        with rate_source 'calibrated'. It is only used until the first table
+        of the directory records its sampling_time.
+        Returns a dict for the table metadata with the estimates and the
+        list of degradations that were applied.
+    '''
+    plan = ClusterInfo(syn).get_cluster_plan()
+    num_columns = len(plan["columns"])
+    rate_source = "recorded"
+    if seconds_per_work is None:
+        rate_source = "calibrated"
+        seconds_per_work = setup_time / estimate_setup_work(num_rows, num_columns)
+
+    def estimate(plan: dict) -> float:
+        return num_samples * seconds_per_work * estimate_work(num_rows, get_plan_widths(plan))
+
+    budget_info = {
+        "time_left": time_left,
+        "seconds_per_work": seconds_per_work,
+        "rate_source": rate_source,
+        "estimated_time_undegraded": estimate(plan),
+        "degradations": [],
+    }
+    max_size = max(get_plan_widths(plan))
+    degraded_plan = plan
+    while estimate(degraded_plan) > time_left and max_size > 1:
+        max_size -= 1
+        degraded_plan = limit_cluster_size(plan, max_size)
+    if degraded_plan is not plan:
+        apply_cluster_plan(syn, degraded_plan)
+        budget_info["degradations"].append({"type": "max_cluster_size", "value": max_size})
+    budget_info["estimated_time"] = estimate(degraded_plan)
+    budget_info["fits_budget"] = budget_info["estimated_time"] <= time_left
+    return budget_info
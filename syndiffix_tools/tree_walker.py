@@ -1,5 +1,6 @@
 import random
 import string
+from typing import Callable, Iterator, Optional
 
 from syndiffix import Synthesizer
 from syndiffix.tree import Branch, Leaf, Node
@@ -61,9 +62,50 @@ class TreeWalker:
     def __init__(self, sdx: Synthesizer):
         self.sdx = sdx
 
-    def forest_walker(self):
-        for col_id, root in self.sdx.forest._tree_cache.items():
-            yield col_id, root
+    def forest_walker(self, combinations: Optional[list] = None):
+        ''' combinations: only walk the trees of these column combinations.
+               Each combination is a list of column indices or column names.
+        '''
+        if combinations is None:
+            for col_id, root in self.sdx.forest._tree_cache.items():
+                yield col_id, root
+            return
+        for comb in self._normalize_combinations(combinations):
+            root = self.sdx.forest._tree_cache.get(comb)
+            if root is not None:
+                yield comb, root
+
+    def _normalize_combinations(self, combinations: list) -> list:
+        column_ids = {name: i for i, name in enumerate(self.sdx.forest.columns)}
+        normalized = []
+        for comb in combinations:
+            try:
+                ids = [column_ids[col] if isinstance(col, str) else int(col) for col in comb]
+            except KeyError as e:
+                raise ValueError(f"Column {e.args[0]} not found.")
+            normalized.append(tuple(sorted(ids)))
+        return normalized
+
+    def filtered_tree_walker(
+        self,
+        node: Node,
+        max_depth: Optional[int] = None,
+        prune: Optional[Callable[[Node, int], bool]] = None,
+    ) -> Iterator[tuple]:
+        ''' Yields (node, parent, depth) for the nodes of a tree, with the
+            root at depth 0. Subtrees below max_depth, and subtrees whose root
+            node makes prune(node, depth) return True, are not visited.
+        '''
+        stack = [(node, None, 0)]
+        while stack:
+            node, parent, depth = stack.pop()
+            if prune is not None and prune(node, depth):
+                continue
+            yield node, parent, depth
+            if isinstance(node, Branch) and (max_depth is None or depth < max_depth):
+                # reversed so that children are visited in order
+                for child_node in reversed(list(node.children.values())):
+                    stack.append((child_node, node, depth + 1))
 
     def tree_walker(self, node: Node, parent: Node = None):
         nodes = []
@@ -123,15 +165,53 @@ class TreeWalker:
             seed += str(col_index) + "_"
         for si in node.snapped_intervals:
             seed += str(si.min) + "_" + str(si.max) + "_"
-        random.seed(seed)
+        # A local generator, so that walks on other threads do not interfere
         return "nid:" + "".join(
-            random.choices(string.ascii_lowercase + string.digits, k=6)
+            random.Random(seed).choices(string.ascii_lowercase + string.digits, k=6)
         )
 
-    def get_forest_nodes(self):
+    def get_forest_nodes(
+        self,
+        combinations: Optional[list] = None,
+        node_type: Optional[str] = None,
+        max_depth: Optional[int] = None,
+        singularity: Optional[bool] = None,
+        over_threshold: Optional[bool] = None,
+        predicate: Optional[Callable[[Node, int], bool]] = None,
+        prune: Optional[Callable[[Node, int], bool]] = None,
+        include_depth: bool = False,
+    ):
+        ''' With no arguments, returns the node info of every node of every
+            tree. The arguments restrict this:
+            combinations: only these column combinations (see forest_walker).
+            node_type: 'leaf' or 'branch'.
+            max_depth: only nodes at most this deep (the root is at depth 0).
+            singularity, over_threshold: only nodes with this flag value.
+            predicate: only nodes for which predicate(node, depth) is True.
+            prune: skip the subtrees for which prune(node, depth) is True.
+            include_depth: if True, add the node's depth to its info as 'depth'.
+            max_depth and prune skip whole subtrees. The other filters are
+            checked per node, before the node info is built.
+        '''
+        if node_type not in (None, "leaf", "branch"):
+            raise ValueError(f"node_type {node_type} not recognized. Must be 'leaf' or 'branch'.")
+        low_threshold = self.sdx.forest.anonymization_params.low_count_params.low_threshold
+
         forest = {}
-        for col_id, root in self.forest_walker():
-            for node, parent in self.tree_walker(root):
+        for col_id, root in self.forest_walker(combinations):
+            for node, parent, depth in self.filtered_tree_walker(root, max_depth=max_depth, prune=prune):
+                if node_type == "leaf" and not isinstance(node, Leaf):
+                    continue
+                if node_type == "branch" and not isinstance(node, Branch):
+                    continue
+                if singularity is not None and node.is_singularity() != singularity:
+                    continue
+                if over_threshold is not None and node.is_over_threshold(low_threshold) != over_threshold:
+                    continue
+                if predicate is not None and not predicate(node, depth):
+                    continue
                 ni = self.node_info(node=node, parent=parent)
+                if include_depth:
+                    ni["depth"] = depth
                 forest[ni["node_id"]] = ni
         return forest
\ No newline at end of file
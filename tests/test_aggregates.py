@@ -0,0 +1,49 @@
+import pyarrow as pa
+
+from syndiffix_tools.aggregates import *
+from syndiffix_tools.tables_builder import TablesBuilder
+from syndiffix_tools.tables_reader import TablesReader
+
+from helpers import *
+
+
+def test_aggregate_table():
+    df = get_generic_dataframe()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    counts = aggregate_table(table, ["str5"])
+    assert counts.set_index("str5")["count"].equals(df.groupby("str5").size().rename("count"))
+    sums = aggregate_table(table, ["int10"], bins={"int10": [1, 6, 10]}, sum_column="float")
+    assert list(sums["int10"]) == [1.0, 6.0]
+    assert sums["count"].sum() == len(df)
+    assert abs(sums["sum"].sum() - df["float"].sum()) < 1e-9
+
+
+def test_count_by(tmp_path):
+    df = get_generic_dataframe()
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(df, "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["int10", "str5"], save_stats="none", save_marginals=True)
+    tr = TablesReader(tmp_path / "syn")
+    df_syn = tr.get_best_syn_df(columns=["int10", "str5"])
+    counts = tr.count_by(["str5"])
+    assert counts.set_index("str5")["count"].equals(df_syn.groupby("str5").size().rename("count"))
+    assert tr.count_by(["str5"]) is counts
+    counts = tr.count_by(["int10", "str5"], bins={"int10": 2})
+    assert counts["count"].sum() == len(df_syn)
+    assert tr.count_by(["float"]) is None
+
+
+def test_count_by_compact_dtypes(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path, compact_dtypes=True)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["int10", "str5"], save_stats="none", save_marginals=True)
+    # The precomputed marginals and the computed counts are the same
+    from_marginals = TablesReader(tmp_path / "syn").count_by(["str5"])
+    for marginals_path in (tmp_path / "marginals").iterdir():
+        marginals_path.unlink()
+    computed = TablesReader(tmp_path / "syn").count_by(["str5"])
+    assert from_marginals["str5"].dtype == object
+    assert list(from_marginals["str5"]) == sorted(from_marginals["str5"])
+    assert from_marginals.equals(computed)
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from syndiffix_tools.background_writer import BackgroundWriteError, BackgroundWriter
+from syndiffix_tools import tables_builder
+from syndiffix_tools.tables_builder import TablesBuilder
+from syndiffix_tools.tables_reader import TablesReader
+
+from helpers import *
+
+
+def test_background_writer():
+    writer = BackgroundWriter(max_pending=1)
+    gate = threading.Event()
+    done = []
+    writer.submit(gate.wait)
+    writer.submit(done.append, 1)
+    # The queue is full, so this submit blocks until the first task finishes
+    thread = threading.Thread(target=writer.submit, args=(done.append, 2))
+    thread.start()
+    thread.join(timeout=0.1)
+    assert thread.is_alive()
+    gate.set()
+    thread.join()
+    writer.flush()
+    assert done == [1, 2]
+    # Errors name their task and are raised by the next flush, not by submit
+    writer.submit(lambda: 1 / 0, task_name="a")
+    writer.submit(lambda: 1 / 0, task_name="b")
+    writer.wait()
+    writer.submit(done.append, 3)
+    with pytest.raises(BackgroundWriteError, match="of a failed") as exc_info:
+        writer.flush()
+    assert isinstance(exc_info.value.__cause__, ZeroDivisionError)
+    assert done == [1, 2, 3]
+    assert writer.take_error("b").task_name == "b"
+    writer.flush()
+    writer.close()
+
+
+def test_background_writes(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path, write_queue_size=2)
+    tb.put_df_orig(get_generic_dataframe(), "test_file", also_make_csv=True)
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10"], save_stats="max")
+    tb.synthesize(columns=["int10", "str5"], save_marginals=True)
+    # A table that is still being written is not synthesized again
+    tb.synthesize(columns=["int10", "str5"])
+    tb.flush()
+    assert (tmp_path / "test_file.csv").exists()
+    assert len(list((tmp_path / "stats").iterdir())) == 2
+    tr = TablesReader(tmp_path / "syn")
+    assert len(tr.catalog) == 2
+    assert list(tr.get_best_syn_df(columns=["str5"]).columns) == ["int10", "str5"]
+
+
+def test_background_write_errors(tmp_path, monkeypatch):
+    tb = TablesBuilder(dir_path=tmp_path, write_queue_size=2)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    put_pq_from_df = tables_builder.put_pq_from_df
+
+    def failing_put_pq_from_df(path, df, **kwargs):
+        if list(df.columns) == ["float", "int10"]:
+            raise OSError("disk full")
+        put_pq_from_df(path, df, **kwargs)
+
+    monkeypatch.setattr(tables_builder, "put_pq_from_df", failing_put_pq_from_df)
+    jobs = [{"columns": ["float", "int10"]}, {"columns": ["int10", "str5"]}]
+    results = tb.synthesize_jobs(jobs, isolated=False)
+    # The failed write is blamed on its own job, not on the next one
+    assert [result["status"] for result in results] == ["error", "ok"]
+    assert "disk full" in results[0]["error"]
+    assert len(tb.get_failures()) == 1
+    assert len(list((tmp_path / "syn").glob("*.parquet"))) == 1
+    # The failed table is not left pending, so a retry writes it
+    monkeypatch.setattr(tables_builder, "put_pq_from_df", put_pq_from_df)
+    results = tb.synthesize_jobs(jobs[:1], isolated=False)
+    assert results[0]["status"] == "ok"
+    assert len(list((tmp_path / "syn").glob("*.parquet"))) == 2
+    assert tb.get_failures() == []
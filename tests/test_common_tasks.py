@@ -32,3 +32,28 @@ def test_make_data_file_name():
         make_data_file_name("table1", ["col" + str(i) for i in range(40)])
         == "sdx.table1.col40..cdesig"
     )
+
+
+def test_put_pq_from_df_profiles(tmp_path):
+    import pyarrow.parquet as pq
+
+    from helpers import get_generic_dataframe
+
+    df = get_generic_dataframe()
+    for profile in PQ_WRITE_PROFILES:
+        file_path = tmp_path / f"{profile}.parquet"
+        put_pq_from_df(file_path, df, profile=profile, dictionary_columns=["str5"])
+        assert get_df_from_pq(file_path).equals(df)
+    column_meta = pq.ParquetFile(tmp_path / "small.parquet").metadata.row_group(0).column(0)
+    assert column_meta.compression == "ZSTD"
+    # String columns keep pyarrow's default dictionary encoding, other columns
+    # only get it if listed
+    put_pq_from_df(tmp_path / "small.parquet", df, profile="small", dictionary_columns=[])
+    row_group = pq.ParquetFile(tmp_path / "small.parquet").metadata.row_group(0)
+    encodings = {row_group.column(i).path_in_schema: row_group.column(i).encodings for i in range(row_group.num_columns)}
+    assert "RLE_DICTIONARY" in encodings["str5"]
+    assert "RLE_DICTIONARY" not in encodings["float"]
+    # filters prune on the row group statistics
+    df_filtered = get_df_from_pq(tmp_path / "fast-read.parquet", columns=["int10"], filters=[("int10", ">", 5)])
+    assert list(df_filtered.columns) == ["int10"]
+    assert (df_filtered["int10"] > 5).all()
@@ -0,0 +1,26 @@
+import time
+
+from syndiffix_tools.isolated import run_isolated
+
+
+def allocate(num_bytes):
+    return bytearray(num_bytes)
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+def test_run_isolated():
+    assert run_isolated(allocate, {"num_bytes": 10**6}, max_memory_bytes=10**9)["status"] == "ok"
+    # The limit is on top of the address space the child inherits, which is
+    # more than 10**7 bytes with numpy and pandas loaded
+    assert run_isolated(allocate, {"num_bytes": 10**6}, max_memory_bytes=10**7)["status"] == "ok"
+    result = run_isolated(allocate, {"num_bytes": 10**9}, max_memory_bytes=10**8)
+    assert result["status"] == "out_of_memory"
+    result = run_isolated(sleep, {"seconds": 10}, timeout=0.2)
+    assert result["status"] == "timeout"
+    assert result["elapsed_time"] < 5
+    result = run_isolated(allocate, {"num_bytes": "many"})
+    assert result["status"] == "error"
+    assert "TypeError" in result["error"]
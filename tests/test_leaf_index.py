@@ -0,0 +1,57 @@
+import pytest
+from syndiffix import Synthesizer
+
+from syndiffix_tools.leaf_index import LeafIndex
+
+from helpers import *
+
+
+def test_leaf_index():
+    df = get_generic_dataframe()
+    syn = Synthesizer(df[["str5", "datetime", "int10"]])
+    syn.sample()
+    li = LeafIndex(syn)
+    found = li.leaves_containing(df, combinations=[["str5", "int10"]])
+    # Each original row is in exactly one leaf of the tree
+    assert sorted(found["row"]) == list(df.index)
+    for _, row in found.iterrows():
+        leaf = li.leaves[row["combination"]][li.node_ids[row["combination"]].index(row["node_id"])]
+        assert row["row"] in leaf.rows
+    assert len(li.leaves_containing(pd.DataFrame({"str5": ["zzz"]}))) == 0
+    found = li.leaves_intersecting({"int10": (3, 5)})
+    assert len(found) > 0
+    for _, row in found.iterrows():
+        ni = li.get_leaf_info(row["combination"], row["node_id"])
+        assert ni["columns"] == ["int10"]
+
+    # Bounds of other types than the original data are converted
+    assert li.leaves_intersecting({"int10": (2.5, 5)}).equals(li.leaves_intersecting({"int10": (3, 5)}))
+    assert len(li.leaves_intersecting({"datetime": ("2005-01-01", "2006-01-01")})) > 0
+    with pytest.raises(ValueError):
+        li.leaves_intersecting({"int10": ("a", 5)})
+
+
+def test_leaf_index_float():
+    df = get_generic_dataframe()
+    syn = Synthesizer(df[["float", "int10"]])
+    syn.sample()
+    li = LeafIndex(syn)
+    assert li.leaves_intersecting({"float": (0, 1)}).equals(li.leaves_intersecting({"float": (0.0, 1.0)}))
+    assert len(li.leaves_containing(pd.DataFrame({"float": [0], "int10": [3.0]}))) > 0
+
+
+def test_leaf_index_bulk():
+    df = get_generic_dataframe_big()[["str5", "int10", "float", "datetime"]]
+    syn = Synthesizer(df)
+    syn.sample()
+    li = LeafIndex(syn)
+    found = li.leaves_containing(df)
+    # The tree descent finds the same leaves as testing every leaf
+    for comb in li.leaves:
+        columns = [syn.forest.columns[i] for i in comb]
+        points = np.column_stack([li.convert_values(col, df[col]) for col in columns])[:, np.newaxis, :]
+        mins, maxs = li.mins[comb], li.maxs[comb]
+        point_index, leaf_index = np.nonzero(((points == mins) | ((points > mins) & (points < maxs))).all(axis=2))
+        in_comb = found[found["combination"] == comb]
+        assert list(in_comb["row"]) == list(df.index[point_index])
+        assert list(in_comb["node_id"]) == [li.node_ids[comb][i] for i in leaf_index]
@@ -0,0 +1,60 @@
+from syndiffix_tools.manifest import Manifest
+from syndiffix_tools.storage_manager import StorageManager
+from syndiffix_tools.tables_builder import TablesBuilder
+from syndiffix_tools.tables_manager import TablesManager
+from syndiffix_tools.tables_reader import TablesReader
+
+from helpers import *
+
+
+def test_manifest(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path, use_manifest=True)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10"], save_stats="max")
+    tb.synthesize(columns=["int10", "str5"], target_column="str5", save_stats="none")
+    tb.synthesize(columns=["float", "int10", "str5"], save_stats="min")
+    # No sidecar or stats files
+    assert list((tmp_path / "syn").glob("*.json")) == []
+    assert list((tmp_path / "stats").iterdir()) == []
+    manifest = Manifest(tmp_path)
+    assert len(manifest.query()) == 3
+    assert [meta_data["columns"] for meta_data in manifest.query(columns=["int10"], target="str5")] == [
+        ["int10", "str5"]
+    ]
+    assert [len(meta_data["columns"]) for meta_data in manifest.query(columns=["int10", "float"])] == [2, 3]
+    assert len(manifest.query(columns=["float", "int10"], exact_columns=True)) == 1
+    assert manifest.query(min_elapsed_time=3600.0) == []
+    assert len(manifest.query(max_cluster_size=3)) == 3
+    name = manifest.query(columns=["float", "int10"], exact_columns=True)[0]["name"]
+    assert manifest.get_stats(name)["forest_nodes"] is not None
+    assert manifest.get_stats(manifest.query(target="str5")[0]["name"]) is None
+    # Synthesizing again is skipped
+    tb.synthesize(columns=["float", "int10"])
+    assert len(manifest.query()) == 3
+    tr = TablesReader(tmp_path / "syn")
+    assert len(tr.catalog) == 3
+    assert list(tr.get_best_syn_df(columns=["float"]).columns) == ["float", "int10"]
+    assert list(tr.get_best_syn_df(columns=["int10"], target="str5").columns) == ["int10", "str5"]
+    tm = TablesManager(dir_path=tmp_path)
+    assert tm.syn_file_exists(columns=["int10", "str5"], target_column="str5")
+    assert list(tm.get_best_syn_df(columns=["float", "str5"]).columns) == ["float", "int10", "str5"]
+    assert tb.get_stale_tables() == []
+    # Deleted tables leave the manifest
+    StorageManager(tmp_path).delete_table(name)
+    assert len(manifest.query()) == 2
+    assert len(TablesReader(tmp_path / "syn").catalog) == 2
+
+
+def test_manifest_import(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10"])
+    tb.synthesize(columns=["int10", "str5"], save_stats="none")
+    manifest = Manifest(tmp_path)
+    assert manifest.import_files(tmp_path / "syn", tmp_path / "stats", remove=True) == 2
+    assert list((tmp_path / "syn").glob("*.json")) == []
+    assert list((tmp_path / "stats").iterdir()) == []
+    assert manifest.get_stats(manifest.query(columns=["float"])[0]["name"])["cluster_info"] is not None
+    assert len(TablesReader(tmp_path / "syn").catalog) == 2
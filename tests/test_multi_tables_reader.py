@@ -0,0 +1,51 @@
+import pandas as pd
+
+from syndiffix_tools.frame_cache import FrameCache
+from syndiffix_tools.multi_tables_reader import MultiTablesReader
+from syndiffix_tools.tables_builder import TablesBuilder
+
+from helpers import *
+
+
+def test_frame_cache_eviction():
+    df = pd.DataFrame({"a": range(100)})
+    size = int(df.memory_usage(deep=True).sum())
+    fc = FrameCache(max_bytes=2 * size)
+    fc.put("x", df)
+    fc.put("y", df)
+    assert fc.get("x") is df
+    # "y" is now the least recently used
+    fc.put("z", df)
+    assert "y" not in fc
+    assert "x" in fc and "z" in fc
+    assert fc.num_bytes == 2 * size
+    fc.put("big", pd.concat([df, df, df]))
+    assert "big" not in fc
+
+
+def test_multi_tables_reader(tmp_path):
+    df = get_generic_dataframe()
+    for dataset in ["ds1", "ds2"]:
+        (tmp_path / dataset).mkdir()
+        tb = TablesBuilder(dir_path=tmp_path / dataset)
+        tb.put_df_orig(df, dataset)
+        tb.set_pid_cols(["pid"])
+        tb.synthesize(columns=["int10", "str5"], save_stats="none")
+    tb.synthesize(columns=["float", "int10", "str5"], save_stats="none")
+    (tmp_path / "not_a_dataset").mkdir()
+    mtr = MultiTablesReader(tmp_path, max_cache_bytes=10**6)
+    assert mtr.get_datasets() == ["ds1", "ds2"]
+    df_syn = mtr.get_best_syn_df("ds2", columns=["str5"])
+    assert list(df_syn.columns) == ["int10", "str5"]
+    assert len(mtr.frame_cache) == 1
+    assert mtr.get_best_syn_df("ds2", columns=["str5"]) is df_syn
+    assert mtr.get_best_syn_df("ds1", columns=["float"]) is None
+    # One index over all datasets, with the smallest covering table first
+    assert len(mtr.catalog) == 3
+    assert [entry["dataset"] for entry in mtr.index[("ds2", "int10")]] == ["ds2", "ds2"]
+    assert mtr.get_best_entry("ds2", columns=["float"])["columns"] == ["float", "int10", "str5"]
+    assert mtr.get_best_entry("ds2")["columns"] == ["float", "int10", "str5"]
+    # Readers for a dataset share the catalog entries and the memory budget
+    tr = mtr.get_reader("ds2")
+    assert tr.get_best_syn_df(columns=["str5"]) is df_syn
+    assert len(tr.count_by(["str5"])) == 5
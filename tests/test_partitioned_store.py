@@ -0,0 +1,117 @@
+import pytest
+
+from syndiffix_tools.partitioned_store import PartitionedStore
+from syndiffix_tools.quality_evaluator import QualityEvaluator
+from syndiffix_tools.storage_manager import StorageManager
+from syndiffix_tools.tables_builder import TablesBuilder
+from syndiffix_tools.tables_manager import TablesManager
+from syndiffix_tools.tables_reader import TablesReader
+
+from helpers import *
+
+
+def test_partitioned_store(tmp_path):
+    store = PartitionedStore(tmp_path)
+    df = get_generic_dataframe()[["float", "str5"]]
+    store.put_table("a", df, {"columns": ["float", "str5"]})
+    store.put_table("b", df, {"columns": ["float", "str5"], "rows": 1})
+    assert sorted(store.get_manifest()) == ["a", "b"]
+    assert store.get_df("a").equals(df)
+    assert store.get_df("c") is None
+    # A rewrite replaces the table's metadata, also for other readers
+    other_store = PartitionedStore(tmp_path)
+    store.put_table("a", df, {"columns": ["float", "str5"], "rows": 2})
+    assert other_store.get_manifest()["a"]["rows"] == 2
+    assert len(other_store.get_manifest()) == 2
+    # Tables whose metadata is kept elsewhere are only located
+    store.put_table("c", df.head(10), None)
+    store.put_stats("c", {"x": 1})
+    assert "c" not in store.get_manifest() and store.exists("c")
+    assert len(store.get_df("c")) == 10
+    # All tables are in one pack
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["lock", "manifest.jsonl", "pack-00000.parquets",
+                                                              "stats.jsonl"]
+    # Compaction drops the dead bytes of the rewritten and removed tables
+    store.remove_table("b")
+    assert not other_store.exists("b")
+    freed = store.compact()
+    assert freed > 0
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["lock", "manifest.jsonl", "pack-00001.parquets",
+                                                              "stats.jsonl"]
+    assert len((tmp_path / "manifest.jsonl").read_text().splitlines()) == 2
+    assert other_store.get_manifest()["a"]["rows"] == 2
+    assert other_store.get_df("a").equals(df)
+    assert store.get_stats() == {"c": {"x": 1, "name": "c"}}
+    assert store.compact() == 0
+    # A new pack is started at max_pack_bytes
+    small_store = PartitionedStore(tmp_path / "small", max_pack_bytes=1)
+    for name in ["a", "b", "c"]:
+        small_store.put_table(name, df, {"columns": ["float", "str5"]})
+    assert len(list((tmp_path / "small").glob("*.parquets"))) == 3
+    assert small_store.get_df("b").equals(df)
+
+
+def test_partitioned_store_concurrent_compact(tmp_path):
+    import threading
+
+    df = get_generic_dataframe()[["float", "str5"]]
+    store = PartitionedStore(tmp_path)
+    store.put_table("a", df, {"columns": ["float", "str5"]})
+    names = [f"t{i}" for i in range(30)]
+
+    def write():
+        # Another instance, like a builder in another process
+        writer = PartitionedStore(tmp_path)
+        for name in names:
+            writer.put_table(name, df.head(10), {"columns": ["float", "str5"]})
+            writer.put_table("a", df, {"columns": ["float", "str5"]})
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    while thread.is_alive():
+        store.compact()
+    thread.join()
+    # No table written during a compaction is lost
+    assert sorted(store.get_locations()) == sorted(names + ["a"])
+    assert all(len(store.get_df(name)) == 10 for name in names)
+
+
+def test_partitioned_tables(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path, partitioned=True)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10"], save_stats="min")
+    tb.synthesize(columns=["int10", "str5"], save_marginals=True)
+    # Tables from both storages are found
+    TablesBuilder(dir_path=tmp_path).synthesize(columns=["float", "int10", "str5"], save_stats="none")
+    assert len(list((tmp_path / "syn").glob("*.parquet"))) == 1
+    assert len(list((tmp_path / "syn").glob("*.json"))) == 1
+    assert list((tmp_path / "stats").iterdir()) == []
+    assert (tmp_path / "syn" / "partitioned" / "stats.jsonl").exists()
+    tr = TablesReader(tmp_path / "syn")
+    assert len(tr.catalog) == 3
+    assert list(tr.get_best_syn_df(columns=["int10"]).columns) == ["float", "int10"]
+    assert list(tr.get_best_syn_df(columns=["str5"]).columns) == ["int10", "str5"]
+    assert list(tr.get_best_syn_df(columns=["float", "str5"]).columns) == ["float", "int10", "str5"]
+    assert tr.count_by(["str5"])["count"].sum() == len(tr.get_best_syn_df(columns=["str5"]))
+    tm = TablesManager(dir_path=tmp_path)
+    assert tm.syn_file_exists(columns=["float", "int10"])
+    assert tm.get_syn_df(columns=["float", "int10"]).equals(tr.get_best_syn_df(columns=["int10"]))
+    assert list(tm.get_best_syn_df(columns=["str5"]).columns) == ["int10", "str5"]
+    assert tb.get_stale_tables() == []
+    with pytest.raises(ValueError):
+        tb.synthesize(columns=["float"], replicates=2)
+    # Quality scores and storage cover the partitioned tables
+    qualities = QualityEvaluator(tmp_path).evaluate_all()
+    assert len(qualities) == 3
+    assert all("quality" in meta_data for meta_data in tb.partitioned_store.get_manifest().values())
+    sm = StorageManager(tmp_path)
+    tables = {table["name"]: table for table in sm.get_tables()}
+    assert sorted(table["partitioned"] for table in tables.values()) == [False, True, True]
+    report = sm.report()
+    assert report["partitioned_overhead_bytes"] > 0
+    partitioned_names = [name for name, table in tables.items() if table["partitioned"]]
+    assert sm.delete_table(partitioned_names[0]) > 0
+    assert not tb.partitioned_store.exists(partitioned_names[0])
+    assert len(TablesReader(tmp_path / "syn").catalog) == 2
+    assert sm.report()["syn_num_bytes"] < report["syn_num_bytes"]
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from syndiffix_tools.quality_evaluator import QualityEvaluator
+from syndiffix_tools.tables_builder import TablesBuilder
+
+from helpers import *
+
+
+def test_quality_evaluator(tmp_path):
+    df = get_generic_dataframe()
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(df, "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10", "str5"], save_stats="none")
+    qe = QualityEvaluator(tmp_path)
+    # The original scores perfectly against itself
+    quality = qe.evaluate_df(df.drop(columns=["pid"]))
+    assert quality["marginal_1dim_error"] == 0.0
+    assert quality["marginal_2dim_error"] == 0.0
+    qualities = qe.evaluate_all()
+    assert len(qualities) == 1
+    quality = list(qualities.values())[0]
+    assert 0.0 < quality["marginal_1dim_error"] < 1.0
+    assert quality["correlation_delta"] is None
+    # The scores are cached in the table's metadata
+    meta_data_path = (tmp_path / "syn" / list(qualities.keys())[0]).with_suffix(".json")
+    with meta_data_path.open("r") as file:
+        assert json.load(file)["quality"] == quality
+    # An evaluator of some columns scores the same as a full one on them
+    qe_columns = QualityEvaluator(tmp_path, columns=["float", "str5"])
+    df_syn = df[["float", "str5"]].sample(frac=0.5, random_state=0)
+    assert sorted(qe_columns.codebooks) == ["float", "str5"]
+    assert qe_columns.evaluate_df(df_syn) == qe.evaluate_df(df_syn)
+
+
+def test_quality_evaluator_manifest(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path, use_manifest=True)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10"], save_stats="min")
+    tb.flush()
+    qualities = QualityEvaluator(tmp_path).evaluate_all()
+    name = list(qualities.keys())[0].removesuffix(".parquet")
+    # Cached in the table's manifest row, which keeps its stats
+    assert tb.manifest.get_table(name)["quality"] == qualities[name + ".parquet"]
+    assert tb.manifest.get_stats(name) is not None
+
+
+def test_quality_evaluator_cache(tmp_path):
+    from syndiffix_tools.quality_evaluator import _sparse_total_variation, _total_variation
+
+    # The sparse distance equals the dense one
+    dense_orig, dense_syn = np.array([3, 0, 1, 4]), np.array([0, 2, 1, 1])
+    sparse_orig = (np.array([0, 2, 3]), np.array([3, 1, 4]))
+    sparse_syn = (np.array([1, 2, 3]), np.array([2, 1, 1]))
+    assert _sparse_total_variation(sparse_orig, sparse_syn) == pytest.approx(_total_variation(dense_orig, dense_syn))
+    df = get_generic_dataframe()
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(df, "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10", "str5"], save_stats="none")
+    quality = list(QualityEvaluator(tmp_path).evaluate_all().values())[0]
+    assert quality["columns"] == ["float", "int10", "str5"]
+    # Scores of fewer columns replace the cached ones, and are replaced back
+    quality_columns = list(QualityEvaluator(tmp_path, columns=["float", "str5"]).evaluate_all().values())[0]
+    assert quality_columns["columns"] == ["float", "str5"]
+    assert list(QualityEvaluator(tmp_path).evaluate_all().values())[0] == quality
+    # A replaced original invalidates the scores
+    df_updated = df.copy()
+    df_updated["str5"] = df_updated["str5"].iloc[::-1].to_numpy()
+    tb.update_df_orig(df_updated)
+    quality_updated = list(QualityEvaluator(tmp_path).evaluate_all().values())[0]
+    assert quality_updated["orig_fingerprint"] != quality["orig_fingerprint"]
@@ -0,0 +1,118 @@
+import json
+
+from syndiffix_tools.storage_manager import StorageManager
+from syndiffix_tools.tables_builder import TablesBuilder
+from syndiffix_tools.tables_reader import TablesReader
+
+from helpers import *
+
+
+def test_storage_manager(tmp_path):
+    df = get_generic_dataframe()
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(df, "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10"], save_stats="min")
+    tb.synthesize(columns=["float", "int10", "str5"], save_stats="min")
+    tr = TablesReader(tmp_path / "syn", access_log=True)
+    tr.get_best_syn_df(columns=["float"])
+    tr.get_best_syn_df(columns=["float", "int10"])
+    sm = StorageManager(tmp_path)
+    report = sm.report()
+    assert len(report["tables"]) == 2
+    assert report["syn_num_bytes"] > 0 and report["stats_num_bytes"] > 0
+    # The wider table covers both requests but is never the best match
+    redundant = sm.find_redundant_tables()
+    assert len(redundant) == 1
+    assert sm.find_redundant_tables(requests=[(["str5"], None)]) == []
+    # A dry run deletes nothing
+    deleted = sm.enforce_budget(0, dry_run=True)
+    assert [kind for kind, _, _ in deleted] == ["stats", "stats", "table", "table"]
+    assert deleted[2][1] == redundant[0]
+    assert sm.report() == report
+    # Dropping the stats is enough to fit this budget
+    deleted = sm.enforce_budget(report["syn_num_bytes"])
+    assert [kind for kind, _, _ in deleted] == ["stats", "stats"]
+    assert sm.report()["stats_num_bytes"] == 0
+    deleted = sm.enforce_budget(report["syn_num_bytes"] - 1)
+    assert deleted == [("table", redundant[0], deleted[0][2])]
+    tr = TablesReader(tmp_path / "syn")
+    assert len(tr.catalog) == 1
+    assert sm.delete_table(sm.get_tables()[0]["name"]) > 0
+    assert sm.report()["syn_num_bytes"] == 0
+
+
+def test_storage_manager_housekeeping(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10"], save_stats="min")
+    tr = TablesReader(tmp_path / "syn", access_log=True)
+    for _ in range(5):
+        tr.get_best_syn_df(columns=["float"])
+        tr.get_best_syn_df(columns=["str5"])
+    sm = StorageManager(tmp_path, max_access_log_bytes=0)
+    last_access = sm.get_tables()[0]["last_access"]
+    # Repeated requests are compacted into one line each
+    assert sm.compact_access_log() > 0
+    accesses = [json.loads(line) for line in (tmp_path / "access_log.jsonl").read_text().splitlines()]
+    assert sorted(access["count"] for access in accesses) == [5, 5]
+    assert sm.get_tables()[0]["last_access"] == last_access
+    assert sm.compact_access_log(max_age=-1.0) > 0
+    assert (tmp_path / "access_log.jsonl").read_text() == ""
+    # Stats without a table are deleted first
+    orphan_path = tmp_path / "stats" / "stats_no_such_table.json"
+    orphan_path.write_text("{}")
+    report = sm.report()
+    assert report["orphan_stats_num_bytes"] == 2
+    deleted = sm.enforce_budget(report["syn_num_bytes"] + report["stats_num_bytes"] - 1)
+    assert deleted == [("orphan_stats", orphan_path.name, 2)]
+    assert not orphan_path.exists()
+
+
+def test_storage_manager_manifest(tmp_path):
+    df = get_generic_dataframe()
+    tb = TablesBuilder(dir_path=tmp_path, use_manifest=True, partitioned=True)
+    tb.put_df_orig(df, "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "int10"], save_stats="min")
+    tb.synthesize(columns=["float", "int10", "str5"], save_stats="min")
+    tb.flush()
+    sm = StorageManager(tmp_path)
+    report = sm.report()
+    # The stats are in the manifest rows
+    assert len(report["tables"]) == 2
+    assert all(table["stats_num_bytes"] > 0 for table in report["tables"])
+    assert report["stats_num_bytes"] == sum(table["stats_num_bytes"] for table in report["tables"])
+    deleted = sm.enforce_budget(report["syn_num_bytes"] + report["partitioned_overhead_bytes"])
+    assert [kind for kind, _, _ in deleted] == ["stats", "stats"]
+    assert sm.report()["stats_num_bytes"] == 0
+    assert all(sm.manifest.get_stats(table["name"]) is None for table in report["tables"])
+    assert len(sm.manifest.query()) == 2
+
+
+def test_storage_manager_concurrent_writes(tmp_path):
+    import threading
+
+    df = get_generic_dataframe()
+    tb = TablesBuilder(dir_path=tmp_path, partitioned=True)
+    tb.put_df_orig(df, "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float"], save_stats="min")
+    tb.flush()
+    sm = StorageManager(tmp_path)
+    name = sm.get_tables()[0]["name"]
+    columns = [["int10"], ["str5"], ["float", "int10"], ["float", "str5"], ["int10", "str5"]]
+
+    def build():
+        for cols in columns:
+            tb.synthesize(columns=cols, save_stats="min")
+        tb.flush()
+
+    thread = threading.Thread(target=build)
+    thread.start()
+    # Deleting compacts the store while the builder writes to it
+    sm.delete_table(name)
+    thread.join()
+    assert len(sm.get_tables()) == len(columns)
+    assert len(TablesReader(tmp_path / "syn").catalog) == len(columns)
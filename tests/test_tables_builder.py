@@ -50,4 +50,78 @@ def test_set_pid_cols():
     tb.set_pid_cols([])
     assert tb.orig_meta_data["pid_cols"] == []
     tb.set_pid_cols(["pid"])
-    assert tb.orig_meta_data["pid_cols"] == ["pid"]
\ No newline at end of file
+    assert tb.orig_meta_data["pid_cols"] == ["pid"]
+
+def test_compact_dtypes():
+    # must run after test_input_new_df_orig
+    test_path = Path("tests/test_dir")
+    tb = TablesBuilder(dir_path=test_path, compact_dtypes=True)
+    assert str(tb.df_orig["str5"].dtype) == "category"
+    assert str(tb.df_orig["int10"].dtype) == "int8"
+    df = get_df_from_pq(Path(test_path, "test_file.parquet"))
+    assert restore_df_dtypes(tb.df_orig, tb.orig_meta_data["column_dtypes"]).equals(df)
+    assert tb.df_orig.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
+    columns = ["int10", "str5"]
+    tb.synthesize(columns=columns, save_stats="none")
+    df_syn = get_df_from_pq(Path(test_path, "syn", make_data_file_name(tb.orig_file_name, columns) + ".parquet"))
+    assert str(df_syn["str5"].dtype) == "category"
+
+
+def test_update_df_orig(tmp_path):
+    df = get_generic_dataframe()
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(df, "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["int10", "str5"], save_stats="none")
+    tb.synthesize(columns=["float", "str5"], save_stats="none")
+    assert tb.get_stale_tables() == []
+    df_new = df.copy()
+    df_new["float"] = df_new["float"] + 1.0
+    assert tb.update_df_orig(df_new) == ["float"]
+    assert tb.df_orig.equals(df_new)
+    stale_tables = tb.get_stale_tables()
+    assert [meta_data["columns"] for meta_data in stale_tables] == [["float", "str5"]]
+    assert len(tb.rebuild_stale_tables(save_stats="none")) == 1
+    assert tb.get_stale_tables() == []
+    assert TablesBuilder(dir_path=tmp_path).get_stale_tables() == []
+
+
+def test_replicates(tmp_path):
+    from syndiffix_tools.tables_reader import TablesReader
+
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["float", "str5"], save_stats="none", replicates=3)
+    tb.synthesize(columns=["int10", "str5"], save_stats="none")
+    tr = TablesReader(tmp_path / "syn")
+    df_all = tr.get_best_syn_replicates(columns=["str5"])
+    assert sorted(df_all["replicate"].unique()) == [0, 1, 2]
+    assert list(df_all.columns) == ["float", "str5", "replicate"]
+    df_first = tr.get_best_syn_replicates(columns=["str5"], replicate=0)
+    assert df_first.equals(tr.get_best_syn_df(columns=["float", "str5"]))
+    df_second = tr.get_best_syn_replicates(columns=["str5"], replicate=1)
+    assert not df_second.equals(df_first)
+    assert tr.get_best_syn_replicates(columns=["int10"]) is None
+
+
+def test_preview(tmp_path):
+    from syndiffix_tools.preview import sample_by_pid
+
+    df = get_generic_dataframe()
+    df_sample = sample_by_pid(df, ["pid"], 0.5)
+    # Sampled entities keep all of their rows
+    assert df_sample["pid"].value_counts().equals(df[df["pid"].isin(df_sample["pid"])]["pid"].value_counts())
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(df, "test_file")
+    tb.set_pid_cols(["pid"])
+    results = tb.synthesize(columns=["float", "int10", "str5"], preview=[0.25, 0.5])
+    assert [sample["fraction"] for sample in results["samples"]] == [0.25, 0.5]
+    assert results["estimated_time"] > 0.0
+    assert results["estimated_memory_bytes"] > 0
+    assert results["samples"][0]["cluster_info"][0]["type"] == "initial"
+    assert 0.0 <= results["samples"][0]["quality"]["marginal_1dim_error"] <= 1.0
+    # Nothing is written to the real outputs
+    assert list((tmp_path / "syn").iterdir()) == []
+    assert list((tmp_path / "stats").iterdir()) == []
+    assert len(list((tmp_path / "preview").glob("*.json"))) == 1
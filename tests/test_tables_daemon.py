@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from syndiffix_tools.tables_builder import TablesBuilder
+from syndiffix_tools.tables_daemon import TablesClient, TablesDaemon
+from syndiffix_tools.tables_reader import TablesReader
+
+from helpers import *
+
+
+def test_tables_daemon(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["int10", "str5"], save_stats="none")
+    tr = TablesReader(tmp_path / "syn")
+    df_syn = tr.get_best_syn_df(columns=["str5"])
+    for shm_dir in [None, tmp_path / "shm"]:
+        daemon = TablesDaemon(tr, tmp_path / "daemon.sock", shm_dir=shm_dir)
+        daemon.start()
+        try:
+            client = TablesClient(tmp_path / "daemon.sock")
+            assert client.get_best_syn_df(columns=["str5"]).equals(df_syn)
+            assert client.get_best_syn_df(columns=["float"]) is None
+        finally:
+            daemon.shutdown()
+    assert not (tmp_path / "shm").exists()
+
+
+def test_tables_daemon_shm_files(tmp_path):
+    tb = TablesBuilder(dir_path=tmp_path)
+    tb.put_df_orig(get_generic_dataframe(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=["int10", "str5"], save_stats="none")
+    tb.synthesize(columns=["float"], save_stats="none")
+    shm_dir = tmp_path / "shm"
+    # Room for only one file
+    daemon = TablesDaemon(TablesReader(tmp_path / "syn"), tmp_path / "daemon.sock", max_cache_bytes=1,
+                          shm_dir=shm_dir)
+    daemon.start()
+    try:
+        client = TablesClient(tmp_path / "daemon.sock")
+        client.get_best_syn_df(columns=["str5"])
+        first_files = set(shm_dir.iterdir())
+        client.get_best_syn_df(columns=["float"])
+        assert len(list(shm_dir.iterdir())) == 1
+        assert set(shm_dir.iterdir()).isdisjoint(first_files)
+        # A rewritten table replaces its file
+        float_files = set(shm_dir.iterdir())
+        time.sleep(0.01)
+        tb.synthesize(columns=["float"], save_stats="none", force=True)
+        assert client.get_best_syn_df(columns=["float"]) is not None
+        assert len(list(shm_dir.iterdir())) == 1
+        assert set(shm_dir.iterdir()).isdisjoint(float_files)
+        # Concurrent requests evict each other's files, which stay readable
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            dfs = list(executor.map(lambda cols: client.get_best_syn_df(columns=cols), [["str5"], ["float"]] * 20))
+        assert all(df is not None and len(df) > 0 for df in dfs)
+    finally:
+        daemon.shutdown()
+    assert not shm_dir.exists()
+
@@ -50,4 +50,121 @@ def test_set_pid_cols():
     tm.set_pid_cols([])
     assert tm.orig_meta_data["pid_cols"] == []
     tm.set_pid_cols(["pid"])
-    assert tm.orig_meta_data["pid_cols"] == ["pid"]
\ No newline at end of file
+    assert tm.orig_meta_data["pid_cols"] == ["pid"]
+
+def test_cluster_plan():
+    # must run after test_input_new_df_orig
+    test_path = Path("tests/test_dir")
+    tm = TablesManager(dir_path=test_path)
+    columns = ["datetime", "float", "int10", "str5"]
+    tm.synthesize(columns=columns, save_stats="none", use_cluster_plan=True)
+    data_file_name = make_data_file_name(tm.orig_file_name, columns)
+    meta_data_path = Path(test_path, "syn", data_file_name + ".meta_data.json")
+    with meta_data_path.open("r") as file:
+        meta_data = json.load(file)
+    assert meta_data["used_cluster_plan"] is False
+    assert len(list(Path(test_path, "plans").iterdir())) == 1
+    # The second time, the stored plan is applied
+    tm.synthesize(columns=columns, save_stats="none", use_cluster_plan=True, force=True)
+    with meta_data_path.open("r") as file:
+        meta_data_planned = json.load(file)
+    assert meta_data_planned["used_cluster_plan"] is True
+    assert meta_data_planned["cluster_info"] == meta_data["cluster_info"]
+
+
+def test_orig_on_disk():
+    # must run after test_input_new_df_orig
+    test_path = Path("tests/test_dir")
+    tm = TablesManager(dir_path=test_path, orig_on_disk=True)
+    assert tm.df_orig is None
+    assert list(tm.get_df_orig(["str5", "pid"]).columns) == ["str5", "pid"]
+    tm.synthesize(columns=["int10", "str5"], save_stats="none", force=True)
+    assert tm.syn_file_exists(columns=["int10", "str5"])
+    assert tm.df_orig is None
+
+
+def test_synthesize_jobs(tmp_path, monkeypatch):
+    import time
+
+    tm = TablesManager(dir_path=tmp_path)
+    tm.put_df_orig(get_generic_dataframe_big(), "test_file")
+    tm.set_pid_cols(["pid"])
+    results = tm.synthesize_jobs(
+        [
+            {"columns": ["int10", "str5"], "save_stats": "none"},
+            {"columns": ["no_such_column"]},
+        ],
+        timeout=600,
+    )
+    assert [result["status"] for result in results] == ["ok", "error"]
+    assert tm.syn_file_exists(columns=["int10", "str5"])
+    # A job that is killed part way through writing its table
+    partial_path = Path(tm.syn_dir_path, make_data_file_name(tm.orig_file_name, ["float"]) + ".parquet.tmp")
+
+    def blocking_synthesize(**job):
+        partial_path.touch()
+        time.sleep(600)
+
+    monkeypatch.setattr(tm, "synthesize", blocking_synthesize)
+    results = tm.synthesize_jobs([{"columns": ["float"]}], timeout=0.5)
+    assert results[0]["status"] == "timeout"
+    assert not partial_path.exists()
+    monkeypatch.undo()
+    failures = tm.get_failures()
+    assert sorted(failure["status"] for failure in failures) == ["error", "timeout"]
+    # Failures are also recorded when not isolated
+    results = tm.synthesize_jobs([{"columns": ["no_such_column", "str5"]}], isolated=False)
+    assert results[0]["status"] == "error"
+    assert len(tm.get_failures()) == 3
+
+
+def test_on_demand(tmp_path, monkeypatch):
+    import threading
+
+    import pytest
+
+    tm = TablesManager(dir_path=tmp_path, on_demand_workers=1)
+    tm.put_df_orig(get_generic_dataframe(), "test_file")
+    tm.set_pid_cols(["pid"])
+    tm.synthesize(columns=["float", "int10"], save_stats="none")
+    assert tm.get_best_syn_df(columns=["float"]) is not None
+    # Hold the synthesis back, so that the requests below arrive while it runs
+    gate = threading.Event()
+    synthesize = tm.synthesize
+
+    def gated_synthesize(**kwargs):
+        gate.wait()
+        return synthesize(**kwargs)
+
+    monkeypatch.setattr(tm, "synthesize", gated_synthesize)
+    assert tm.get_best_syn_df(columns=["float", "str5"]) is None
+    futures = [tm.request_syn_df(columns=["str5", "float"]) for _ in range(3)]
+    assert all(future is futures[0] for future in futures)
+    assert tm.get_best_syn_df(columns=["float", "str5"], wait=0.01) is None
+    assert not futures[0].done()
+    gate.set()
+    df_syn = futures[0].result(timeout=60)
+    assert list(df_syn.columns) == ["float", "str5"]
+    # The new table is in the catalog without a rebuild
+    assert any(entry["columns"] == ["float", "str5"] for entry in tm.catalog)
+    assert tm.get_best_syn_df(columns=["str5"], wait=None).equals(df_syn)
+    assert tm.request_syn_df(columns=["float", "str5"]).result().equals(df_syn)
+    # A failure is raised by the future and recorded
+    with pytest.raises(TypeError):
+        tm.request_syn_df(columns=["str5", "int10"], no_such_argument=1).result(timeout=60)
+    assert len(tm.get_failures()) == 1
+    assert tm.get_best_syn_df(columns=["int10", "str5"], wait=None) is not None
+    assert tm.get_failures() == []
+    # pid columns are never in a synthetic table
+    with pytest.raises(ValueError):
+        tm.get_best_syn_df(columns=["pid", "str5"], wait=None)
+    with pytest.raises(ValueError):
+        tm.request_syn_df(columns=["pid", "str5"])
+    # An isolated job is forked only once the on-demand syntheses are done
+    gate.clear()
+    future = tm.request_syn_df(columns=["datetime", "str5"])
+    threading.Timer(0.5, gate.set).start()
+    results = tm.synthesize_jobs([{"columns": ["datetime", "float"], "save_stats": "none"}])
+    assert future.done()
+    assert results[0]["status"] == "ok"
+    tm.shutdown_on_demand()
@@ -0,0 +1,66 @@
+import json
+
+from syndiffix import Synthesizer
+
+from syndiffix_tools.cluster_info import ClusterInfo
+from syndiffix_tools.cluster_plans import PlannedClustering
+from syndiffix_tools.tables_builder import TablesBuilder
+from syndiffix_tools.time_budget import estimate_work, get_plan_widths, get_seconds_per_work, limit_cluster_size
+
+from helpers import *
+
+
+def test_limit_cluster_size():
+    df = get_generic_dataframe_big()[["str5", "int10", "float", "datetime", "str5a", "int10a", "floata"]]
+    plan = ClusterInfo(Synthesizer(df)).get_cluster_plan()
+    for max_size in [1, 2, 3]:
+        limited_plan = limit_cluster_size(plan, max_size)
+        assert max(get_plan_widths(limited_plan)) <= max_size
+        # The limited plan is valid and covers all columns
+        df_syn = Synthesizer(df, clustering=PlannedClustering(limited_plan)).sample()
+        assert sorted(df_syn.columns) == sorted(df.columns)
+
+
+def test_time_budget(tmp_path):
+    columns = ["str5", "int10", "float", "datetime", "str5a", "int10a", "floata"]
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    tb = TablesBuilder(dir_path=tmp_path / "a")
+    tb.put_df_orig(get_generic_dataframe_big(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=columns[:4], time_budget=3600.0)
+    tb.synthesize(columns=columns, save_stats="none", time_budget=0.0)
+    budgets = {}
+    for meta_data_path in (tmp_path / "a" / "syn").glob("*.json"):
+        with meta_data_path.open("r") as file:
+            meta_data = json.load(file)
+        budgets[len(meta_data["columns"])] = meta_data
+        assert 0.0 < meta_data["sampling_time"] <= meta_data["elapsed_time"]
+    assert budgets[4]["time_budget"]["degradations"] == []
+    assert budgets[4]["time_budget"]["rate_source"] == "calibrated"
+    assert budgets[4]["setup_time"] > 0.0
+    # The second synthesis uses the timing recorded by the first, which
+    # rules out measuring the clusters at all
+    assert budgets[7]["time_budget"]["rate_source"] == "recorded"
+    assert budgets[7]["time_budget"]["degradations"] == [{"type": "no_clustering"}]
+    assert all(len(cluster["cluster_id"]) == 1 for cluster in budgets[7]["cluster_info"])
+    assert "setup_time" not in budgets[7]
+    # Without recorded timings, the clusters are measured and then capped
+    tb = TablesBuilder(dir_path=tmp_path / "b")
+    tb.put_df_orig(get_generic_dataframe_big(), "test_file")
+    tb.set_pid_cols(["pid"])
+    tb.synthesize(columns=columns, save_stats="none", time_budget=0.0)
+    with next((tmp_path / "b" / "syn").glob("*.json")).open("r") as file:
+        budget = json.load(file)["time_budget"]
+    assert budget["rate_source"] == "calibrated"
+    assert budget["degradations"] == [{"type": "max_cluster_size", "value": 1}]
+    assert budget["estimated_time"] < budget["estimated_time_undegraded"]
+    assert not budget["fits_budget"]
+
+
+def test_seconds_per_work():
+    cluster_info = [{"cluster_id": ["a", "b"]}]
+    meta_data = {"rows": 10, "cluster_info": cluster_info, "elapsed_time": 5.0, "sampling_time": 3.0}
+    assert get_seconds_per_work([meta_data]) == 3.0 / estimate_work(10, [2])
+    # Without a sampling time, the setup cannot be told apart
+    assert get_seconds_per_work([{"rows": 10, "cluster_info": cluster_info, "elapsed_time": 5.0}]) is None
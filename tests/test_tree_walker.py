@@ -0,0 +1,31 @@
+from syndiffix import Synthesizer
+
+from syndiffix_tools.tree_walker import TreeWalker
+
+from helpers import *
+
+
+def test_filtered_forest_nodes():
+    df = get_generic_dataframe()
+    syn = Synthesizer(df[["str5", "datetime", "int10"]])
+    syn.sample()
+    tw = TreeWalker(syn)
+    forest = tw.get_forest_nodes()
+    leaves = tw.get_forest_nodes(node_type="leaf", over_threshold=True)
+    assert set(leaves) == {
+        node_id for node_id, ni in forest.items() if ni["node_type"] == "leaf" and ni["over_threshold"]
+    }
+    # A node can be over threshold below one that is not, so nothing is pruned
+    df_big = pd.concat([df] * 30, ignore_index=True)
+    df_big["pid"] = df_big.index
+    syn_big = Synthesizer(df_big[["str5", "int10", "float"]], pids=df_big[["pid"]])
+    syn_big.sample()
+    tw_big = TreeWalker(syn_big)
+    over = tw_big.get_forest_nodes(over_threshold=True)
+    assert set(over) == {node_id for node_id, ni in tw_big.get_forest_nodes().items() if ni["over_threshold"]}
+    assert all("depth" not in ni for ni in forest.values())
+    nodes = tw.get_forest_nodes(combinations=[["str5", "int10"]], max_depth=1, include_depth=True)
+    assert len(nodes) > 0
+    assert all(ni["columns"] == ["str5", "int10"] and ni["depth"] <= 1 for ni in nodes.values())
+    roots = tw.get_forest_nodes(max_depth=0)
+    assert len(roots) == len(syn.forest._tree_cache)